@@ -1,6 +1,7 @@
 from Strategies.strategy import Strategy
-import numpy as np
+from Strategies.indicators import SMA, rolling_mean
 import datetime
+import numpy as np
 from event import SignalEvent
 
 
@@ -19,7 +20,10 @@ class MovingAverageCrossStrategy(Strategy):
         self.short_window = short_window
         self.long_window = long_window
 
+        self.symbol_pos = dict((s, j) for j, s in enumerate(self.symbol_list))
         self.bought = self._calculate_initial_bought()
+        self.short_sma = self.register_indicator(SMA("adj_close", short_window))
+        self.long_sma = self.register_indicator(SMA("adj_close", long_window))
 
     def _calculate_initial_bought(self):
         """
@@ -33,22 +37,24 @@ class MovingAverageCrossStrategy(Strategy):
     def calculate_signals(self, event):
         """
         基于MAC SMA生成一组新的信号，进入市场的标志就是短期的移动平均超过
-        长期的移动平均。
+        长期的移动平均。只检查这一时刻有新数据的代码。
         """
         if event.type == 'MARKET':
-            for s in self.symbol_list:
-                bars = self.bars.get_latest_bars_values(
-                    s, "adj_close", N=self.long_window
-                )
+            prices = self.bars.get_history(
+                "adj_close", N=1, symbols=self.symbol_list
+            )[-1]
+            symbols = self.symbol_list if event.symbols is None else event.symbols
+            for s in symbols:
+                j = self.symbol_pos[s]
                 bar_date = self.bars.get_latest_bar_datetime(s)
-                if bars is not None and bars != []:
-                    short_sma = np.mean(bars[-self.short_window:])
-                    long_sma = np.mean(bars[-self.long_window:])
+                if self.short_sma.value is not None:
+                    short_sma = self.short_sma.value[j]
+                    long_sma = self.long_sma.value[j]
 
                     symbol = s
                     dt = datetime.datetime.utcnow()
                     sig_dir = ""
-                    order_price = self.bars.get_latest_bars_values(s, 'adj_close')
+                    order_price = prices[j]
                     if short_sma > long_sma and self.bought[s] == "OUT":
                         print("LONG: %s" % bar_date)
                         sig_dir = 'LONG'
@@ -61,3 +67,18 @@ class MovingAverageCrossStrategy(Strategy):
                         signal = SignalEvent(1, bar_date, symbol, dt, sig_dir, order_price, 1.0)
                         self.events.put(signal)
                         self.bought[s] = 'OUT'
+
+    def vectorized_signals(self, bar_store):
+        """
+        与calculate_signals相同的规则：短期均线高于长期均线时进入LONG，
+        低于长期均线时退出，相等或者没有数据时保持原来的状态
+        """
+        prices = bar_store.columns['adj_close']
+        short_sma = rolling_mean(prices, self.short_window)
+        long_sma = rolling_mean(prices, self.long_window)
+        code = np.where(short_sma > long_sma, 1, np.where(short_sma < long_sma, 0, -1))
+        # 把状态不变的时刻填充为最近一次确定的状态，初始状态为OUT
+        rows = np.arange(len(code))[:, None]
+        last = np.maximum.accumulate(np.where(code >= 0, rows, -1), axis=0)
+        state = np.take_along_axis(code, np.maximum(last, 0), axis=0)
+        return np.where(last >= 0, state, 0).astype(np.int8)
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+# indicators.py
+
+from __future__ import print_function
+
+from abc import ABCMeta, abstractmethod
+from collections import deque
+
+import numpy as np
+
+
+class Indicator(object, metaclass=ABCMeta):
+    """
+    Indicator是所有增量指标的抽象基类。指标注册到DataHandler之后，每发布一条
+    新的数据，都会用这条数据的截面（所有代码的最新值，见bar_store.Bar）在O(1)
+    时间内更新一次，而不是每次都对整个窗口重新计算。
+    value是一个长度等于代码数量的数组，lookback是指标需要的历史数据条数。
+    """
+    lookback = 1
+
+    def __init__(self):
+        self.value = None
+        self.count = 0
+
+    @property
+    def ready(self):
+        """
+        是否已经积累了足够的数据
+        """
+        return self.count >= self.lookback
+
+    @abstractmethod
+    def update(self, bar):
+        """
+        用最新的数据截面更新指标
+        """
+        raise NotImplementedError("Should implement update()")
+
+
+class SMA(Indicator):
+    """
+    简单移动平均。每个代码维护自己有效数据的累积和，并用环形缓冲保存最近window个
+    累积和，窗口的和就是两个累积和之差，每次只需一次加法和一次减法。
+    NaN表示这个代码在这一时刻没有数据，不占用窗口；数据不足一个窗口时返回已有
+    数据的平均值。累积和按数据的顺序逐个相加，与rolling_mean中的np.cumsum完全
+    相同，所以两者的结果逐位相等：数据不足一个长期窗口时，长短两条均线在理论上
+    相等的时刻也严格相等，不会因为舍入误差产生信号。
+    """
+
+    def __init__(self, field, window):
+        super(SMA, self).__init__()
+        self.field = field
+        self.window = window
+        self.lookback = window
+        self._buffer = None
+
+    def _init_state(self, n):
+        # 第k条有效数据和第k个累积和都保存在第k % window行
+        self._buffer = np.full((self.window, n), np.nan)
+        self._csums = np.zeros((self.window, n))
+        self._csum = np.zeros(n)
+        self._k = np.zeros(n, dtype=np.int64)
+        self._sum = np.zeros(n)
+        self._n = np.zeros(n, dtype=np.int64)
+
+    def _roll(self, x):
+        """
+        把有数据的代码的新值放入各自的环形缓冲，更新累积和、窗口的和以及有效数据
+        的个数，返回(代码下标, 新值, 移出窗口的旧值)，没有移出的数据时旧值为NaN
+        """
+        if self._buffer is None:
+            self._init_state(len(x))
+        self.count += 1
+        idx = np.flatnonzero(~np.isnan(x))
+        k = self._k[idx] + 1
+        self._k[idx] = k
+        pos = k % self.window
+        new = x[idx]
+        old = self._buffer[pos, idx]
+        self._buffer[pos, idx] = new
+
+        # 第k-window个累积和（不足一个窗口时为第0个，即0）正好在要覆盖的位置上
+        csum = self._csum[idx] + new
+        self._csum[idx] = csum
+        self._sum[idx] = csum - self._csums[pos, idx]
+        self._csums[pos, idx] = csum
+        self._n[idx] = np.minimum(k, self.window)
+        return idx, new, old
+
+    def _mean(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self._n > 0, self._sum / self._n, np.nan)
+
+    def update(self, bar):
+        self._roll(getattr(bar, self.field))
+        self.value = self._mean()
+
+
+def rolling_mean(values, window):
+    """
+    对整个(时间, 代码)的历史一次性计算与SMA逐条更新相同的结果，供向量化的回测使用。
+    NaN不占用窗口，数据不足一个窗口时取已有数据的平均值，没有新数据的时刻
+    沿用上一个值，第一条数据之前为NaN。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        return rolling_mean(values[:, None], window)[:, 0]
+    out = np.full(values.shape, np.nan)
+    rows = np.arange(len(values))
+    # 没有缺失数据的代码一起计算，np.cumsum沿axis=0逐行累加，与逐列计算的结果相同
+    full = ~np.isnan(values).any(axis=0)
+    if full.any():
+        csum = np.vstack((np.zeros((1, full.sum())), np.cumsum(values[:, full], axis=0)))
+        k = rows + 1
+        lo = np.maximum(k - window, 0)
+        out[:, full] = (csum[k] - csum[lo]) / (k - lo)[:, None]
+    for j in np.flatnonzero(~full):
+        valid = np.flatnonzero(~np.isnan(values[:, j]))
+        if not len(valid):
+            continue
+        csum = np.concatenate(([0.0], np.cumsum(values[valid, j])))
+        k = np.arange(1, len(valid) + 1)
+        lo = np.maximum(k - window, 0)
+        mean = (csum[k] - csum[lo]) / (k - lo)
+        # 没有数据的时刻沿用最近一个有数据时刻的值
+        last = np.searchsorted(valid, rows, side='right') - 1
+        out[:, j] = np.where(last >= 0, mean[np.maximum(last, 0)], np.nan)
+    return out
+
+
+class RollingStd(SMA):
+    """
+    滚动标准差，在SMA的基础上再维护一个平方和。mean和std分别为窗口内的
+    平均值和标准差，ddof的含义与np.std相同。
+    平方和是相对于一个平移量的偏差的平方和，平移量是这个代码的第一条数据，
+    之后环形缓冲每转满一圈就换成当时窗口的平均值并重新求和，这样价格的水平
+    很高而波动很小（例如价格不变）时不会因为相减而损失精度。
+    """
+
+    def __init__(self, field, window, ddof=0):
+        super(RollingStd, self).__init__(field, window)
+        self.ddof = ddof
+
+    def _init_state(self, n):
+        super(RollingStd, self)._init_state(n)
+        self._shift = np.full(n, np.nan)
+        self._sumsq = np.zeros(n)
+
+    def update(self, bar):
+        idx, new, old = self._roll(getattr(bar, self.field))
+        shift = self._shift[idx]
+        shift = np.where(np.isnan(shift), new, shift)
+        self._shift[idx] = shift
+        old = np.where(np.isnan(old), 0.0, (old - shift) ** 2)
+        self._sumsq[idx] += (new - shift) ** 2 - old
+        # 环形缓冲每转满一圈就更新平移量并重新求平方和，以消除浮点误差的累积
+        wrapped = idx[self._k[idx] % self.window == 0]
+        if len(wrapped):
+            shift = self._sum[wrapped] / self._n[wrapped]
+            self._shift[wrapped] = shift
+            self._sumsq[wrapped] = np.nansum((self._buffer[:, wrapped] - shift) ** 2, axis=0)
+
+        self.mean = self._mean()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            var = (self._sumsq - self._n * (self.mean - self._shift) ** 2) / (self._n - self.ddof)
+        var = np.where(self._n > self.ddof, np.maximum(var, 0.0), np.nan)
+        self.std = np.sqrt(var)
+        self.value = self.std
+
+
+class ZScore(RollingStd):
+    """
+    滚动Z分数，即最新值与窗口平均值之差除以窗口标准差
+    """
+
+    def update(self, bar):
+        super(ZScore, self).update(bar)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.value = (getattr(bar, self.field) - self.mean) / self.std
+
+
+class EMA(Indicator):
+    """
+    指数移动平均，alpha = 2/(span+1)。第一个有效值作为初始值，NaN保持上一次的值。
+    """
+
+    def __init__(self, field, span):
+        super(EMA, self).__init__()
+        self.field = field
+        self.span = span
+        self.alpha = 2.0 / (span + 1.0)
+
+    def update(self, bar):
+        x = getattr(bar, self.field)
+        self.count += 1
+        if self.value is None:
+            self.value = np.array(x, dtype=np.float64)
+            return
+        ema = self.value + self.alpha * (x - self.value)
+        self.value = np.where(np.isnan(self.value), x,
+                              np.where(np.isnan(x), self.value, ema))
+
+
+class RollingMax(Indicator):
+    """
+    滚动最大值。每个代码维护一个单调队列，队首就是窗口内的最大值，每个数据
+    最多进出队列一次，所以均摊代价是O(1)。窗口按每个代码自己的数据条数计算，
+    NaN表示没有数据。
+    """
+
+    def __init__(self, field, window):
+        super(RollingMax, self).__init__()
+        self.field = field
+        self.window = window
+        self.lookback = window
+        self._deques = None
+
+    def _dominates(self, new, old):
+        return new >= old
+
+    def update(self, bar):
+        x = getattr(bar, self.field)
+        if self._deques is None:
+            self._deques = [deque() for _ in range(len(x))]
+            self._t = [0] * len(x)
+            self.value = np.full(len(x), np.nan)
+        self.count += 1
+        for j in np.flatnonzero(~np.isnan(x)).tolist():
+            v = x[j]
+            t = self._t[j]
+            self._t[j] = t + 1
+            d = self._deques[j]
+            while d and d[0][0] <= t - self.window:
+                d.popleft()
+            while d and self._dominates(v, d[-1][1]):
+                d.pop()
+            d.append((t, v))
+            self.value[j] = d[0][1]
+
+
+class RollingMin(RollingMax):
+    """
+    滚动最小值，与RollingMax相同，只是单调队列的方向相反
+    """
+
+    def _dominates(self, new, old):
+        return new <= old
+
+
+class ATR(Indicator):
+    """
+    平均真实波幅（Wilder）。前window条数据取真实波幅的简单平均，之后按
+    atr = (atr * (window - 1) + tr) / window递推，缺失的数据被跳过。
+    """
+
+    def __init__(self, window, high='high', low='low', close='close'):
+        super(ATR, self).__init__()
+        self.window = window
+        self.lookback = window + 1
+        self.high = high
+        self.low = low
+        self.close = close
+        self._prev_close = None
+
+    def update(self, bar):
+        high = getattr(bar, self.high)
+        low = getattr(bar, self.low)
+        close = getattr(bar, self.close)
+        tr = high - low
+        if self._prev_close is not None:
+            tr = np.fmax(tr, np.fmax(np.abs(high - self._prev_close),
+                                     np.abs(low - self._prev_close)))
+            close = np.where(np.isnan(close), self._prev_close, close)
+        self._prev_close = close
+
+        self.count += 1
+        if self.value is None:
+            self.value = np.array(tr, dtype=np.float64)
+            self._n = (~np.isnan(tr)).astype(np.int64)
+            return
+        self._n += ~np.isnan(tr)
+        atr = self.value + (tr - self.value) / np.clip(self._n, 1, self.window)
+        self.value = np.where(np.isnan(self.value), tr,
+                              np.where(np.isnan(tr), self.value, atr))
+
+
+class RSI(Indicator):
+    """
+    相对强弱指数（Wilder平滑），取值0到100，缺失的数据被跳过。
+    还没有价格变化时为NaN；平均涨幅和平均跌幅都为0（价格一直不变）时为50，
+    只有平均跌幅为0时为100。
+    """
+
+    def __init__(self, field, window=14):
+        super(RSI, self).__init__()
+        self.field = field
+        self.window = window
+        self.lookback = window + 1
+        self._prev = None
+        self._gain = None
+        self._loss = None
+
+    def update(self, bar):
+        x = getattr(bar, self.field)
+        self.count += 1
+        if self._prev is None:
+            self._prev = np.array(x, dtype=np.float64)
+            self._gain = np.zeros(len(x))
+            self._loss = np.zeros(len(x))
+            self._n = np.zeros(len(x), dtype=np.int64)
+            self.value = np.full(len(x), np.nan)
+            return
+        change = x - self._prev
+        valid = ~np.isnan(change)
+        self._prev = np.where(np.isnan(x), self._prev, x)
+        self._n += valid
+        n = np.clip(self._n, 1, self.window)
+        gain = self._gain + (np.maximum(change, 0.0) - self._gain) / n
+        loss = self._loss + (np.maximum(-change, 0.0) - self._loss) / n
+        self._gain = np.where(valid, gain, self._gain)
+        self._loss = np.where(valid, loss, self._loss)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = np.where(self._loss == 0.0, 100.0,
+                           100.0 - 100.0 / (1.0 + self._gain / self._loss))
+        rsi = np.where((self._gain == 0.0) & (self._loss == 0.0), 50.0, rsi)
+        self.value = np.where(self._n > 0, rsi, np.nan)
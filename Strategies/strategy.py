@@ -12,7 +12,11 @@ class Strategy(object, metaclass=ABCMeta):
     对于给定的代码基于DataHandler对象生成的数据来生成Signal。
     这个类既可以用来处理历史数据，也可以用来处理实际交易数据。只需要将数据存放到
     数据队列当中
+    lookback是策略通过get_history/get_latest_bars访问的最多历史条数，回测在创建
+    策略之后把它注册到数据处理对象上，只保留有限历史的数据处理对象据此决定
+    环形缓冲的大小。需要更长窗口的策略在构造时设置self.lookback即可。
     """
+    lookback = 1
 
     @abstractmethod
     def calculate_signals(self, event):
@@ -20,3 +24,19 @@ class Strategy(object, metaclass=ABCMeta):
         提供一种计算信号的机制
         """
         raise NotImplementedError("Should implement calculate_signals()")
+
+    def register_indicator(self, indicator):
+        """
+        把一个增量指标注册到数据处理对象上，只需要在构造策略时调用一次，
+        之后指标会随着每条新数据自动更新
+        """
+        return self.bars.register_indicator(indicator)
+
+    def vectorized_signals(self, bar_store):
+        """
+        可选的向量化接口：对整个BarStore一次性计算每个时刻每个代码的目标状态，
+        返回(时间, 代码)的数组，1表示做多，-1表示做空，0表示空仓。
+        结果应当与逐条调用calculate_signals时产生的信号一致，
+        由vectorized.VectorizedBacktest使用。
+        """
+        raise NotImplementedError("Should implement vectorized_signals()")
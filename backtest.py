@@ -5,21 +5,70 @@
 from __future__ import print_function
 
 import datetime
+import json
+import os, os.path
 import pprint
-import queue
 import time
-from equity_plot import plot_performance
+from event import EventQueue, MarketEvent, SignalEvent, OrderEvent, FillEvent
+from profiling import HandlerProfiler, handler_name
+
+
+class StrategySlot(object):
+    """
+    一组策略、组合和执行处理对象。每一组有自己的事件队列和处理函数表，信号、订单
+    和成交只在组内传递，所以多个组可以共享同一个DataHandler而互不影响。
+    """
+
+    def __init__(self, name, strategy, portfolio, execution_handler, events):
+        self.name = name
+        self.strategy = strategy
+        self.portfolio = portfolio
+        self.execution_handler = execution_handler
+        self.events = events
+        self.handlers = {}
+
+        self.signals = 0
+        self.orders = 0
+        self.fills = 0
+
+    def on_market(self, event):
+        # 先撮合挂单，再记录这条数据上的持仓市值
+        self.execution_handler.on_market(event, self.portfolio.bars)
+
+    def update_timeindex(self, event):
+        self.portfolio.update_timeindex()
+
+    def on_signal(self, event):
+        self.signals += 1
+        self.portfolio.update_signal(event)  # Transfer Signal Event to order Event and trigger an order event
+
+    def on_order(self, event):
+        self.orders += 1
+        self.execution_handler.execute_order(event)
+
+    def on_fill(self, event):
+        # finish the order by updating the position. This is quite naive, further extention is required.
+        self.fills += 1
+        self.portfolio.update_fill(event)
 
 
 class Backtest(object):
     """
     Back_test class. The main class that capsule every thing
+    strategies是(strategy_cls, strategy_params)的列表时，同时运行多个策略：
+    数据只读取和遍历一次，每条数据分发给所有的策略，每个策略有自己的组合、
+    执行处理和成交记录（见StrategySlot）。strategy、portfolio等属性指向第一个策略。
     """
+    # 分发完成后把MarketEvent放回复用池；如果有处理函数需要保留MarketEvent，设为False
+    reuse_market_events = True
 
     def __init__(
             self, csv_dir, symbol_list, initial_capital,
             heartbeat, start_date, data_handler_cls,
-            execution_handler_cls, portfolio_cls, strategy_cls
+            execution_handler_cls, portfolio_cls, strategy_cls,
+            strategy_params=None, data_handler_params=None, verbose=True,
+            profile=False, profile_path='profile.json', strategies=None,
+            execution_handler_params=None
     ):
         self.csv_dir = csv_dir
         self.symbol_list = symbol_list
@@ -31,114 +80,240 @@ class Backtest(object):
         self.execution_handler_cls = execution_handler_cls
         self.portfolio_cls = portfolio_cls
         self.strategy_cls = strategy_cls
+        self.strategy_params = strategy_params or {}
+        self.data_handler_params = data_handler_params or {}
+        self.execution_handler_params = execution_handler_params or {}
+        self.strategies = strategies or [(strategy_cls, self.strategy_params)]
+        self.verbose = verbose
+        # profile为True时记录每个处理函数的耗时，run_trading结束时写入profile_path
+        self.profiler = HandlerProfiler() if profile else None
+        self.profile_path = profile_path
 
-        self.events = queue.Queue()
+        self.events = EventQueue()
+        self.handlers = {}
+        self.handler_names = {}
 
-        self.signals = 0
-        self.orders = 0
-        self.fills = 0
-        self.num_strats = 1
+        self.num_strats = len(self.strategies)
         self._generate_trading_instances()
-
-        # self.strat_params_list=strat_params_list
+        self._register_handlers()
 
     def _generate_trading_instances(self):
         """
         Generate all the instances associated with the trading: data handler, strategy  and execution_handler instance
         """
-        print(
-            "Creating DataHandler,Strategy,Portfolio and ExecutionHandler/n"
-        )
-        # print("strategy parameter list:%s..." % strategy_params_dict)
+        if self.verbose:
+            print(
+                "Creating DataHandler,Strategy,Portfolio and ExecutionHandler/n"
+            )
         self.data_handler = self.data_handler_cls(self.events, self.csv_dir,
-                                                  self.symbol_list)
-        self.strategy = self.strategy_cls(self.data_handler, self.events)  # Create the instance of strategy
-        self.portfolio = self.portfolio_cls(self.data_handler, self.events, self.start_date,
-                                            self.initial_capital)  # create instance of portfolio
-        self.execution_handler = self.execution_handler_cls(self.events)
+                                                  self.symbol_list, **self.data_handler_params)
+        self.slots = []
+        for k, (strategy_cls, strategy_params) in enumerate(self.strategies):
+            events = EventQueue()
+            strategy = strategy_cls(self.data_handler, events,
+                                    **(strategy_params or {}))  # Create the instance of strategy
+            self.data_handler.register_lookback(strategy.lookback)
+            portfolio = self.portfolio_cls(self.data_handler, events, self.start_date,
+                                           self.initial_capital)  # create instance of portfolio
+            execution_handler = self.execution_handler_cls(events, **self.execution_handler_params)
+            name = '%s_%d' % (strategy_cls.__name__, k) if self.num_strats > 1 else ''
+            self.slots.append(StrategySlot(name, strategy, portfolio, execution_handler, events))
+
+    @property
+    def strategy(self):
+        return self.slots[0].strategy
+
+    @property
+    def portfolio(self):
+        return self.slots[0].portfolio
+
+    @property
+    def execution_handler(self):
+        return self.slots[0].execution_handler
+
+    @property
+    def signals(self):
+        return self.slots[0].signals
+
+    @property
+    def orders(self):
+        return self.slots[0].orders
+
+    @property
+    def fills(self):
+        return self.slots[0].fills
+
+    def subscribe(self, event_cls, handler, name=None, slot=None):
+        """
+        为某一类事件注册一个处理函数。同一类事件可以有多个处理函数，按注册的顺序调用。
+        分发时按事件的类查表，事件的子类需要单独注册。
+        name是这个处理函数在性能统计中的名字，默认为"类名.方法名"。
+        slot为None时处理所有策略的事件，否则只处理这个StrategySlot的信号、订单和成交。
+        """
+        tables = [slot.handlers] if slot is not None \
+            else [self.handlers] + [s.handlers for s in self.slots]
+        for table in tables:
+            table.setdefault(event_cls, []).append(handler)
+        self.handler_names[handler] = name or handler_name(handler)
+
+    def _register_handlers(self):
+        """
+        注册默认的事件处理函数。MarketEvent由所有策略共享，其他事件只在各自的组内分发
+        """
+        for slot in self.slots:
+            prefix = slot.name + ':' if slot.name else ''
+            portfolio = prefix + type(slot.portfolio).__name__
+            execution = prefix + type(slot.execution_handler).__name__
+            self.handlers.setdefault(MarketEvent, []).extend(
+                [slot.strategy.calculate_signals, slot.on_market,
+                 slot.update_timeindex])  ## Trigger a Signal event
+            self.handler_names[slot.strategy.calculate_signals] = \
+                prefix + handler_name(slot.strategy.calculate_signals)
+            self.handler_names[slot.on_market] = execution + '.on_market'
+            self.handler_names[slot.update_timeindex] = portfolio + '.update_timeindex'
+            self.subscribe(SignalEvent, slot.on_signal, portfolio + '.update_signal', slot)
+            self.subscribe(OrderEvent, slot.on_order, execution + '.execute_order', slot)
+            self.subscribe(FillEvent, slot.on_fill, portfolio + '.update_fill', slot)
 
     def _run_backtest(self):
         """
-        执行回测
+        执行回测。每条数据先把MarketEvent分发给所有的策略，再依次处理每个策略
+        自己队列中的信号、订单和成交
         """
-        i = 0
+        if self.profiler is not None:
+            return self._run_backtest_profiled()
+        events = self.events
+        handlers = self.handlers
+        slots = [(slot.events, slot.handlers) for slot in self.slots]
+        reuse = self.reuse_market_events
         while True:
-            i += 1
-            print(i)
             if self.data_handler.continue_backtest == True:
                 self.data_handler.update_bars()  # Trigger a market event
             else:
                 break
-            while True:
-                try:
-                    event = self.events.get(False)  ##Get an event from the Queue
-                except queue.Empty:
-                    break
-                else:
-                    if event is not None:
-                        if event.type == 'MARKET':
-                            self.strategy.calculate_signals(event)  ## Trigger a Signal event #
-                            self.portfolio.update_timeindex()
-                        elif event.type == 'SIGNAL':
-                            self.signals += 1
-                            self.portfolio.update_signal(
-                                event)  # Transfer Signal Event to order Event and trigger an order event
-                        elif event.type == 'ORDER':
-                            self.orders += 1
-                            self.execution_handler.execute_order(event)
-                        elif event.type == 'FILL':  # finish the order by updating the position. This is quite naive, further extention is required.
-                            self.fills += 1
-                            self.portfolio.update_fill(event)
-
-            time.sleep(self.heartbeat)
-
-    def _output_performance(self):
-
-        self.portfolio.create_equity_curve_dateframe()  # get equity curve object
-
-        print("Creating summary stats...")
-        stats = self.portfolio.output_summary_stats()
-
-        print("Creating equity curve...")
-        print(self.portfolio.equity_curve.tail(10))
-        pprint.pprint(stats)
-
-        print("Signals: %s" % self.signals)
-        print("Orders: %s" % self.orders)
-        print("Fills: %s" % self.fills)
-        self.portfolio.equity_curve.to_csv('equity.csv')
-        # self.execution_handler.execution_records.set_index('date_time',inplace =True)
-        self.execution_handler.execution_records.to_csv('Execution_summary.csv')
-
-    def run_trading(self):
-        """
-        模拟回测以及输出业绩结果的过程
+            while events:
+                event = events.popleft()
+                event_cls = type(event)
+                for handler in handlers.get(event_cls, ()):
+                    handler(event)
+                if reuse and event_cls is MarketEvent:
+                    event.release()
+            for queue, table in slots:
+                while queue:
+                    event = queue.popleft()
+                    for handler in table.get(type(event), ()):
+                        handler(event)
+
+            if self.heartbeat:
+                time.sleep(self.heartbeat)
+
+    def _run_backtest_profiled(self):
+        """
+        与_run_backtest相同的主循环，另外记录数据更新和每个处理函数的耗时
+        """
+        events = self.events
+        queues = [(events, self.handlers)] + [(slot.events, slot.handlers) for slot in self.slots]
+        names = self.handler_names
+        reuse = self.reuse_market_events
+        profiler = self.profiler
+        clock = time.perf_counter
+        update_name = type(self.data_handler).__name__ + '.update_bars'
+
+        profiler.start()
+        while self.data_handler.continue_backtest == True:
+            start = clock()
+            self.data_handler.update_bars()
+            profiler.record(update_name, clock() - start)
+            if events:
+                profiler.bars += 1
+            for queue, table in queues:
+                while queue:
+                    event = queue.popleft()
+                    event_cls = type(event)
+                    event_start = clock()
+                    for handler in table.get(event_cls, ()):
+                        start = clock()
+                        handler(event)
+                        profiler.record(names[handler], clock() - start)
+                    profiler.record_event(event_cls.__name__, clock() - event_start)
+                    if reuse and event_cls is MarketEvent:
+                        event.release()
+
+            if self.heartbeat:
+                time.sleep(self.heartbeat)
+        profiler.stop()
+
+    def _write_slot_results(self, slot, output_dir):
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        portfolio = slot.portfolio
+        if getattr(portfolio, 'equity_curve', None) is None:
+            portfolio.create_equity_curve_dateframe()
+        stats = dict((k, float(v)) for k, v in portfolio.summary_stats().items())
+        stats['signals'] = slot.signals
+        stats['orders'] = slot.orders
+        stats['fills'] = slot.fills
+        portfolio.equity_curve.to_csv(os.path.join(output_dir, 'equity.csv'))
+        slot.execution_handler.blotter.to_csv(os.path.join(output_dir, 'Execution_summary.csv'))
+        with open(os.path.join(output_dir, 'stats.json'), 'w') as fp:
+            json.dump(stats, fp, indent=1)
+        return stats
+
+    def _slot_dir(self, slot, output_dir):
+        return os.path.join(output_dir, slot.name) if slot.name else output_dir
+
+    def write_results(self, output_dir='.'):
+        """
+        把资产曲线（equity.csv）、业绩统计（stats.json）和成交记录
+        （Execution_summary.csv）写入output_dir，开启了性能统计时同时写入profile_path。
+        同时运行多个策略时，每个策略的结果写入以策略名命名的子目录，
+        返回{策略名: 业绩统计}。
+        """
+        results = dict((slot.name, self._write_slot_results(slot, self._slot_dir(slot, output_dir)))
+                       for slot in self.slots)
+        if self.profiler is not None:
+            self.profiler.to_json(os.path.join(output_dir, self.profile_path))
+        if self.num_strats == 1:
+            return results['']
+        return results
+
+    def _output_performance(self, output_dir='.'):
+        for slot in self.slots:
+            if slot.name:
+                print("Strategy %s" % slot.name)
+            slot.portfolio.create_equity_curve_dateframe()  # get equity curve object
+
+            print("Creating summary stats...")
+            stats = slot.portfolio.output_summary_stats()
+
+            print("Creating equity curve...")
+            print(slot.portfolio.equity_curve.tail(10))
+            pprint.pprint(stats)
+
+            print("Signals: %s" % slot.signals)
+            print("Orders: %s" % slot.orders)
+            print("Fills: %s" % slot.fills)
+        if self.profiler is not None:
+            self.profiler.print_report()
+        self.write_results(output_dir)
+
+    def run_batch(self, output_dir='.'):
+        """
+        无界面的回测：执行回测并把结果写入文件后返回业绩统计，不输出也不画图，
+        不会导入matplotlib
+        """
+        self._run_backtest()
+        return self.write_results(output_dir)
+
+    def run_trading(self, plot=True, output_dir='.'):
+        """
+        模拟回测以及输出业绩结果的过程。plot为True时在写入结果文件之后
+        根据这些文件画图（此时才导入画图模块）
         """
         self._run_backtest()
-        self._output_performance()
-        my_plot = plot_performance(self.portfolio.equity_curve,
-                                   self.data_handler.symbol_data[self.symbol_list[0]],
-                                   self.execution_handler.execution_records )
-        my_plot.plot_equity_curve()
-        my_plot.plot_stock_curve()
-        my_plot.show_all_plot()
-        # out=open("opt.csv","w")
-        # spl=len(self.strat_params_list)
-        # for i,sp in enumerate(self.strat_params_list):
-        #     print("Strategy %s out of %s..." %(i+1,spl))
-        #     self._generate_trading_instances(sp)
-        #     self._run_backtest()
-        #     stats=self._output_performance()
-        #     pprint.pprint(stats)
-        #
-        #     tot_ret=float(stats[0][1].replace("%",""))
-        #     sharpe=float(stats[1][1])
-        #     max_dd=float(stats[2][1].replace("%",""))
-        #     dd_dur=int(stats[3][1])
-        #
-        #     out.write(
-        #         "%s,%s,%s,%s,%s,%s,%s\n" %
-        #         sp["ols_window"],sp["zscore_high"],sp["zscore_low"],
-        #         tot_ret,sharpe,max_dd,dd_dur
-        #     )
-        # out.close()
+        self._output_performance(output_dir)
+        if plot:
+            from equity_plot import plot_results
+            for slot in self.slots:
+                plot_results(self._slot_dir(slot, output_dir), self.csv_dir, self.symbol_list[0],
+                             self.data_handler_params.get('csv_format'))
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+# bar_cache.py
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import os, os.path
+import shutil
+import tempfile
+
+from bar_store import BarStore
+
+CACHE_VERSION = 2
+
+
+def _cache_path(cache_dir, symbol_list):
+    """
+    每个代码列表对应缓存目录中的一个子目录
+    """
+    key = hashlib.sha1('\n'.join(symbol_list).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, key)
+
+
+def _file_hash(path):
+    """
+    计算文件内容的sha1
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _source_path(csv_dir, symbol):
+    return os.path.join(csv_dir, '%s.csv' % symbol)
+
+
+def _read_manifest(path):
+    try:
+        with open(os.path.join(path, 'manifest.json')) as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return None
+
+
+def _write_manifest(path, manifest):
+    tmp = os.path.join(path, 'manifest.json.tmp')
+    with open(tmp, 'w') as fp:
+        json.dump(manifest, fp, indent=1)
+    os.replace(tmp, os.path.join(path, 'manifest.json'))
+
+
+def _is_valid(path, manifest, csv_dir, symbol_list, csv_format=None):
+    """
+    检查缓存是否仍然有效。源文件的修改时间和大小都没有变化时直接认为有效；
+    修改时间变了但是大小没变时再比较文件的sha1，内容没有变化则更新清单中的
+    修改时间，下次就不需要再计算sha1了。
+    """
+    if manifest is None or manifest.get('version') != CACHE_VERSION \
+            or manifest.get('symbol_list') != list(symbol_list) \
+            or manifest.get('csv_format') != csv_format:
+        return False
+    touched = False
+    for s in symbol_list:
+        source = manifest['sources'][s]
+        st = os.stat(_source_path(csv_dir, s))
+        if st.st_mtime_ns == source['mtime_ns'] and st.st_size == source['size']:
+            continue
+        if st.st_size != source['size'] or \
+                _file_hash(_source_path(csv_dir, s)) != source['sha1']:
+            return False
+        source['mtime_ns'] = st.st_mtime_ns
+        touched = True
+    if touched:
+        _write_manifest(path, manifest)
+    return True
+
+
+def build_cache(csv_dir, symbol_list, cache_dir, csv_format=None):
+    """
+    解析CSV文件并把结果写入二进制缓存，返回内存中的BarStore。
+    先写到临时目录，再整体替换原来的缓存目录。
+    csv_format是CSV文件的格式（见ingest.CSV_FORMATS），None表示yahoo格式。
+    """
+    store = BarStore.from_csv(csv_dir, symbol_list, csv_format)
+    path = _cache_path(cache_dir, symbol_list)
+    manifest = {
+        'version': CACHE_VERSION,
+        'symbol_list': list(symbol_list),
+        'csv_format': csv_format,
+        'sources': {},
+    }
+    for s in symbol_list:
+        st = os.stat(_source_path(csv_dir, s))
+        manifest['sources'][s] = {
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            'sha1': _file_hash(_source_path(csv_dir, s)),
+        }
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    tmp = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        store.save(tmp)
+        _write_manifest(tmp, manifest)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmp, path)
+    except OSError:
+        # 另一个进程同时写入了同一个缓存，直接使用内存中的结果
+        shutil.rmtree(tmp, ignore_errors=True)
+    return store
+
+
+def ensure_cache(csv_dir, symbol_list, cache_dir, csv_format=None):
+    """
+    保证缓存有效（必要时重新解析CSV并更新缓存），返回缓存的目录，
+    之后可以在任何进程中用BarStore.load以内存映射的方式读取；缓存没能写入时返回None
+    """
+    path = _cache_path(cache_dir, symbol_list)
+    if not _is_valid(path, _read_manifest(path), csv_dir, symbol_list, csv_format):
+        build_cache(csv_dir, symbol_list, cache_dir, csv_format)
+    return path if _read_manifest(path) is not None else None
+
+
+def load_bar_store(csv_dir, symbol_list, cache_dir, csv_format=None):
+    """
+    从二进制缓存中以内存映射的方式读取BarStore，缓存不存在、源文件已经
+    改变或者格式不同时重新解析CSV并更新缓存
+    """
+    path = _cache_path(cache_dir, symbol_list)
+    if _is_valid(path, _read_manifest(path), csv_dir, symbol_list, csv_format):
+        return BarStore.load(path)
+    store = build_cache(csv_dir, symbol_list, cache_dir, csv_format)
+    if _read_manifest(path) is None:
+        return store
+    return BarStore.load(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert the CSV files of a symbol list into the binary bar cache"
+    )
+    parser.add_argument('csv_dir')
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--cache-dir', default=None,
+                        help="defaults to <csv_dir>/.bar_cache")
+    parser.add_argument('--format', default=None,
+                        help="CSV format registered in ingest.CSV_FORMATS (default: yahoo)")
+    args = parser.parse_args()
+    cache_dir = args.cache_dir or os.path.join(args.csv_dir, '.bar_cache')
+    store = load_bar_store(args.csv_dir, args.symbols, cache_dir, args.format)
+    print("Cached %s bars x %s symbols in %s" %
+          (len(store), len(store.symbol_list), _cache_path(cache_dir, args.symbols)))
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+# bar_store.py
+
+from __future__ import print_function
+
+from collections import namedtuple
+from multiprocessing import shared_memory
+import json
+import os, os.path
+
+import numpy as np
+import pandas as pd
+
+# 数据条目中保存的字段，顺序即为Bar中的顺序
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'adj_close', 'pct_change')
+
+# 单条数据（标量）或者N条数据（数组视图）的轻量封装，
+# 第一个元素为时间，保持与原来(datetime, Series)元组相同的下标习惯
+Bar = namedtuple('Bar', ('datetime',) + BAR_FIELDS)
+
+
+class BarStore(object):
+    """
+    BarStore是一个列式的数据存储，每个字段对应一个连续的NumPy二维数组，
+    形状为(时间, 代码)，所有代码共享同一个时间索引。
+    存储本身是只读的，回测的进度（游标）由数据处理对象自己维护，因此同一个
+    BarStore可以被多个数据处理对象同时使用。
+    """
+
+    def __init__(self, index, symbol_list, columns):
+        self.index = pd.DatetimeIndex(index)
+        self.symbol_list = list(symbol_list)
+        self.columns = columns
+        self.symbol_pos = dict((s, i) for i, s in enumerate(self.symbol_list))
+
+    def __len__(self):
+        return len(self.index)
+
+    @classmethod
+    def from_frames(cls, symbol_list, frames, index):
+        """
+        由每个代码的DataFrame（已经对齐到index）构造BarStore
+        """
+        columns = {}
+        for field in BAR_FIELDS:
+            columns[field] = np.ascontiguousarray(
+                np.column_stack([frames[s][field].values for s in symbol_list]),
+                dtype=np.float64
+            )
+        return cls(index, symbol_list, columns)
+
+    @classmethod
+    def from_csv(cls, csv_dir, symbol_list, csv_format=None):
+        """
+        从数据路径中打开CSV文件，对齐到所有代码时间索引的并集（向前填充），
+        并计算pct_change。csv_format为None时假设数据来自于yahoo，
+        其他格式由ingest模块解析（见ingest.CSV_FORMATS）。
+        """
+        if csv_format is not None:
+            from ingest import read_csv
+            frames = dict((s, read_csv(os.path.join(csv_dir, '%s.csv' % s), csv_format))
+                          for s in symbol_list)
+            return cls.align_frames(symbol_list, frames)
+        frames = {}
+        for s in symbol_list:
+            frames[s] = pd.read_csv(
+                os.path.join(csv_dir, '%s.csv' % s),
+                header=0, index_col=0, parse_dates=True,
+                names=[
+                    'datetime', 'high', 'low',
+                    'open', 'close', 'volume', 'adj_close'
+                ]
+            ).sort_index()
+        return cls.align_frames(symbol_list, frames)
+
+    @classmethod
+    def align_frames(cls, symbol_list, frames):
+        """
+        把每个代码按时间升序排列的DataFrame对齐到所有代码时间索引的并集
+        （向前填充），计算pct_change，构造BarStore
+        """
+        comb_index = None
+        for s in symbol_list:
+            if comb_index is None:
+                comb_index = frames[s].index
+            else:
+                comb_index = comb_index.union(frames[s].index)
+
+        for s in symbol_list:
+            frames[s] = frames[s].reindex(index=comb_index, method='pad')
+            frames[s]['pct_change'] = compute_pct_change(frames[s]['adj_close'].values)
+        return cls.from_frames(symbol_list, frames, comb_index)
+
+    def save(self, path):
+        """
+        把BarStore以二进制的形式保存到目录path中：时间索引和每个字段各一个.npy文件，
+        代码列表保存在symbols.json中
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        # 保留时间索引原来的精度，读回来的索引与解析CSV得到的完全相同
+        np.save(os.path.join(path, 'index.npy'), self.index.values)
+        for f in BAR_FIELDS:
+            np.save(os.path.join(path, '%s.npy' % f), self.columns[f])
+        with open(os.path.join(path, 'symbols.json'), 'w') as fp:
+            json.dump(self.symbol_list, fp)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        读取由save保存的BarStore，默认以只读的方式做内存映射，不需要解析和复制数据
+        """
+        with open(os.path.join(path, 'symbols.json')) as fp:
+            symbol_list = json.load(fp)
+        index = np.load(os.path.join(path, 'index.npy'))
+        columns = dict(
+            (f, np.load(os.path.join(path, '%s.npy' % f), mmap_mode=mmap_mode))
+            for f in BAR_FIELDS
+        )
+        return cls(index, symbol_list, columns)
+
+    def to_shared_memory(self):
+        """
+        把所有字段复制到一块共享内存中，返回(handle, shm)。
+        handle是一个可以pickle的字典，传给其他进程后用attach_shared_memory挂载；
+        shm由创建者持有，所有进程用完之后负责调用close()和unlink()。
+        """
+        shape = (len(BAR_FIELDS),) + self.columns[BAR_FIELDS[0]].shape
+        nbytes = int(np.prod(shape)) * np.dtype(np.float64).itemsize
+        shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        block = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        for k, f in enumerate(BAR_FIELDS):
+            block[k] = self.columns[f]
+        del block
+        handle = {
+            'name': shm.name,
+            'shape': shape,
+            'index': self.index,
+            'symbol_list': self.symbol_list,
+        }
+        return handle, shm
+
+    @classmethod
+    def attach_shared_memory(cls, handle):
+        """
+        只读地挂载由to_shared_memory创建的共享内存，不复制数据。
+        """
+        shm = shared_memory.SharedMemory(name=handle['name'])
+        block = np.ndarray(handle['shape'], dtype=np.float64, buffer=shm.buf)
+        block.flags.writeable = False
+        columns = dict((f, block[k]) for k, f in enumerate(BAR_FIELDS))
+        store = cls(handle['index'], handle['symbol_list'], columns)
+        store._shm = shm
+        return store
+
+    def select(self, symbol_list):
+        """
+        取出一部分代码的数据，时间索引保持不变。这些代码在原来的顺序中连续时
+        返回视图（例如共享内存或者内存映射的一部分），否则复制
+        """
+        cols = [self.symbol_pos[s] for s in symbol_list]
+        if cols and cols == list(range(cols[0], cols[0] + len(cols))):
+            cols = slice(cols[0], cols[0] + len(cols))
+        columns = dict((f, self.columns[f][:, cols]) for f in BAR_FIELDS)
+        return BarStore(self.index, symbol_list, columns)
+
+    def column(self, field):
+        """
+        返回某个字段的(时间, 代码)数组
+        """
+        return self.columns[field]
+
+    def to_frame(self, symbol):
+        """
+        将某个代码的全部数据转换为pandas的DataFrame，仅用于输出和画图
+        """
+        j = self.symbol_pos[symbol]
+        return pd.DataFrame(
+            dict((f, self.columns[f][:, j]) for f in BAR_FIELDS),
+            index=self.index
+        )
+
+
+def compute_pct_change(values):
+    """
+    向量化计算相邻两个数值的百分比变化，第一个数值为NaN
+    """
+    out = np.empty(len(values), dtype=np.float64)
+    out[:1] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(values[1:], values[:-1], out=out[1:])
+    out[1:] -= 1.0
+    return out
+
+
+class RingBuffer(object):
+    """
+    保存最近capacity行数据的环形缓冲，每一行的形状为shape。数据保存在2*capacity行
+    的数组中，每一行同时写入p和p+capacity两个位置，所以最近的任意k<=capacity行
+    总是data[end-k:end]这段连续的视图，既不需要复制，也不需要定期整理，
+    内存只与capacity有关，与写入的总行数无关。
+    返回的视图只在下一次append之前有效。
+    """
+
+    def __init__(self, capacity, shape=(), dtype=np.float64, fill=np.nan):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.fill = fill
+        self.capacity = 0
+        self.count = 0
+        self.end = 0
+        self.data = np.full((0,) + self.shape, fill, dtype=self.dtype)
+        self.resize(capacity)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def start(self):
+        """
+        最早一条仍然保留的数据在data中的行号
+        """
+        return self.end - len(self)
+
+    @property
+    def last(self):
+        """
+        最近写入的一行（视图），还没有数据时为None
+        """
+        return self.data[self.end - 1] if self.count else None
+
+    def append(self, row):
+        """
+        写入新的一行，容量已满时覆盖最早的一行
+        """
+        p = self.count % self.capacity
+        self.data[p] = row
+        self.data[p + self.capacity] = row
+        self.count += 1
+        self.end = p + self.capacity + 1
+
+    def window(self, N):
+        """
+        返回最近的N行，如果没有那么多，返回N-k行
+        """
+        return self.data[max(self.end - N, self.start):self.end]
+
+    def resize(self, capacity):
+        """
+        把容量改为capacity，保留最近的min(capacity, len(self))行
+        """
+        capacity = max(int(capacity), 1)
+        if capacity == self.capacity:
+            return
+        keep = self.window(capacity).copy()
+        self.capacity = capacity
+        self.data = np.full((2 * capacity,) + self.shape, self.fill, dtype=self.dtype)
+        self.count = 0
+        self.end = 0
+        for row in keep:
+            self.append(row)
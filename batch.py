@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+# batch.py
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import importlib
+import json
+import sys
+
+from backtest import Backtest
+
+# 命令行中可以用简称指定的数据处理类
+DATA_HANDLERS = {
+    'dense': 'data:HistoricCSVDataHandler',
+    'stream': 'data:StreamingCSVDataHandler',
+    'sparse': 'data:SparseCSVDataHandler',
+}
+
+
+def load_class(path):
+    """
+    根据"模块:类名"的字符串导入一个类
+    """
+    module, _, name = path.partition(':')
+    try:
+        return getattr(importlib.import_module(module), name)
+    except (ImportError, AttributeError) as e:
+        print("Cannot load class %s" % path)
+        raise e
+
+
+def run(csv_dir, symbol_list, output_dir, strategy, portfolio,
+        execution='execution:SimulatedExecutionHandler', data_handler='dense',
+        strategy_params=None, initial_capital=100000.0, start_date=None,
+        profile=False):
+    """
+    无界面地执行一次回测，结果写入output_dir，返回业绩统计。
+    各个类用"模块:类名"的字符串指定，整个过程不会导入画图模块。
+    """
+    backtest = Backtest(
+        csv_dir, symbol_list, initial_capital, 0.0, start_date,
+        load_class(DATA_HANDLERS.get(data_handler, data_handler)),
+        load_class(execution), load_class(portfolio), load_class(strategy),
+        strategy_params=strategy_params, verbose=False, profile=profile
+    )
+    return backtest.run_batch(output_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run one backtest without plotting and write equity.csv, "
+                    "stats.json and Execution_summary.csv to the output directory"
+    )
+    parser.add_argument('csv_dir')
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--strategy',
+                        default='Strategies.MovingAverageCrossStrategy:MovingAverageCrossStrategy')
+    parser.add_argument('--portfolio', default='AAPL:My_portfolio')
+    parser.add_argument('--execution', default='execution:SimulatedExecutionHandler')
+    parser.add_argument('--data-handler', default='dense',
+                        help="dense, stream, sparse or module:Class")
+    parser.add_argument('--params', default='{}', help="strategy parameters as JSON")
+    parser.add_argument('--capital', type=float, default=100000.0)
+    parser.add_argument('--start-date', default='2015-05-01')
+    parser.add_argument('--profile', action='store_true')
+    args = parser.parse_args()
+    stats = run(
+        args.csv_dir, args.symbols, args.output_dir, args.strategy, args.portfolio,
+        args.execution, args.data_handler, json.loads(args.params), args.capital,
+        datetime.datetime.strptime(args.start_date, '%Y-%m-%d'), args.profile
+    )
+    json.dump(stats, sys.stdout, indent=1)
+    print()
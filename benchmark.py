@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+# benchmark.py
+
+from __future__ import print_function
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os, os.path
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from backtest import Backtest
+from data import HistoricCSVDataHandler, StreamingCSVDataHandler, SparseCSVDataHandler
+from event import EventQueue, OrderEvent
+from execution import SimulatedExecutionHandler
+from portfolio import Portfolio
+from Strategies.MovingAverageCrossStrategy import MovingAverageCrossStrategy
+
+DATA_HANDLERS = {
+    'dense': HistoricCSVDataHandler,
+    'stream': StreamingCSVDataHandler,
+    'sparse': SparseCSVDataHandler,
+}
+
+# 报告中的阶段，以及属于每个阶段的处理函数名的后缀（见profiling.handler_name）
+STAGES = (
+    ('update_bars', ('.update_bars',)),
+    ('signals', ('.calculate_signals',)),
+    ('portfolio', ('.update_timeindex', '.update_signal', '.update_fill')),
+    ('execution', ('.on_market', '.execute_order')),
+)
+
+
+class BenchmarkPortfolio(Portfolio):
+    """
+    测试用的组合，每个信号固定交易100股，不做风险管理
+    """
+    quantity = 100
+
+    def generate_naive_order(self, signal):
+        order = None
+        symbol = signal.symbol
+        direction = signal.signal_type
+        cur_quantity = self.current_positions[symbol]
+
+        if direction == 'LONG' and cur_quantity == 0:
+            order = OrderEvent(signal.date_time, symbol, 'MKT', self.quantity, 'BUY',
+                               signal.order_price, direction)
+        if direction == 'SHORT' and cur_quantity == 0:
+            order = OrderEvent(signal.date_time, symbol, 'MKT', self.quantity, 'SELL',
+                               signal.order_price, direction)
+        if direction == 'EXIT' and cur_quantity > 0:
+            order = OrderEvent(signal.date_time, symbol, 'MKT', abs(cur_quantity), 'SELL',
+                               signal.order_price, direction)
+        if direction == 'EXIT' and cur_quantity < 0:
+            order = OrderEvent(signal.date_time, symbol, 'MKT', abs(cur_quantity), 'BUY',
+                               signal.order_price, direction)
+        return order
+
+    def vectorized_positions(self, state):
+        """
+        与generate_naive_order相同的规则：空仓时按信号的方向开仓，EXIT时平仓，
+        有持仓时的LONG和SHORT信号被忽略。所以非空仓的时刻，持仓的方向就是最近
+        一次空仓之后的第一个目标状态
+        """
+        state = np.asarray(state)
+        rows = np.arange(len(state))[:, None]
+        last_flat = np.maximum.accumulate(np.where(state == 0, rows, -1), axis=0)
+        entry = np.take_along_axis(state, np.minimum(last_flat + 1, len(state) - 1), axis=0)
+        return np.where(state != 0, entry.astype(self.position_dtype) * self.quantity, 0)
+
+
+def generate_ohlcv(n_bars, start='2010-01-01', freq='D', gap=0.0, seed=None):
+    """
+    生成一个代码的模拟行情（几何布朗运动），格式与yahoo的CSV相同。
+    freq为'D'时使用工作日，其他取值（例如'1min'）直接传给pd.date_range；
+    gap是随机删除一条数据的概率，用来模拟停牌和缺失的数据。
+    """
+    rng = np.random.default_rng(seed)
+    if freq == 'D':
+        index = pd.bdate_range(start, periods=n_bars)
+    else:
+        index = pd.date_range(start, periods=n_bars, freq=freq)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0.0002, 0.02, n_bars)))
+    open_ = np.concatenate(([100.0], close[:-1])) * (1.0 + rng.normal(0.0, 0.005, n_bars))
+    high = np.maximum(open_, close) * (1.0 + np.abs(rng.normal(0.0, 0.01, n_bars)))
+    low = np.minimum(open_, close) * (1.0 - np.abs(rng.normal(0.0, 0.01, n_bars)))
+    volume = np.round(rng.lognormal(15.0, 0.5, n_bars))
+    frame = pd.DataFrame({
+        'High': high, 'Low': low, 'Open': open_, 'Close': close,
+        'Volume': volume, 'Adj Close': close,
+    }, index=pd.DatetimeIndex(index, name='Date'))
+    if gap > 0:
+        keep = rng.random(n_bars) >= gap
+        keep[0] = True
+        frame = frame[keep]
+    return frame
+
+
+def write_universe(csv_dir, n_symbols, n_bars, freq='D', gap=0.0, seed=0):
+    """
+    在csv_dir中生成n_symbols个代码的CSV文件，返回代码列表
+    """
+    if not os.path.isdir(csv_dir):
+        os.makedirs(csv_dir)
+    symbol_list = ['SYM%04d' % i for i in range(n_symbols)]
+    for i, s in enumerate(symbol_list):
+        frame = generate_ohlcv(n_bars, freq=freq, gap=gap, seed=seed + i)
+        frame.to_csv(os.path.join(csv_dir, '%s.csv' % s))
+    return symbol_list
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _stage_times(report):
+    """
+    把每个处理函数的累计耗时按阶段汇总
+    """
+    times = dict((stage, 0.0) for stage, _ in STAGES)
+    for name, stats in report['handlers'].items():
+        for stage, suffixes in STAGES:
+            if name.endswith(suffixes):
+                times[stage] += stats['total']
+    return times
+
+
+def run_case(n_symbols, n_bars, freq='D', gap=0.0, handler='dense',
+             short_window=10, long_window=30, seed=0):
+    """
+    在一个模拟的行情上执行一次完整的回测，返回每个阶段的耗时（秒）
+    """
+    tmp = tempfile.mkdtemp(prefix='bench_')
+    try:
+        return _run_case(os.path.join(tmp, 'csv'), n_symbols, n_bars, freq, gap, handler,
+                         short_window, long_window, seed)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _run_case(csv_dir, n_symbols, n_bars, freq, gap, handler, short_window, long_window, seed):
+    data_handler_cls = DATA_HANDLERS[handler]
+    symbol_list, generate_time = _timed(write_universe, csv_dir, n_symbols, n_bars,
+                                        freq, gap, seed)
+    # csv_load是构造被测的数据处理对象的时间：dense读取全部数据，
+    # stream只打开文件并读入第一块，sparse读取每个代码各自的数组
+    data_handler, load_time = _timed(data_handler_cls, EventQueue(), csv_dir, symbol_list)
+    params = {'short_window': short_window, 'long_window': long_window}
+    data_handler_params = {'bar_store': data_handler.bar_store} if handler == 'dense' else {}
+    data_handler.update_bars()
+    start_date = data_handler.get_latest_datetime() - pd.Timedelta(1, 'D')
+    del data_handler
+
+    def make_backtest(profile):
+        return Backtest(
+            csv_dir, symbol_list, 100000.0, 0.0, start_date, data_handler_cls,
+            SimulatedExecutionHandler, BenchmarkPortfolio, MovingAverageCrossStrategy,
+            strategy_params=params, data_handler_params=data_handler_params,
+            verbose=False, profile=profile
+        )
+
+    # 策略每次产生信号都会输出一行，不计入测量
+    with contextlib.redirect_stdout(io.StringIO()):
+        backtest = make_backtest(False)
+        _, loop_time = _timed(backtest._run_backtest)
+        profiled = make_backtest(True)
+        profiled._run_backtest()
+    portfolio = backtest.portfolio
+    rows = portfolio.ledger_rows - 1
+    _, stats_time = _timed(lambda: (portfolio.create_equity_curve_dateframe(),
+                                    portfolio.summary_stats()))
+    report = profiled.profiler.report()
+
+    stages = {'generate': generate_time, 'csv_load': load_time}
+    stages.update(_stage_times(report))
+    stages['event_loop'] = loop_time
+    stages['performance_stats'] = stats_time
+    return {
+        'symbols': n_symbols,
+        'bars': n_bars,
+        'freq': freq,
+        'gap': gap,
+        'handler': handler,
+        'rows': rows,
+        'fills': backtest.fills,
+        'stages': stages,
+        'bars_per_second': rows / loop_time if loop_time > 0 else None,
+        'events_per_second': report['events'] / loop_time if loop_time > 0 else None,
+    }
+
+
+def run_suite(sizes, freq='D', gap=0.0, handler='dense', repeat=1):
+    """
+    对每个(代码数, 数据条数)执行repeat次测量，每个阶段取最小值
+    """
+    results = []
+    for n_symbols, n_bars in sizes:
+        runs = [run_case(n_symbols, n_bars, freq, gap, handler) for _ in range(repeat)]
+        best = runs[0]
+        for stage in best['stages']:
+            best['stages'][stage] = min(r['stages'][stage] for r in runs)
+        best['repeat'] = repeat
+        results.append(best)
+        print("%5d symbols x %7d bars: %s" % (n_symbols, n_bars, ", ".join(
+            "%s=%.3fs" % (k, v) for k, v in best['stages'].items())))
+    return {
+        'commit': _git_commit(),
+        'created': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'results': results,
+    }
+
+
+def _parse_size(text):
+    n_symbols, n_bars = text.lower().split('x')
+    return int(n_symbols), int(n_bars)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time each stage of a backtest on synthetic OHLCV universes"
+    )
+    parser.add_argument('--sizes', nargs='+', type=_parse_size,
+                        default=[(1, 2500), (10, 2500), (50, 2500)],
+                        help="symbols x bars, e.g. 10x2500")
+    parser.add_argument('--freq', default='D', help="'D' for daily, or e.g. 1min")
+    parser.add_argument('--gap', type=float, default=0.0,
+                        help="probability of dropping each bar")
+    parser.add_argument('--handler', choices=sorted(DATA_HANDLERS), default='dense')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args()
+    suite = run_suite(args.sizes, args.freq, args.gap, args.handler, args.repeat)
+    with open(args.output, 'w') as fp:
+        json.dump(suite, fp, indent=1)
+    print("Results written to %s" % args.output)
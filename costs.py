@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+# costs.py
+
+from __future__ import print_function
+
+from abc import ABCMeta, abstractmethod
+import math
+
+import numpy as np
+
+
+class CostComponent(object, metaclass=ABCMeta):
+    """
+    交易成本模型的一个组成部分。每个组成部分有两种等价的计算方式：
+    cost对单笔成交用纯Python的标量运算计算，供事件驱动的回测逐笔调用；
+    batch对一组成交的NumPy数组一次性计算，供向量化回测和批量定价使用。
+    quantity为成交数量（不带方向），price为每股的参考价格，
+    market是成交时的市场数据（'volume'为平均成交量，'volatility'为收益率的标准差），
+    batch中的各个参数都是长度相同的数组，symbols是代码的数组。
+    lookback是计算market需要的历史数据条数。
+    """
+    lookback = 1
+
+    @abstractmethod
+    def cost(self, symbol, quantity, price, market=None):
+        raise NotImplementedError("Should implement cost()")
+
+    @abstractmethod
+    def batch(self, symbols, quantity, price, market=None):
+        raise NotImplementedError("Should implement batch()")
+
+
+class TieredCommission(CostComponent):
+    """
+    分档佣金。tiers是按数量上限升序排列的(上限, 费率)列表，成交数量落在哪一档，
+    整笔成交都按这一档的费率计算；per_share为True时费率是每股的金额，
+    否则是成交金额的比例。结果不低于minimum，maximum不为None时不超过
+    成交金额的maximum倍。
+    """
+
+    def __init__(self, tiers, minimum=0.0, maximum=None, per_share=True):
+        self.tiers = [(float(bound), float(rate)) for bound, rate in tiers]
+        self.minimum = minimum
+        self.maximum = maximum
+        self.per_share = per_share
+        self._bounds = np.array([bound for bound, rate in self.tiers])
+        self._rates = np.array([rate for bound, rate in self.tiers])
+
+    def cost(self, symbol, quantity, price, market=None):
+        rate = self.tiers[-1][1]
+        for bound, tier_rate in self.tiers:
+            if quantity <= bound:
+                rate = tier_rate
+                break
+        fee = rate * quantity if self.per_share else rate * quantity * price
+        if self.maximum is not None:
+            fee = min(fee, self.maximum * quantity * price)
+        return max(self.minimum, fee)
+
+    def batch(self, symbols, quantity, price, market=None):
+        quantity = np.asarray(quantity, dtype=np.float64)
+        tier = np.minimum(np.searchsorted(self._bounds, quantity, side='left'),
+                          len(self._rates) - 1)
+        fee = self._rates[tier] * quantity
+        if not self.per_share:
+            fee = fee * price
+        if self.maximum is not None:
+            fee = np.minimum(fee, self.maximum * quantity * price)
+        return np.maximum(self.minimum, fee)
+
+
+# Interactive Brokers的佣金规则（FillEvent.calculate_ib_commission）：
+# 不超过500股时每股0.013，否则每股0.008，最低1.3
+IB_COMMISSION = TieredCommission([(500, 0.013), (np.inf, 0.008)], minimum=1.3)
+
+
+class ExchangeFees(CostComponent):
+    """
+    按交易所收取的费用。fees是交易所到(每股金额, 成交金额的比例)的字典，
+    exchanges是代码到交易所的字典，没有列出的代码使用default交易所，
+    default为None时这些代码不收费。
+    """
+
+    def __init__(self, fees, exchanges, default=None):
+        self.fees = dict((k, (float(a), float(b))) for k, (a, b) in fees.items())
+        self.exchanges = dict(exchanges)
+        self.default = default
+
+    def _rates(self, symbol):
+        exchange = self.exchanges.get(symbol, self.default)
+        return self.fees.get(exchange, (0.0, 0.0))
+
+    def cost(self, symbol, quantity, price, market=None):
+        per_share, fraction = self._rates(symbol)
+        return per_share * quantity + fraction * quantity * price
+
+    def batch(self, symbols, quantity, price, market=None):
+        # 每个不同的代码只查一次表
+        unique, inverse = np.unique(np.asarray(symbols, dtype=object), return_inverse=True)
+        rates = np.array([self._rates(s) for s in unique], dtype=np.float64).reshape(-1, 2)
+        quantity = np.asarray(quantity, dtype=np.float64)
+        return rates[inverse, 0] * quantity + rates[inverse, 1] * quantity * price
+
+
+class SpreadSlippage(CostComponent):
+    """
+    买卖价差造成的滑价：每股的滑价为价格乘以半个价差，spread_bps是以基点表示的
+    价差，可以用spreads字典为每个代码单独指定
+    """
+
+    def __init__(self, spread_bps, spreads=None):
+        self.spread_bps = float(spread_bps)
+        self.spreads = dict(spreads or {})
+
+    def cost(self, symbol, quantity, price, market=None):
+        return price * self.spreads.get(symbol, self.spread_bps) * 0.5e-4
+
+    def batch(self, symbols, quantity, price, market=None):
+        price = np.asarray(price, dtype=np.float64)
+        if not self.spreads:
+            return price * (self.spread_bps * 0.5e-4)
+        bps = np.array([self.spreads.get(s, self.spread_bps) for s in symbols], dtype=np.float64)
+        return price * bps * 0.5e-4
+
+
+class SquareRootImpact(CostComponent):
+    """
+    平方根市场冲击模型：每股的冲击为
+        coefficient * 波动率 * sqrt(成交数量 / 平均成交量) * 价格，
+    波动率是最近window条数据收益率的标准差，平均成交量是最近window条数据成交量的
+    平均值。没有成交量或者波动率的数据、或者成交数量不为正时冲击为0。
+    """
+
+    def __init__(self, coefficient=1.0, window=20):
+        self.coefficient = coefficient
+        self.window = window
+        self.lookback = window
+
+    def cost(self, symbol, quantity, price, market=None):
+        volume = market['volume']
+        volatility = market['volatility']
+        if not (volume > 0 and quantity > 0) or volatility != volatility:
+            return 0.0
+        return self.coefficient * volatility * math.sqrt(quantity / volume) * price
+
+    def batch(self, symbols, quantity, price, market=None):
+        volume = market['volume']
+        volatility = market['volatility']
+        valid = (volume > 0) & (quantity > 0) & ~np.isnan(volatility)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            impact = self.coefficient * volatility * np.sqrt(quantity / volume) * price
+        return np.where(valid, impact, 0.0)
+
+
+class CostModel(object):
+    """
+    由佣金、交易所费用和滑价组成的交易成本模型。成交价格是参考价格加上（买入）
+    或者减去（卖出）所有slippage组成部分的每股滑价之和，佣金是commission和
+    所有fees组成部分按成交价格计算的费用之和。
+    fill用于事件驱动的回测，对单笔成交计算(成交价格, 佣金)；batch对一组成交
+    一次性计算，两者的结果相同。
+    """
+
+    def __init__(self, commission=IB_COMMISSION, fees=(), slippage=()):
+        self.commission = commission
+        self.fees = list(fees)
+        self.slippage = list(slippage)
+        components = [commission] + self.fees + self.slippage
+        self.lookback = max([1] + [c.lookback for c in components if c is not None])
+
+    def market(self, bars, symbol):
+        """
+        从数据处理对象中取出symbol最近lookback条数据的平均成交量和收益率的标准差
+        """
+        if self.lookback <= 1:
+            return None
+        volume = bars.get_latest_bars_values(symbol, 'volume', N=self.lookback)
+        returns = bars.get_latest_bars_values(symbol, 'pct_change', N=self.lookback)
+        return {'volume': _nan_mean(volume), 'volatility': _nan_std(returns)}
+
+    def market_batch(self, columns, rows, cols):
+        """
+        与market相同，对一组成交一次性计算：columns是(时间, 代码)的字段数组
+        （例如BarStore.columns），第k笔成交使用第rows[k]条数据为止的窗口
+        """
+        if self.lookback <= 1:
+            return None
+        return {'volume': _window_reduce(columns['volume'], rows, cols, self.lookback, _nan_mean),
+                'volatility': _window_reduce(columns['pct_change'], rows, cols, self.lookback,
+                                             _nan_std)}
+
+    def fill(self, symbol, quantity, price, buy_or_sell, bars=None):
+        """
+        对单笔成交返回(成交价格, 佣金)
+        """
+        market = self.market(bars, symbol) if bars is not None else None
+        slippage = 0.0
+        for component in self.slippage:
+            slippage += component.cost(symbol, quantity, price, market)
+        if slippage:
+            price = price + slippage if buy_or_sell == 'BUY' else price - slippage
+        commission = 0.0
+        if self.commission is not None:
+            commission = self.commission.cost(symbol, quantity, price, market)
+        for component in self.fees:
+            commission += component.cost(symbol, quantity, price, market)
+        return price, commission
+
+    def batch(self, symbols, quantity, price, direction, market=None):
+        """
+        对一组成交返回(成交价格, 佣金)的数组，direction为1（买入）或者-1（卖出）
+        """
+        quantity = np.asarray(quantity, dtype=np.float64)
+        price = np.asarray(price, dtype=np.float64)
+        if self.slippage:
+            slippage = sum(c.batch(symbols, quantity, price, market) for c in self.slippage)
+            price = price + np.asarray(direction) * slippage
+        commission = np.zeros(len(quantity))
+        if self.commission is not None:
+            commission += self.commission.batch(symbols, quantity, price, market)
+        for component in self.fees:
+            commission += component.batch(symbols, quantity, price, market)
+        return price, commission
+
+
+def _nan_mean(values, axis=None):
+    values = np.asarray(values, dtype=np.float64)
+    count = np.sum(~np.isnan(values), axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nansum(values, axis=axis) / count
+
+
+def _nan_std(values, axis=None):
+    values = np.asarray(values, dtype=np.float64)
+    mean = _nan_mean(values, axis)
+    if axis is not None:
+        mean = np.expand_dims(mean, axis)
+    return np.sqrt(_nan_mean((values - mean) ** 2, axis))
+
+
+def _window_reduce(column, rows, cols, window, reduce):
+    """
+    取出每笔成交在column中第rows[k]-window+1到第rows[k]行、第cols[k]列的窗口
+    （前面不足的部分为NaN），组成(成交数, window)的数组后一次性求值
+    """
+    padded = np.vstack((np.full((window - 1, column.shape[1]), np.nan), column))
+    offsets = np.arange(window)
+    windows = padded[np.asarray(rows)[:, None] + offsets, np.asarray(cols)[:, None]]
+    return reduce(windows, axis=1)
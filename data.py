@@ -4,12 +4,17 @@
 from __future__ import print_function
 
 from abc import ABCMeta, abstractmethod
+from collections import deque
+import heapq
 import os, os.path
 
 import numpy as np
 import pandas as pd
 
+from bar_cache import load_bar_store
+from bar_store import BAR_FIELDS, Bar, BarStore, RingBuffer, compute_pct_change
 from event import MarketEvent
+from ticks import TickBarReader
 
 
 class DataHandler(object):
@@ -58,6 +63,21 @@ class DataHandler(object):
         """
         raise NotImplementedError("Should implement get_latest_bars_values()")
 
+    @abstractmethod
+    def get_history(self, val_type, N=1, symbols=None):
+        """
+        返回最近N条数据中某个字段的NumPy数组视图，symbols可以是单个代码、
+        代码列表或者None（所有代码）
+        """
+        raise NotImplementedError("Should implement get_history()")
+
+    @abstractmethod
+    def get_latest_datetime(self):
+        """
+        返回最近一次update_bars对应的时间
+        """
+        raise NotImplementedError("Should implement get_latest_datetime()")
+
     @abstractmethod
     def update_bars(self):
         """
@@ -66,130 +86,554 @@ class DataHandler(object):
         """
         raise NotImplementedError("Should implement update_bars()")
 
+    def register_indicator(self, indicator):
+        """
+        注册一个增量指标，之后每次update_bars都会用最新的数据截面更新它
+        """
+        self.indicators.append(indicator)
+        return indicator
+
+    def register_lookback(self, N):
+        """
+        声明之后会访问最近N条历史数据。全部数据都在内存中的处理对象可以忽略它，
+        只保留有限历史的处理对象据此决定保留多少条数据
+        """
+        pass
+
+    @staticmethod
+    def _check_published(count):
+        """
+        count（已经发布的数据条数）为0时抛出IndexError。在第一次update_bars之前，
+        数组的第-1行是整个数据集的最后一条，读取它相当于使用了未来的数据
+        """
+        if count <= 0:
+            raise IndexError("No bars have been published yet")
+
+    def _get_symbol_pos(self, symbol):
+        """
+        返回代码在symbol_list中的位置
+        """
+        try:
+            return self._symbol_pos[symbol]
+        except KeyError:
+            print("That symbol is not available in the historical data")
+            raise
 
-class HistoricCSVDataHandler(DataHandler):
+    def _get_column_selector(self, symbols):
+        """
+        把代码列表转换为(时间, 代码)数组的列选择器。在symbol_list中连续排列的代码
+        转换为切片，这样取出的数据是视图；否则只能使用下标数组（会复制数据）。
+        结果会被缓存，所以每条数据的代价是常数。
+        """
+        key = tuple(symbols)
+        try:
+            return self._column_selectors[key]
+        except KeyError:
+            pos = [self._get_symbol_pos(s) for s in key]
+            if pos and pos == list(range(pos[0], pos[0] + len(pos))):
+                selector = slice(pos[0], pos[0] + len(pos))
+            else:
+                selector = np.array(pos, dtype=np.intp)
+            self._column_selectors[key] = selector
+            return selector
+
+
+class ColumnarDataHandler(DataHandler):
+    """
+    ColumnarDataHandler实现了基于列式数组的get_latest_bar*方法。子类需要提供：
+    _columns：字段到(行, 代码)数组的字典；_datetimes：每一行对应的时间；
+    _symbol_pos：代码到列号的字典；bar_index：最新一条数据之后的行号；
+    _first_row：最早一条仍然保留的数据所在的行号（只保留有限历史时大于0）。
+    返回的视图只在下一次update_bars之前有效。
+    """
+    _first_row = 0
+
+    def _latest_row(self):
+        """
+        返回最新一条数据所在的行号，还没有发布任何数据时抛出IndexError
+        """
+        self._check_published(self.bar_index - self._first_row)
+        return self.bar_index - 1
+
+    def get_latest_bar(self, symbol):
+        """
+        从最新的symbol_list中返回最新数据条目
+        """
+        j = self._get_symbol_pos(symbol)
+        t = self._latest_row()
+        return Bar(pd.Timestamp(self._datetimes[t]),
+                   *[self._columns[f][t, j] for f in BAR_FIELDS])
+
+    def get_latest_bars(self, symbol, N=1):
+        """
+        从最近的数据列表中获取N条数据，如果没有那么多，则返回N-k条数据
+        """
+        j = self._get_symbol_pos(symbol)
+        start = max(self.bar_index - N, self._first_row)
+        return Bar(self._datetimes[start:self.bar_index],
+                   *[self._columns[f][start:self.bar_index, j] for f in BAR_FIELDS])
+
+    def get_latest_bar_datetime(self, symbol):
+        """
+        返回最近的数据条目对应的Python datetime
+        """
+        self._get_symbol_pos(symbol)
+        return pd.Timestamp(self._datetimes[self._latest_row()])
+
+    def get_latest_datetime(self):
+        """
+        返回最近一次update_bars对应的时间
+        """
+        return pd.Timestamp(self._datetimes[self._latest_row()])
+
+    def get_latest_bar_value(self, symbol, val_type):
+        """
+        返回最近的数据条目中的Open,High,Low,Close,Volume或OI的值
+        """
+        return self._columns[val_type][self._latest_row(), self._get_symbol_pos(symbol)]
+
+    def get_latest_bars_values(self, symbol, val_type, N=1):
+        """
+        返回latest_symbol_list中的最近N条数据，如果没有那么多，返回N-k条
+        """
+        return self.get_history(val_type, N, symbol)
+
+    def get_history(self, val_type, N=1, symbols=None):
+        """
+        返回最近N条数据中某个字段的值，如果没有那么多，返回N-k条。
+        symbols为单个代码时返回一维视图；为None时返回所有代码的(N, 代码数)视图；
+        为代码列表时返回(N, len(symbols))的数组，代码在symbol_list中连续时为视图。
+        不论N多大，代价都是常数。
+        """
+        rows = slice(max(self.bar_index - N, self._first_row), self.bar_index)
+        column = self._columns[val_type]
+        if symbols is None:
+            return column[rows]
+        if isinstance(symbols, str):
+            return column[rows, self._get_symbol_pos(symbols)]
+        return column[rows, self._get_column_selector(symbols)]
+
+    def _update_indicators(self):
+        """
+        用刚刚发布的数据截面更新所有注册的指标
+        """
+        t = self.bar_index - 1
+        bar = Bar(self._datetimes[t], *[self._columns[f][t] for f in BAR_FIELDS])
+        for indicator in self.indicators:
+            indicator.update(bar)
+
+
+class HistoricCSVDataHandler(ColumnarDataHandler):
     """
     HistoricCSVDataHandler类用来读取请求的代码的CSV文件，这些CSV文件
     存储在磁盘上，提供了一种类似于实际交易的场景的”最近数据“一种概念。
+    数据保存在列式的BarStore当中，bar_index是指向已经发布的数据条数的游标，
+    所有的get_latest_bar*方法都直接返回数组的视图或者标量。
+    如果传入了已经加载好的bar_store，就直接使用它而不再读取CSV文件；
+    如果指定了cache_dir，则从二进制缓存中以内存映射的方式读取数据（见bar_cache）。
+    csv_format指定非yahoo格式的CSV文件（见ingest.CSV_FORMATS）。
     """
 
-    def __init__(self, events, csv_dir, symbol_list):
+    def __init__(self, events, csv_dir, symbol_list, bar_store=None, cache_dir=None,
+                 csv_format=None):
         self.events = events
         self.csv_dir = csv_dir
         self.symbol_list = symbol_list
+        self.cache_dir = cache_dir
+        self.csv_format = csv_format
 
-        self.symbol_data = {}
-        self.latest_symbol_data = {}
+        self.bar_store = bar_store
+        self._column_selectors = {}
+        self.indicators = []
         self.continue_backtest = True
         self.bar_index = 0
-        self.data_generator={}
         self._open_convert_csv_files()
 
     def _open_convert_csv_files(self):
         """
-        从数据路径中打开CSV文件，将它们转化为pandas的DataFrame。
+        从数据路径中打开CSV文件，将它们转化为列式的BarStore。
         这里假设数据来自于yahoo。
         """
-        comb_index = None
-        for s in self.symbol_list:
-            self.symbol_data[s] = pd.io.parsers.read_csv(
-                os.path.join(self.csv_dir, '%s.csv' % s),
-                header=0, index_col=0, parse_dates=True,
-                names=[
-                    'datetime', 'high', 'low',
-                    'open', 'close', 'volume', 'adj_close'
-                ]
-            ).sort_index()
-            if comb_index is None:
-                comb_index = self.symbol_data[s].index
-            else:
-                comb_index.union(self.symbol_data[s].index)
+        if self.bar_store is None and self.cache_dir is not None:
+            self.bar_store = load_bar_store(self.csv_dir, self.symbol_list, self.cache_dir,
+                                            self.csv_format)
+        elif self.bar_store is None:
+            self.bar_store = BarStore.from_csv(self.csv_dir, self.symbol_list, self.csv_format)
+        self._columns = self.bar_store.columns
+        self._datetimes = self.bar_store.index
+        self._symbol_pos = self.bar_store.symbol_pos
 
-            self.latest_symbol_data[s] = []
-        for s in self.symbol_list:
-            self.symbol_data[s] = self.symbol_data[s].reindex(
-                index=comb_index, method='pad'
-            )
-            self.symbol_data[s]["pct_change"] = self.symbol_data[s]["adj_close"].pct_change()
-            # self.symbol_data[s] = self.symbol_data[s].iterrows()  #make the symbol_data as a generator
-            self.data_generator[s] = self.symbol_data[s].iterrows()
-    def _get_new_bar(self, symbol):
+    def update_bars(self):
         """
-        从数据集返回最新的数据条目
+        将游标向前移动一条数据，数据用完时停止回测。
         """
-        for b in  self.data_generator[symbol]:
-            yield b
+        if self.bar_index >= len(self.bar_store):
+            self.continue_backtest = False
+            return
+        self.bar_index += 1
+        if self.indicators:
+            self._update_indicators()
+        self.events.put(MarketEvent.acquire())
+
+
+# CSV文件中的列（yahoo格式），第一列为时间
+CSV_COLUMNS = ['datetime', 'high', 'low', 'open', 'close', 'volume', 'adj_close']
+# 读取一块CSV之后，按BAR_FIELDS的顺序取出的列（pct_change由处理对象计算）
+_CSV_FIELDS = [f for f in BAR_FIELDS if f != 'pct_change']
+_EXHAUSTED = np.iinfo(np.int64).max
+
+
+class _ChunkedCSVReader(object):
+    """
+    按块读取单个代码的CSV文件，每次只在内存中保留一块（有界的前瞻缓冲）。
+    文件需要按时间升序排列。
+    """
+
+    def __init__(self, path, chunksize):
+        self._chunks = pd.read_csv(
+            path, header=0, index_col=0, parse_dates=True,
+            names=CSV_COLUMNS, chunksize=chunksize
+        )
+        self._times = None
+        self._values = None
+        self._pos = 0
+        self.head = _EXHAUSTED
+        self._load_chunk()
+
+    def _load_chunk(self):
+        for chunk in self._chunks:
+            if len(chunk):
+                self._times = chunk.index.values.astype('datetime64[ns]').view(np.int64)
+                self._values = chunk[_CSV_FIELDS].values.astype(np.float64)
+                self._pos = 0
+                self.head = self._times[0]
+                return
+        self._times = None
+        self._values = None
+        self.head = _EXHAUSTED
+
+    def pop(self):
+        """
+        返回当前数据条目的各字段值，并前进到下一条
+        """
+        values = self._values[self._pos]
+        self._pos += 1
+        if self._pos < len(self._times):
+            self.head = self._times[self._pos]
+        else:
+            self._load_chunk()
+        return values
+
+
+class StreamingCSVDataHandler(ColumnarDataHandler):
+    """
+    StreamingCSVDataHandler按块读取每个代码的CSV文件，适用于无法全部装入内存的
+    数据集（例如多年的分钟数据）。每个代码只在内存中保留一块尚未发布的数据，
+    各个代码按时间归并，某个代码在某个时间点没有数据时沿用上一条数据。
+    已经发布的历史数据保存在每个字段一个的环形缓冲（bar_store.RingBuffer）中，
+    只保留max_lookback条（可以通过register_lookback增大，策略的lookback在创建
+    回测时自动注册），所以内存与回测的长度无关。get_latest_bar*的用法与
+    HistoricCSVDataHandler相同，返回的窗口是连续的视图，请求超过保留条数的数据时
+    返回N-k条。CSV文件需要按时间升序排列。
+    """
+
+    def __init__(self, events, csv_dir, symbol_list, chunksize=100000, max_lookback=1):
+        self.events = events
+        self.csv_dir = csv_dir
+        self.symbol_list = symbol_list
+        self.chunksize = chunksize
+
+        self._symbol_pos = dict((s, j) for j, s in enumerate(self.symbol_list))
+        self._column_selectors = {}
+        self.indicators = []
+        self.continue_backtest = True
+        n = len(self.symbol_list)
+        self.max_lookback = max(max_lookback, 1)
+        self._buffers = dict((f, RingBuffer(self.max_lookback, (n,))) for f in BAR_FIELDS)
+        self._time_buffer = RingBuffer(self.max_lookback, (), 'datetime64[ns]',
+                                       np.datetime64('NaT'))
+        self._row = np.full(n, np.nan)
+        self._prev_adj_close = np.full(n, np.nan)
+        self._sync_buffers()
+        self._readers = [self._open_reader(s) for s in self.symbol_list]
+        self._heads = np.array([r.head for r in self._readers], dtype=np.int64)
+
+    def _open_reader(self, symbol):
+        """
+        打开一个代码的数据源，返回有head属性和pop方法的读取对象
+        """
+        return _ChunkedCSVReader(os.path.join(self.csv_dir, '%s.csv' % symbol), self.chunksize)
+
+    def _sync_buffers(self):
+        """
+        让ColumnarDataHandler的get_latest_bar*方法直接读取环形缓冲的数组
+        """
+        self._columns = dict((f, b.data) for f, b in self._buffers.items())
+        self._datetimes = self._time_buffer.data
+        self.bar_index = self._time_buffer.end
+        self._first_row = self._time_buffer.start
+
+    def register_lookback(self, N):
+        """
+        保证至少保留最近N条历史数据，已经发布的数据中最近的部分保留下来
+        """
+        if N <= self.max_lookback:
+            return
+        self.max_lookback = N
+        for buffer in self._buffers.values():
+            buffer.resize(N)
+        self._time_buffer.resize(N)
+        self._sync_buffers()
+
+    def update_bars(self):
+        """
+        发布下一个时间点的数据：在这个时间点有数据的代码读入新的一条，
+        其余的代码沿用上一条数据。
+        """
+        now = self._heads.min()
+        if now == _EXHAUSTED:
+            self.continue_backtest = False
+            return
+        updated = np.flatnonzero(self._heads == now)
+        values = [self._readers[j].pop() for j in updated]
+        self._heads[updated] = [self._readers[j].head for j in updated]
+
+        row = self._row
+        adj_close = self._buffers['adj_close']
+        # 容量为1时上一条数据会被覆盖，所以先保存上一条的adj_close
+        has_prev = adj_close.count > 0
+        if has_prev:
+            self._prev_adj_close[:] = adj_close.last
+        for k, f in enumerate(_CSV_FIELDS):
+            buffer = self._buffers[f]
+            if has_prev:
+                row[:] = buffer.last
+            for j, v in zip(updated, values):
+                row[j] = v[k]
+            buffer.append(row)
+        if has_prev:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                np.divide(adj_close.last, self._prev_adj_close, out=row)
+            row -= 1.0
+        else:
+            row[:] = np.nan
+        self._buffers['pct_change'].append(row)
+        self._time_buffer.append(now)
+        self._sync_buffers()
+
+        if self.indicators:
+            self._update_indicators()
+        self.events.put(MarketEvent.acquire())
+
+
+class TickBarDataHandler(StreamingCSVDataHandler):
+    """
+    TickBarDataHandler读取每个代码的逐笔成交文件（csv_dir/<代码>.csv，列为
+    ticks.TICK_COLUMNS），在回测过程中增量地聚合为K线并按时间归并发布，
+    不保存成交的历史，也不需要事先把K线写入磁盘。
+    bar是主周期（例如'1min'、'tick:500'、'volume:10000'，见ticks.make_aggregator），
+    驱动MarketEvent和所有的get_latest_bar*方法；resolutions中的其他周期用同一遍
+    成交数据聚合，K线的时间到达之后才能通过get_resolution_bars取得，
+    每个周期保留最近resolution_lookback根。
+    按成交笔数和成交量聚合的K线以最后一笔成交的时间为标签，同一时间的多笔成交
+    分属两根K线时，后一根的标签推后1纳秒（见ticks.BarAggregator._label），
+    所以每个代码的时间索引不会重复。
+    """
+
+    def __init__(self, events, csv_dir, symbol_list, bar='1min', resolutions=(),
+                 chunksize=100000, max_lookback=1, resolution_lookback=100):
+        self.bar = bar
+        self.resolutions = list(resolutions)
+        self._resolution_bars = dict(
+            (r, [deque(maxlen=resolution_lookback) for s in symbol_list])
+            for r in self.resolutions
+        )
+        super(TickBarDataHandler, self).__init__(events, csv_dir, symbol_list,
+                                                 chunksize, max_lookback)
+
+    def _open_reader(self, symbol):
+        return TickBarReader(os.path.join(self.csv_dir, '%s.csv' % symbol), self.bar,
+                             self.chunksize, self.resolutions)
+
+    def update_bars(self):
+        super(TickBarDataHandler, self).update_bars()
+        if self.resolutions and self.continue_backtest:
+            self._release_resolution_bars(self._datetimes[self.bar_index - 1].view(np.int64))
+
+    def _release_resolution_bars(self, now):
+        """
+        把时间不晚于当前时刻的其他周期的K线移入各自的历史
+        """
+        for r in self.resolutions:
+            histories = self._resolution_bars[r]
+            for j, reader in enumerate(self._readers):
+                pending = reader.pending[r]
+                history = histories[j]
+                while pending and pending[0][0] <= now:
+                    t, values = pending.popleft()
+                    prev = history[-1].adj_close if history else np.nan
+                    pct_change = values[-1] / prev - 1.0
+                    history.append(Bar(pd.Timestamp(t, unit='ns'), *(values + (pct_change,))))
+
+    def get_resolution_bars(self, resolution, symbol, N=1):
+        """
+        返回symbol在resolution周期上最近的N根已经完成的K线（Bar的列表）
+        """
+        history = self._resolution_bars[resolution][self._get_symbol_pos(symbol)]
+        return list(history)[-N:]
+
+
+class SparseCSVDataHandler(DataHandler):
+    """
+    SparseCSVDataHandler把每个代码的数据按各自的时间保存，不对齐到共同的时间索引，
+    内存只与实际的数据条数成正比，适用于有上市、退市或者交易时间不同的稀疏股票池。
+    每个代码有一个游标，用一个以下一条数据时间为键的堆做多路归并：每次update_bars
+    只发布在下一个时间点真正有数据的代码，并在MarketEvent.symbols中列出它们。
+    单个代码的历史数据是连续的视图；多个代码的窗口需要按各自的游标拼接，所以是副本，
+    没有数据的位置为NaN。N=1时直接返回每个代码最近的值。
+    """
+
+    def __init__(self, events, csv_dir, symbol_list):
+        self.events = events
+        self.csv_dir = csv_dir
+        self.symbol_list = symbol_list
+
+        self._symbol_pos = dict((s, j) for j, s in enumerate(self.symbol_list))
+        self._column_selectors = {}
+        self.indicators = []
+        self.continue_backtest = True
+        self.latest_datetime = None
+        self._times = []
+        self._columns = []
+        self._open_convert_csv_files()
+
+        n = len(self.symbol_list)
+        self._cursor = np.zeros(n, dtype=np.intp)
+        self._last = dict((f, np.full(n, np.nan)) for f in BAR_FIELDS)
+        self._updated = np.zeros(0, dtype=np.intp)
+        self._heap = [(int(t[0]), j) for j, t in enumerate(self._times) if len(t)]
+        heapq.heapify(self._heap)
+
+    def _open_convert_csv_files(self):
+        """
+        读取每个代码的CSV文件，保存为各自独立的一维数组
+        """
+        for s in self.symbol_list:
+            frame = pd.read_csv(
+                os.path.join(self.csv_dir, '%s.csv' % s),
+                header=0, index_col=0, parse_dates=True, names=CSV_COLUMNS
+            ).sort_index()
+            columns = dict((f, np.ascontiguousarray(frame[f].values, dtype=np.float64))
+                           for f in _CSV_FIELDS)
+            columns['pct_change'] = compute_pct_change(columns['adj_close'])
+            self._times.append(frame.index.values.astype('datetime64[ns]').view(np.int64))
+            self._columns.append(columns)
 
     def get_latest_bar(self, symbol):
         """
         从最新的symbol_list中返回最新数据条目
         """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data")
-            raise
-        else:
-            return bars_list[-1]
+        j = self._get_symbol_pos(symbol)
+        self._check_published(self._cursor[j])
+        t = self._cursor[j] - 1
+        columns = self._columns[j]
+        return Bar(pd.Timestamp(self._times[j][t], unit='ns'),
+                   *[columns[f][t] for f in BAR_FIELDS])
 
     def get_latest_bars(self, symbol, N=1):
         """
         从最近的数据列表中获取N条数据，如果没有那么多，则返回N-k条数据
         """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data")
-            raise
-        else:
-            return bars_list[-N:]
+        j = self._get_symbol_pos(symbol)
+        rows = slice(max(self._cursor[j] - N, 0), self._cursor[j])
+        columns = self._columns[j]
+        return Bar(self._times[j][rows].view('datetime64[ns]'),
+                   *[columns[f][rows] for f in BAR_FIELDS])
 
     def get_latest_bar_datetime(self, symbol):
         """
-        返回最近的数据条目对应的Python datetime
+        返回这个代码最近的数据条目对应的Python datetime
         """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data")
-            raise
-        else:
-            return bars_list[-1][0]
+        j = self._get_symbol_pos(symbol)
+        self._check_published(self._cursor[j])
+        return pd.Timestamp(self._times[j][self._cursor[j] - 1], unit='ns')
+
+    def get_latest_datetime(self):
+        """
+        返回最近一次update_bars对应的时间
+        """
+        self._check_published(self.latest_datetime is not None)
+        return self.latest_datetime
 
     def get_latest_bar_value(self, symbol, val_type):
         """
-        返回最近的数据pandas Series对象中的Open,High,Low,Close,Volume或OI的值
+        返回这个代码最近的数据条目中某个字段的值。回测开始之后这个代码还没有数据时
+        返回NaN
         """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That Symbol is not available in the historical data")
-            raise
-        else:
-            return getattr(bars_list[-1][1], val_type)
+        self._check_published(self.latest_datetime is not None)
+        return self._last[val_type][self._get_symbol_pos(symbol)]
 
     def get_latest_bars_values(self, symbol, val_type, N=1):
         """
         返回latest_symbol_list中的最近N条数据，如果没有那么多，返回N-k条
         """
-        try:
-            bars_list = self.get_latest_bars(symbol, N)
-        except KeyError:
-            print("That Symbol is not available in the historical data")
-            raise
-        else:
-            return np.array([getattr(b[1], val_type) for b in bars_list])
+        return self.get_history(val_type, N, symbol)
+
+    def get_history(self, val_type, N=1, symbols=None):
+        """
+        返回最近N条数据中某个字段的值。symbols为单个代码时返回这个代码自己的
+        最近N-k条数据（视图）；否则返回(N, 代码数)的数组，每一列是对应代码
+        自己最近的N条数据，不足的部分为NaN。
+        """
+        if isinstance(symbols, str):
+            j = self._get_symbol_pos(symbols)
+            return self._columns[j][val_type][max(self._cursor[j] - N, 0):self._cursor[j]]
+        selector = slice(None) if symbols is None else self._get_column_selector(symbols)
+        if N == 1:
+            return self._last[val_type][None, selector]
+        positions = np.arange(len(self.symbol_list))[selector]
+        out = np.full((N, len(positions)), np.nan)
+        for k, j in enumerate(positions):
+            window = self._columns[j][val_type][max(self._cursor[j] - N, 0):self._cursor[j]]
+            out[N - len(window):, k] = window
+        return out
 
     def update_bars(self):
         """
-        将最近的数据条目放入到latest_symbol_data结构中。
+        从堆中取出下一个时间点上所有有数据的代码，把它们的游标向前移动一条
         """
-        for s in self.symbol_list:
-            try:
-                bar = next(self._get_new_bar(s))
-            except StopIteration:
-                self.continue_backtest = False
-            else:
-                if bar is not None:
-                    self.latest_symbol_data[s].append(bar)
-        self.events.put(MarketEvent())
+        if not self._heap:
+            self.continue_backtest = False
+            return
+        now = self._heap[0][0]
+        updated = []
+        while self._heap and self._heap[0][0] == now:
+            j = heapq.heappop(self._heap)[1]
+            c = self._cursor[j] + 1
+            self._cursor[j] = c
+            if c < len(self._times[j]):
+                heapq.heappush(self._heap, (int(self._times[j][c]), j))
+            updated.append(j)
+        updated = np.array(updated, dtype=np.intp)
+        for f in BAR_FIELDS:
+            for j in updated:
+                self._last[f][j] = self._columns[j][f][self._cursor[j] - 1]
+
+        self.latest_datetime = pd.Timestamp(now, unit='ns')
+        self._updated = updated
+        if self.indicators:
+            self._update_indicators()
+        self.events.put(MarketEvent.acquire([self.symbol_list[j] for j in updated]))
+
+    def _update_indicators(self):
+        """
+        用刚刚发布的数据更新所有注册的指标，这一时刻没有数据的代码为NaN
+        """
+        values = []
+        for f in BAR_FIELDS:
+            cross = np.full(len(self.symbol_list), np.nan)
+            cross[self._updated] = self._last[f][self._updated]
+            values.append(cross)
+        bar = Bar(self.latest_datetime, *values)
+        for indicator in self.indicators:
+            indicator.update(bar)
@@ -14,6 +14,8 @@ from matplotlib.dates import date2num
 import copy
 import pandas as pd
 
+from bar_store import BarStore
+
 
 class plot_performance():
     def __init__(self, equity_curve, stock_curve, summary_recording):
@@ -73,6 +75,36 @@ class plot_performance():
     def show_all_plot(self):
         pass
         # plt.show()
+
+
+def plot_results(output_dir='.', csv_dir=None, symbol=None, csv_format=None):
+    """
+    回测结束之后的画图步骤：从output_dir中读取run_batch/run_trading写出的
+    equity.csv和Execution_summary.csv，从csv_dir中读取symbol的行情数据，
+    csv_format是行情数据的格式（见ingest.CSV_FORMATS），None表示yahoo格式
+    """
+    equity_curve = pd.read_csv(os.path.join(output_dir, 'equity.csv'),
+                               index_col=0, parse_dates=True)
+    records = pd.read_csv(os.path.join(output_dir, 'Execution_summary.csv'),
+                          index_col=0, parse_dates=['date_time'])
+    stock_curve = BarStore.from_csv(csv_dir, [symbol], csv_format).to_frame(symbol)
+    my_plot = plot_performance(equity_curve, stock_curve, records)
+    my_plot.plot_equity_curve()
+    my_plot.plot_stock_curve()
+    my_plot.show_all_plot()
+    return my_plot
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Plot the result files of a backtest")
+    parser.add_argument('csv_dir')
+    parser.add_argument('symbol')
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--format', default=None, help="CSV format (see ingest.CSV_FORMATS)")
+    args = parser.parse_args()
+    plot_results(args.output_dir, args.csv_dir, args.symbol, args.format)
+
 # if __name__=="__main__":
 #     data=pd.io.parsers.read_csv(
 #         "equity.csv",header=0,
@@ -4,22 +4,60 @@
 
 from __future__ import print_function
 
+from collections import deque
+
+from costs import IB_COMMISSION
+
 
 class Event(object):
     """
     Event的基类，提供所有后续子类的一个接口，在后续的交易系统中会触发进一步的
     事件。
+    事件对象使用__slots__，没有实例的__dict__；type是类属性。
     """
-    pass
+    __slots__ = ()
+    type = None
+
+
+class EventQueue(deque):
+    """
+    回测使用的事件队列。回测在单线程中运行，所以直接使用deque，不需要加锁，
+    也不需要用异常来表示队列已空。put与queue.Queue.put的用法相同。
+    """
+    put = deque.append
 
 
 class MarketEvent(Event):
     """
-    处理接收到新的市场数据的更新
+    处理接收到新的市场数据的更新。symbols是这一时刻有新数据的代码列表，
+    为None时表示所有代码都有新数据
+    每条数据都会产生一个MarketEvent，所以可以通过acquire/release在一个复用池中
+    重复使用同一个对象，避免频繁的分配和垃圾回收。
     """
+    __slots__ = ('symbols',)
+    type = 'MARKET'
+    _pool = []
 
-    def __init__(self):
-        self.type = 'MARKET'
+    def __init__(self, symbols=None):
+        self.symbols = symbols
+
+    @classmethod
+    def acquire(cls, symbols=None):
+        """
+        从复用池中取出一个MarketEvent，池为空时新建一个
+        """
+        pool = cls._pool
+        event = pool.pop() if pool else cls.__new__(cls)
+        event.symbols = symbols
+        return event
+
+    def release(self):
+        """
+        所有的处理函数都处理完之后把事件放回复用池，之后这个对象会被再次使用，
+        所以处理函数不能保留对它的引用
+        """
+        self.symbols = None
+        self._pool.append(self)
 
 
 class SignalEvent(Event):
@@ -27,11 +65,13 @@ class SignalEvent(Event):
     处理从Strategy对象发来的信号的事件，信号会被Portfolio对象所接收并且
     根据这个信号来采取行动
     """
+    __slots__ = ('strategy_id', 'date_time', 'symbol', 'datetime', 'signal_type',
+                 'strength', 'order_price')
+    type = 'SIGNAL'
 
     def __init__(self, strategy_id, date_time, symbol, datetime, signal_type, order_price, strength):
         self.strategy_id = strategy_id
         self.date_time = date_time
-        self.type = 'SIGNAL'
         self.symbol = symbol
         self.datetime = datetime
         self.signal_type = signal_type
@@ -43,17 +83,24 @@ class OrderEvent(Event):
     """
     处理向执行系统提交的订单（Order）信息。这个订单包括一个代码，一个类型
     （市价还是限价），数量以及方向
+    order_type为'MKT'（市价）、'LMT'（限价，价格为order_price）、'STP'（止损，
+    触发价为stop_price，没有给出时为order_price）或者'STP LMT'（止损限价，
+    触发价为stop_price，触发后以order_price为限价）。
     """
+    __slots__ = ('date_time', 'symbol', 'order_type', 'quantity', 'buy_or_sell',
+                 'direction', 'order_price', 'stop_price')
+    type = 'ORDER'
 
-    def __init__(self, date_time, symbol, order_type, quantity, buy_or_sell, order_price, direction):
+    def __init__(self, date_time, symbol, order_type, quantity, buy_or_sell, order_price, direction,
+                 stop_price=None):
         self.date_time = date_time
-        self.type = 'ORDER'
         self.symbol = symbol
         self.order_type = order_type
         self.quantity = quantity
         self.buy_or_sell = buy_or_sell
         self.direction = direction
         self.order_price = order_price
+        self.stop_price = stop_price
     def print_order(self):
         """
         输出订单中的相关信息
@@ -69,11 +116,14 @@ class FillEvent(Event):
     封装订单执行这样一种概念，这个概念是由交易所所返回的。存储交易的数量，
     价格。另外，还要存储交易的佣金和手续费。
     在这里不支持一个订单有多个价格。
+    fill_cost是每股的成交价格，为None时组合按最新的adj_close计算。
     """
+    __slots__ = ('date_time', 'symbol', 'quantity', 'buy_or_sell', 'fill_cost',
+                 'commission')
+    type = 'FILL'
 
     def __init__(self, date_time, symbol, quantity, buy_or_sell,
                  fill_cost, commission=None):
-        self.type = 'FILL'
         self.date_time = date_time
         self.symbol = symbol
        # self.exchange = exchange
@@ -88,11 +138,13 @@ class FillEvent(Event):
 
     def calculate_ib_commission(self):
         """
-        用来计算基于Interactive Brokers的交易费用。
+        用来计算基于Interactive Brokers的交易费用（规则见costs.IB_COMMISSION）。
         """
-        full_cost = 1.3
-        if self.quantity <= 500:
-            full_cost = max(1.3, 0.013 * self.quantity)
-        else:
-            full_cost = max(1.3, 0.008 * self.quantity)
-        return full_cost
+        return IB_COMMISSION.cost(self.symbol, self.quantity, None)
+
+
+def ib_commission(quantity):
+    """
+    FillEvent.calculate_ib_commission的向量化版本，对一组成交数量一次性计算佣金
+    """
+    return IB_COMMISSION.batch(None, quantity, None)
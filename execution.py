@@ -5,6 +5,12 @@
 from __future__ import print_function
 
 from abc import ABCMeta, abstractmethod
+from array import array
+from collections import deque
+import heapq
+import itertools
+
+import numpy as np
 import pandas as pd
 
 try:
@@ -15,6 +21,64 @@ except ImportError:
 from event import FillEvent
 
 
+class TradeBlotter(object):
+    """
+    成交记录。每一列保存在一个可以追加的缓冲中（数值列使用array('d')，其余使用list），
+    追加的均摊代价是O(1)，只有在需要的时候才转换为DataFrame或者写入文件。
+    """
+    COLUMNS = ('date_time', 'symbol', 'direction', 'quantity', 'order_price',
+               'return_profit', 'return_profit_pct')
+    _NUMERIC = ('order_price', 'return_profit', 'return_profit_pct')
+
+    def __init__(self):
+        self._columns = dict(
+            (c, array('d') if c in self._NUMERIC else []) for c in self.COLUMNS
+        )
+        self._frame = None
+
+    def __len__(self):
+        return len(self._columns['date_time'])
+
+    def append(self, date_time, symbol, direction, quantity, order_price,
+               return_profit=np.nan, return_profit_pct=np.nan):
+        """
+        追加一条成交记录
+        """
+        columns = self._columns
+        columns['date_time'].append(date_time)
+        columns['symbol'].append(symbol)
+        columns['direction'].append(direction)
+        columns['quantity'].append(quantity)
+        columns['order_price'].append(order_price)
+        columns['return_profit'].append(return_profit)
+        columns['return_profit_pct'].append(return_profit_pct)
+        self._frame = None
+
+    def to_frame(self):
+        """
+        转换为DataFrame，结果会被缓存到下一次追加为止
+        """
+        if self._frame is None:
+            self._frame = pd.DataFrame(
+                dict((c, np.asarray(self._columns[c]) if c in self._NUMERIC
+                      else self._columns[c]) for c in self.COLUMNS),
+                columns=list(self.COLUMNS)
+            )
+        return self._frame
+
+    def to_csv(self, path, **kwargs):
+        """
+        写入CSV文件
+        """
+        self.to_frame().to_csv(path, **kwargs)
+
+    def to_parquet(self, path, **kwargs):
+        """
+        写入Parquet文件（需要安装pyarrow或者fastparquet）
+        """
+        self.to_frame().to_parquet(path, **kwargs)
+
+
 class ExecutionHandler(object, metaclass=ABCMeta):
     """
     ExecutionHandler抽象类处理由Portfolio生成的order对象与实际市场中发生的
@@ -29,45 +93,309 @@ class ExecutionHandler(object, metaclass=ABCMeta):
         """
         raise NotImplementedError("Should implement execute_order()")
 
+    def on_market(self, event, bars):
+        """
+        每条新数据发布之后调用，模拟撮合的处理对象在这里用新数据撮合挂单
+        """
+        pass
+
 
 class SimulatedExecutionHandler(ExecutionHandler):
     """
     这是一个模拟的执行处理，简单的将所有的订单对象转化为等价的成交对象，不考虑
     时延，滑价以及成交比率的影响。
+    cost_model（见costs.CostModel）不为None时，成交价格和佣金由它计算：
+    参考价格为最新的adj_close，加上滑价和市场冲击得到成交价格。
     """
 
-    def __init__(self, events):
+    def __init__(self, events, cost_model=None):
         self.events = events
-        self.execution_records = pd.DataFrame(columns=['date_time', 'symbol', 'direction', 'quantity', 'order_price',
-                                                       'return_profit', 'return_profit_pct' ])
+        self.cost_model = cost_model
+        self.bars = None
+        self.blotter = TradeBlotter()
         self.recent_deal_average_cost = 0
         self.entry_time = 0
+
+    @property
+    def execution_records(self):
+        """
+        以DataFrame的形式返回所有的成交记录
+        """
+        return self.blotter.to_frame()
+
     def execute_order(self, event):
         """
         Generate the order event and make the execution log
         """
         if event.type == 'ORDER':
-            fill_event = FillEvent(event.date_time,
-                                   event.symbol,
-                                   event.quantity, event.buy_or_sell, fill_cost=None, commission=None)
+            fill_event = self._fill_event(event.date_time,
+                                          event.symbol,
+                                          event.quantity, event.buy_or_sell, None)
             self.events.put(fill_event)
-            if event.direction != 'EXIT':
-                self.entry_time += 1
-                self.execution_records = self.execution_records.append(
-                    pd.DataFrame(
-                        {'date_time': [event.date_time],'symbol': [event.symbol],'direction': [event.direction],
-                         'quantity': [event.quantity], 'order_price': [event.order_price],
-                         'return_profit': None, 'return_profit_pct': None}))
-                self.recent_deal_average_cost = self.recent_deal_average_cost*(self.entry_time-1)/(self.entry_time) + event.order_price/(self.entry_time)
-            else:
-                return_profit = (event.order_price - self.recent_deal_average_cost)*event.quantity
-                return_profit_pct = (event.order_price - self.recent_deal_average_cost)/self.recent_deal_average_cost
-                self.execution_records = self.execution_records.append(
-                    pd.DataFrame(
-                        {'date_time': [event.date_time], 'symbol': [event.symbol], 'direction': [event.direction],
-                         'quantity': [event.quantity], 'order_price': [event.order_price],'return_profit': return_profit,
-                         'return_profit_pct': return_profit_pct }))
+            self._record(event.date_time, event.symbol, event.direction, event.quantity,
+                         event.order_price if fill_event.fill_cost is None else fill_event.fill_cost)
+
+    def on_market(self, event, bars):
+        """
+        保存数据处理对象，成本模型用它取得参考价格和市场数据
+        """
+        if self.bars is None and self.cost_model is not None:
+            bars.register_lookback(self.cost_model.lookback)
+        self.bars = bars
+
+    def _fill_event(self, date_time, symbol, quantity, buy_or_sell, price, limit=None):
+        """
+        生成FillEvent，price为None表示按最新的adj_close成交，limit是限价单的限价。
+        没有成本模型时佣金按FillEvent的默认规则计算
+        """
+        if self.cost_model is None:
+            return FillEvent(date_time, symbol, quantity, buy_or_sell,
+                             fill_cost=price, commission=None)
+        if price is None:
+            price = self.bars.get_latest_bar_value(symbol, 'adj_close')
+        price, commission = self.cost_model.fill(symbol, quantity, price, buy_or_sell, self.bars)
+        if limit is not None:
+            price = min(price, limit) if buy_or_sell == 'BUY' else max(price, limit)
+        return FillEvent(date_time, symbol, quantity, buy_or_sell,
+                         fill_cost=price, commission=commission)
+
+    def _record(self, date_time, symbol, direction, quantity, price, closed=True):
+        """
+        记录一笔成交。开仓时更新平均成本，平仓（EXIT）时计算这一轮交易的盈亏，
+        closed为False表示平仓的订单还没有全部成交，暂时不清空平均成本
+        """
+        if direction != 'EXIT':
+            self.entry_time += 1
+            self.blotter.append(date_time, symbol, direction, quantity, price)
+            self.recent_deal_average_cost = self.recent_deal_average_cost*(self.entry_time-1)/(self.entry_time) + price/(self.entry_time)
+        else:
+            return_profit = (price - self.recent_deal_average_cost)*quantity
+            return_profit_pct = (price - self.recent_deal_average_cost)/self.recent_deal_average_cost
+            self.blotter.append(date_time, symbol, direction, quantity, price,
+                                return_profit, return_profit_pct)
+            if closed:
                 self.recent_deal_average_cost = 0
                 self.entry_time = 0
 
 
+# 挂单簿的四个方向。堆的键为sign*价格，这样每个方向最先被触发的订单总在堆顶，
+# 并且触发条件都可以写成"键 <= 界限"：买入限价和卖出止损的界限为-最低价，
+# 卖出限价和买入止损的界限为最高价
+_BUY_LIMIT, _SELL_LIMIT, _BUY_STOP, _SELL_STOP = range(4)
+_SIGNS = (-1.0, 1.0, 1.0, -1.0)
+
+
+class _RestingOrder(object):
+    """
+    挂单簿中的一个订单，remaining是还没有成交的数量
+    """
+    __slots__ = ('order', 'remaining', 'active')
+
+    def __init__(self, order):
+        self.order = order
+        self.remaining = order.quantity
+        self.active = True
+
+
+class MatchingExecutionHandler(SimulatedExecutionHandler):
+    """
+    模拟撮合的执行处理。市价单与SimulatedExecutionHandler相同，立即按最新的adj_close
+    成交；限价单、止损单和止损限价单挂在每个代码按价格排序的挂单簿中，从下一条数据
+    开始用每条数据的开盘价、最高价和最低价撮合：
+      买入限价单在最低价不高于限价时成交，价格为min(限价, 开盘价)，卖出限价单相反；
+      买入止损单在最高价不低于触发价时成交，价格为max(触发价, 开盘价)，卖出止损单相反；
+      止损限价单触发后，按止损单计算的成交价不超过限价时立即成交，否则从下一条数据
+      开始作为限价单挂出。
+    每个方向的挂单是一个以价格为键的堆，所有代码的堆顶价格保存在(方向, 代码)的数组中，
+    每条数据用一次向量化的比较找出被触发的代码，之后每笔成交的代价是O(log n)，
+    所以撮合的代价与成交的笔数成正比，而不是与挂单数乘以数据条数成正比。
+    participation不为None时，每个代码在每条数据上的成交量不超过这条数据成交量的
+    participation倍，没有成交的部分留在挂单簿中，在之后的数据上继续成交；
+    已经触发的止损单剩余的部分从下一条数据开始按开盘价成交，止损限价单剩余的
+    部分作为限价单挂出。
+    有成本模型时，上面的成交价格作为参考价格再加上滑价，但限价单的成交价格
+    不会比限价更差。
+    """
+
+    def __init__(self, events, participation=None, cost_model=None):
+        super(MatchingExecutionHandler, self).__init__(events, cost_model)
+        self.participation = participation
+        self._seq = itertools.count()
+        self._symbol_pos = None
+        self._books = None
+        self._best = None
+        self._resting = {}
+        # 已经触发、还没有全部成交的止损单，代码的列号 -> deque
+        self._triggered = {}
+
+    @property
+    def open_orders(self):
+        """
+        还在挂单簿中的订单
+        """
+        return [r.order for r in self._resting.values()]
+
+    def _init_books(self, symbol_list):
+        n = len(symbol_list)
+        self._symbol_pos = dict((s, j) for j, s in enumerate(symbol_list))
+        self._books = [[[] for j in range(n)] for side in range(4)]
+        self._best = np.full((4, n), np.inf)
+
+    def execute_order(self, event):
+        """
+        市价单立即成交，其余的订单放入挂单簿
+        """
+        if event.type != 'ORDER':
+            return
+        if event.order_type == 'MKT':
+            return super(MatchingExecutionHandler, self).execute_order(event)
+        buy = event.buy_or_sell == 'BUY'
+        if event.order_type == 'LMT':
+            side, price = (_BUY_LIMIT if buy else _SELL_LIMIT), event.order_price
+        elif event.order_type in ('STP', 'STP LMT'):
+            side = _BUY_STOP if buy else _SELL_STOP
+            price = event.stop_price if event.stop_price is not None else event.order_price
+        else:
+            raise ValueError("Unsupported order type %s" % event.order_type)
+        resting = _RestingOrder(event)
+        self._resting[id(event)] = resting
+        self._push(side, resting, price)
+
+    def cancel_order(self, order):
+        """
+        撤销一个还没有全部成交的订单，返回是否撤销成功。
+        订单只是被标记为无效，在到达堆顶时才真正移出挂单簿
+        """
+        resting = self._resting.pop(id(order), None)
+        if resting is None:
+            return False
+        resting.active = False
+        return True
+
+    def _push(self, side, resting, price):
+        j = self._symbol_pos[resting.order.symbol]
+        heap = self._books[side][j]
+        heapq.heappush(heap, (_SIGNS[side] * price, next(self._seq), resting))
+        self._best[side, j] = heap[0][0]
+
+    def on_market(self, event, bars):
+        """
+        用刚刚发布的数据撮合挂单簿中被触发的订单，先撮合止损单，再撮合限价单
+        """
+        super(MatchingExecutionHandler, self).on_market(event, bars)
+        if self._books is None:
+            self._init_books(bars.symbol_list)
+        if not self._resting:
+            return
+        low = bars.get_history('low', 1)[-1]
+        high = bars.get_history('high', 1)[-1]
+        with np.errstate(invalid='ignore'):
+            triggered = self._best <= np.array([-low, high, high, -low])
+        pending = np.zeros(triggered.shape[1], dtype=bool)
+        pending[list(self._triggered)] = True
+        if event.symbols is not None:
+            # 只有这一时刻有新数据的代码参与撮合
+            updated = np.zeros(triggered.shape[1], dtype=bool)
+            updated[[self._symbol_pos[s] for s in event.symbols]] = True
+            triggered &= updated
+            pending &= updated
+        columns = np.flatnonzero(triggered.any(axis=0) | pending)
+        if not len(columns):
+            return
+
+        open_ = bars.get_history('open', 1)[-1]
+        volume = bars.get_history('volume', 1)[-1]
+        date_time = bars.get_latest_datetime()
+        converted = []
+        for j in columns:
+            capacity = np.inf if self.participation is None \
+                else self.participation * volume[j]
+            # 之前已经触发的止损单先按开盘价成交
+            if pending[j]:
+                capacity = self._match_triggered(j, open_[j], capacity, date_time)
+            for side in (_BUY_STOP, _SELL_STOP, _BUY_LIMIT, _SELL_LIMIT):
+                if triggered[side, j]:
+                    bound = high[j] if _SIGNS[side] > 0 else -low[j]
+                    capacity = self._match(side, j, bound, open_[j], capacity,
+                                           date_time, converted)
+        # 触发了但是没有全部成交的止损限价单从下一条数据开始作为限价单挂出
+        for resting in converted:
+            order = resting.order
+            self._push(_BUY_LIMIT if order.buy_or_sell == 'BUY' else _SELL_LIMIT,
+                       resting, order.order_price)
+
+    def _match(self, side, j, bound, open_price, capacity, date_time, converted):
+        """
+        撮合一个代码一个方向上被触发的订单，返回剩余的可成交数量。
+        止损单一旦触发就一直有效：因为成交量的限制没有全部成交的止损单移出
+        止损单的堆，止损单从下一条数据开始按开盘价成交，止损限价单作为限价单挂出，
+        都不需要价格再次越过触发价
+        """
+        heap = self._books[side][j]
+        sign = _SIGNS[side]
+        stop = side in (_BUY_STOP, _SELL_STOP)
+        while heap and heap[0][0] <= bound and capacity >= 1:
+            key, seq, resting = heap[0]
+            if not resting.active:
+                heapq.heappop(heap)
+                continue
+            order = resting.order
+            price = sign * key
+            if open_price == open_price:
+                # 开盘价已经越过了订单价格时按开盘价成交
+                price = min(price, open_price) if sign < 0 else max(price, open_price)
+            if stop and order.order_type == 'STP LMT':
+                if (price > order.order_price) if side == _BUY_STOP else (price < order.order_price):
+                    heapq.heappop(heap)
+                    converted.append(resting)
+                    continue
+            limit = order.order_price \
+                if side in (_BUY_LIMIT, _SELL_LIMIT) or order.order_type == 'STP LMT' else None
+            capacity = self._fill_resting(resting, price, limit, capacity, date_time)
+            if not resting.active:
+                heapq.heappop(heap)
+        if stop:
+            while heap and heap[0][0] <= bound:
+                resting = heapq.heappop(heap)[2]
+                if not resting.active:
+                    continue
+                if resting.order.order_type == 'STP LMT':
+                    converted.append(resting)
+                else:
+                    self._triggered.setdefault(j, deque()).append(resting)
+        self._best[side, j] = heap[0][0] if heap else np.inf
+        return capacity
+
+    def _match_triggered(self, j, open_price, capacity, date_time):
+        """
+        按开盘价成交之前已经触发、但是因为成交量的限制没有全部成交的止损单
+        """
+        queue = self._triggered[j]
+        while queue and capacity >= 1 and open_price == open_price:
+            resting = queue[0]
+            if resting.active:
+                capacity = self._fill_resting(resting, open_price, None, capacity, date_time)
+            if not resting.active:
+                queue.popleft()
+        if not queue:
+            del self._triggered[j]
+        return capacity
+
+    def _fill_resting(self, resting, price, limit, capacity, date_time):
+        """
+        在可成交数量以内成交一个订单，全部成交时把它标记为无效，返回剩余的可成交数量
+        """
+        order = resting.order
+        quantity = resting.remaining if capacity == np.inf \
+            else min(resting.remaining, int(capacity))
+        capacity -= quantity
+        resting.remaining -= quantity
+        if resting.remaining <= 0:
+            resting.active = False
+            del self._resting[id(order)]
+        fill_event = self._fill_event(date_time, order.symbol, quantity, order.buy_or_sell,
+                                      price, limit)
+        self.events.put(fill_event)
+        self._record(date_time, order.symbol, order.direction, quantity,
+                     fill_event.fill_cost, closed=resting.remaining <= 0)
+        return capacity
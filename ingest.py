@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# ingest.py
+
+from __future__ import print_function
+
+import argparse
+import os, os.path
+
+import numpy as np
+import pandas as pd
+
+from bar_cache import build_cache
+
+# 支持的CSV格式。每种格式包括：
+#   columns      源文件的列名 -> BAR_FIELDS中的字段名，没有列出的列被忽略
+#   date_column  时间列的列名
+#   date_format  时间的格式（strftime的写法），None表示由pandas推断
+#   encoding     文件编码
+#   fill         缺少的字段由哪个字段复制，例如没有复权价格时用收盘价
+# 所有的数值列都可以带千位分隔符、K/M/B的单位后缀或者百分号，时间的顺序任意。
+CSV_FORMATS = {
+    'yahoo': {
+        'columns': {'High': 'high', 'Low': 'low', 'Open': 'open', 'Close': 'close',
+                    'Volume': 'volume', 'Adj Close': 'adj_close'},
+        'date_column': 'Date',
+        'date_format': None,
+        'encoding': 'utf-8',
+        'fill': {},
+    },
+    'hs300': {
+        'columns': {'open': 'open', 'high': 'high', 'low': 'low', 'close': 'close',
+                    'volume': 'volume'},
+        'date_column': 'date',
+        'date_format': '%Y年%m月%d日',
+        'encoding': 'utf-8-sig',
+        'fill': {'adj_close': 'close'},
+    },
+}
+
+# 读取之后的字段，pct_change在对齐之后由BarStore计算
+INGEST_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'adj_close')
+
+# 数值后缀对应的倍数
+SUFFIXES = {'K': 1e3, 'M': 1e6, 'B': 1e9, '%': 0.01}
+
+
+def register_format(name, columns, date_column, date_format=None, encoding='utf-8', fill=None):
+    """
+    注册一种新的CSV格式，之后可以用名字传给BarStore.from_csv、bar_cache和数据处理对象
+    """
+    CSV_FORMATS[name] = {
+        'columns': dict(columns),
+        'date_column': date_column,
+        'date_format': date_format,
+        'encoding': encoding,
+        'fill': dict(fill or {}),
+    }
+
+
+def parse_numeric(values):
+    """
+    把一列字符串一次性转换为浮点数：去掉千位分隔符，处理K/M/B的单位后缀
+    和百分号，无法解析的值为NaN。已经是数值的列直接返回。
+    """
+    series = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=np.float64)
+    text = series.astype(str).str.strip().str.replace(',', '', regex=False)
+    suffix = text.str[-1:].str.upper()
+    has_suffix = suffix.isin(list(SUFFIXES))
+    body = text.where(~has_suffix, text.str[:-1])
+    scale = suffix.map(SUFFIXES).where(has_suffix, 1.0).to_numpy(dtype=np.float64)
+    return pd.to_numeric(body, errors='coerce').to_numpy(dtype=np.float64) * scale
+
+
+def read_csv(path, csv_format):
+    """
+    按csv_format读取一个代码的CSV文件，返回以时间为索引、按时间升序排列的
+    DataFrame，列为INGEST_FIELDS。时间相同的行只保留最后一行。
+    """
+    spec = CSV_FORMATS[csv_format] if not isinstance(csv_format, dict) else csv_format
+    raw = pd.read_csv(path, encoding=spec['encoding'], dtype=str)
+    raw.columns = [c.strip() for c in raw.columns]
+    index = pd.to_datetime(raw[spec['date_column']].str.strip(),
+                           format=spec['date_format'], errors='coerce')
+
+    columns = {}
+    for source, field in spec['columns'].items():
+        columns[field] = parse_numeric(raw[source])
+    for field, source in spec['fill'].items():
+        columns[field] = columns[source]
+    frame = pd.DataFrame(
+        dict((f, columns.get(f, np.full(len(raw), np.nan))) for f in INGEST_FIELDS),
+        index=pd.DatetimeIndex(index, name='datetime')
+    )
+    frame = frame[frame.index.notna()]
+    # 稳定排序，保证时间相同的行保持原来的先后顺序
+    frame = frame.iloc[np.argsort(frame.index.values, kind='stable')]
+    return frame[~frame.index.duplicated(keep='last')]
+
+
+def ingest(csv_dir, symbol_list, csv_format, cache_dir=None):
+    """
+    把csv_dir中一组代码的CSV文件转换为数据处理对象使用的二进制缓存（见bar_cache），
+    返回BarStore。之后用相同的csv_format和cache_dir构造HistoricCSVDataHandler
+    时直接从缓存中读取。
+    """
+    cache_dir = cache_dir or os.path.join(csv_dir, '.bar_cache')
+    return build_cache(csv_dir, symbol_list, cache_dir, csv_format)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Normalise vendor CSV files and write them into the binary bar cache"
+    )
+    parser.add_argument('csv_dir')
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--format', default='hs300', choices=sorted(CSV_FORMATS))
+    parser.add_argument('--cache-dir', default=None,
+                        help="defaults to <csv_dir>/.bar_cache")
+    args = parser.parse_args()
+    store = ingest(args.csv_dir, args.symbols, args.format, args.cache_dir)
+    print("Ingested %s bars x %s symbols (%s to %s)" %
+          (len(store), len(store.symbol_list), store.index[0].date(), store.index[-1].date()))
@@ -7,27 +7,198 @@ from __future__ import print_function
 import numpy as np
 import pandas as pd
 
+# 这个模块中的函数都是向量化的：输入可以是一条曲线（Series或一维数组），
+# 也可以是(时间, 曲线数)的矩阵，此时按列计算，一次得到所有曲线的结果。
+
+
 def create_sharpe_ratio(returns,periods=252):
     """
     计算策略的Sharpe比率，基于基准为0，也就是假设无风险利率为0
     """
-    return np.sqrt(periods)*(np.mean(returns)/np.std(returns))
+    r=np.asarray(returns,dtype=np.float64)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return np.sqrt(periods)*(np.nanmean(r,axis=0)/np.nanstd(r,axis=0))
+
+def create_sortino_ratio(returns,periods=252):
+    """
+    计算Sortino比率，只用下行波动（负收益的均方根）作为分母，无风险利率为0
+    """
+    r=np.asarray(returns,dtype=np.float64)
+    downside=np.sqrt(np.nanmean(np.minimum(r,0.0)**2,axis=0))
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return np.sqrt(periods)*(np.nanmean(r,axis=0)/downside)
+
+def drawdown_matrix(pnl):
+    """
+    计算PnL曲线相对于最高点（high water mark）的回撤和回撤持续的时间。
+    返回(drawdown, duration, drawdown_pct)，形状与pnl相同：
+    drawdown是最高点减去当前值，drawdown_pct是回撤占最高点的比例，
+    duration是连续处于回撤中的周期数。第一个周期没有定义，为NaN。
+    """
+    p=np.asarray(pnl,dtype=np.float64)
+    hwm=p.copy()
+    hwm[0]=0.0
+    hwm=np.fmax.accumulate(hwm,axis=0)
+    drawdown=hwm-p
+    drawdown[0]=np.nan
+    with np.errstate(divide='ignore',invalid='ignore'):
+        drawdown_pct=np.where(hwm>0,drawdown/hwm,np.nan)
+
+    idx=np.arange(len(p)).reshape((-1,)+(1,)*(p.ndim-1))
+    last_flat=np.maximum.accumulate(np.where(drawdown!=0,-1,idx),axis=0)
+    duration=(idx-last_flat).astype(np.float64)
+    duration[last_flat<0]=np.nan
+    return drawdown,duration,drawdown_pct
 
 def create_drawdowns(pnl):
     """
     计算PnL曲线的最大回撤（从最大收益到最小收益之间的距离），以及回撤的时间
     这里需要参数pnl_returns是一个pandas的Series
     """
-    hwm=[0]
-    idx=pnl.index
-    drawdown=pd.Series(index=idx)
-    duration=pd.Series(index=idx)
-    
-    for t in range(1,len(idx)):
-        hwm.append(max(hwm[t-1],pnl[t]))
-        drawdown[t]=(hwm[t]-pnl[t])
-        duration[t]=(0 if drawdown[t]==0 else duration[t-1]+1)
-    
+    drawdown,duration,_=drawdown_matrix(pnl)
+    drawdown=pd.Series(drawdown,index=pnl.index)
+    duration=pd.Series(duration,index=pnl.index)
     return drawdown,drawdown.max(),duration.max()
 
-    
+def hit_rate(returns):
+    """
+    收益为正的周期占所有收益不为0的周期的比例
+    """
+    r=np.asarray(returns,dtype=np.float64)
+    active=np.sum((r!=0)&~np.isnan(r),axis=0)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return np.sum(r>0,axis=0)/active
+
+def create_turnover(traded,equity,periods=252):
+    """
+    年化换手率：成交金额之和除以平均资产，再按周期数年化
+    """
+    traded=np.asarray(traded,dtype=np.float64)
+    equity=np.asarray(equity,dtype=np.float64)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return np.nansum(traded,axis=0)/np.nanmean(equity,axis=0)*periods/len(equity)
+
+def summary_stats(equity,periods=252,traded=None):
+    """
+    根据资产总值曲线计算所有的业绩统计。equity是一条曲线或者(时间, 曲线数)的矩阵，
+    traded是同样形状的每个周期的成交金额（可选，用于计算换手率）。
+    返回一个字典，矩阵输入时每个值都是长度为曲线数的数组。
+    max_drawdown是归一化的资产曲线（初始值为1）从最高点下跌的距离，
+    max_drawdown_pct是相对于最高点的比例。
+    """
+    equity=np.asarray(equity,dtype=np.float64)
+    pnl=equity/equity[0]
+    returns=np.full_like(pnl,np.nan)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        returns[1:]=pnl[1:]/pnl[:-1]-1.0
+    drawdown,duration,drawdown_pct=drawdown_matrix(pnl)
+
+    total_return=pnl[-1]-1.0
+    years=(len(pnl)-1)/float(periods)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        annual_return=np.power(1.0+total_return,1.0/years)-1.0 if years>0 else total_return*np.nan
+        max_dd_pct=np.nanmax(drawdown_pct,axis=0) if len(pnl)>1 else total_return*np.nan
+        calmar=annual_return/max_dd_pct
+
+    stats={
+        'total_return':total_return,
+        'annual_return':annual_return,
+        'sharpe':create_sharpe_ratio(returns,periods),
+        'sortino':create_sortino_ratio(returns,periods),
+        'max_drawdown':np.nanmax(drawdown,axis=0) if len(pnl)>1 else total_return*np.nan,
+        'max_drawdown_pct':max_dd_pct,
+        'drawdown_duration':np.nanmax(duration,axis=0) if len(pnl)>1 else total_return*np.nan,
+        'calmar':calmar,
+        'hit_rate':hit_rate(returns),
+    }
+    if traded is not None:
+        stats['turnover']=create_turnover(traded,equity,periods)
+    return stats
+
+class OnlineMetrics(object):
+    """
+    在回测过程中逐条更新的业绩统计，每条数据的代价是O(1)，不需要保存历史。
+    收益的均值和方差用Welford算法累计，同时记录最高点（high water mark）、
+    当前回撤、最大回撤和回撤持续的时间，回测进行中的任何时刻都可以读取。
+    回撤的定义与summary_stats相同：max_drawdown是归一化资产曲线的回撤，
+    max_drawdown_pct是相对于最高点的比例。
+    """
+
+    def __init__(self,initial,periods=252):
+        self.initial=float(initial)
+        self.periods=periods
+        self.last=self.initial
+        self.count=0
+        self.mean=0.0
+        self.m2=0.0
+        self.downside_sq=0.0
+        self.wins=0
+        self.active=0
+        self.hwm=0.0
+        self.drawdown=0.0
+        self.drawdown_pct=0.0
+        self.max_drawdown=0.0
+        self.max_drawdown_pct=0.0
+        self.drawdown_duration=0
+        self.max_drawdown_duration=0
+
+    def update(self,total):
+        """
+        用这一条数据的资产总值更新所有统计
+        """
+        r=total/self.last-1.0
+        self.last=total
+        self.count+=1
+        delta=r-self.mean
+        self.mean+=delta/self.count
+        self.m2+=delta*(r-self.mean)
+        if r<0:
+            self.downside_sq+=r*r
+        if r!=0:
+            self.active+=1
+            if r>0:
+                self.wins+=1
+
+        if total>=self.hwm:
+            self.hwm=total
+            self.drawdown=0.0
+            self.drawdown_pct=0.0
+            self.drawdown_duration=0
+            return
+        self.drawdown=(self.hwm-total)/self.initial
+        self.drawdown_pct=(self.hwm-total)/self.hwm
+        self.drawdown_duration+=1
+        if self.drawdown>self.max_drawdown:
+            self.max_drawdown=self.drawdown
+        if self.drawdown_pct>self.max_drawdown_pct:
+            self.max_drawdown_pct=self.drawdown_pct
+        if self.drawdown_duration>self.max_drawdown_duration:
+            self.max_drawdown_duration=self.drawdown_duration
+
+    @property
+    def variance(self):
+        return self.m2/self.count if self.count else np.nan
+
+    @property
+    def sharpe(self):
+        std=np.sqrt(self.variance)
+        return np.sqrt(self.periods)*self.mean/std if std>0 else np.nan
+
+    @property
+    def sortino(self):
+        downside=np.sqrt(self.downside_sq/self.count) if self.count else 0.0
+        return np.sqrt(self.periods)*self.mean/downside if downside>0 else np.nan
+
+    def stats(self):
+        """
+        以与summary_stats相同的键返回当前的统计
+        """
+        return {
+            'total_return':self.last/self.initial-1.0,
+            'sharpe':self.sharpe,
+            'sortino':self.sortino,
+            'max_drawdown':self.max_drawdown,
+            'max_drawdown_pct':self.max_drawdown_pct,
+            'drawdown_duration':self.max_drawdown_duration,
+            'hit_rate':self.wins/float(self.active) if self.active else np.nan,
+        }
@@ -2,43 +2,67 @@
 
 #plot_sharpe.py
 
+import argparse
+
 import matplotlib.pyplot as plt
 import numpy as np
+import pandas as pd
 
-def create_data_matrix(csv_ref,col_index):
-    data=np.zeros((3,3))
-    for i in range(0,3):
-        for j in range(0,3):
-            data[i][j]=float(csv_ref[i*3+j][col_index])
-    return data
+def param_columns(results):
+    """
+    ParameterSweep.to_csv写出的结果表中的参数列：参数列在最前面，
+    之后是signals、orders、fills、aborted和summary_stats的各项
+    """
+    columns=list(results.columns)
+    return columns[:columns.index('signals')]
 
-if __name__=="__main__":
-    csv_file=open("opt.csv","r").readlines()
-    csv_ref=[
-        c.strip().split(',')
-        for c in csv_file if c[:3]=="100"
-    ]
-    print(csv_ref)
-    data=create_data_matrix(csv_ref,4)
+def create_data_matrix(results,value,x=None,y=None,aggfunc='max'):
+    """
+    把结果表中value列的值排成以参数y为行、参数x为列的矩阵（缺少的组合为NaN）。
+    只有两个参数时x和y可以省略；有更多参数时，其他参数的各个取值用aggfunc合并
+    """
+    params=param_columns(results)
+    if x is None or y is None:
+        if len(params)!=2:
+            raise ValueError("Choose the parameters to plot with x and y: %s" % params)
+        y,x=params
+    for p in (x,y):
+        if p not in params:
+            raise ValueError("Unknown parameter %s, expected one of %s" % (p,params))
+    return results.pivot_table(index=y,columns=x,values=value,aggfunc=aggfunc).astype(float)
+
+def plot_heatmap(data,title,fmt,cmap):
+    """
+    画出create_data_matrix得到的矩阵，每个格子中标出数值
+    """
     fig,ax=plt.subplots()
-    heatmap=ax.pcolor(data,cmap=plt.cm.Blues)
-    row_labels=[0.5,1.0,1.5]
-    column_labels=[2.0,3.0,4.0]
+    heatmap=ax.pcolor(np.ma.masked_invalid(data.values),cmap=cmap)
     for y in range(data.shape[0]):
         for x in range(data.shape[1]):
-            plt.text(x+0.5,y+0.5,'%.2f%%' % data[y,x],
-                     horizontalalignment='center',
-                     verticalalignment='center')
+            if np.isfinite(data.values[y,x]):
+                plt.text(x+0.5,y+0.5,fmt % data.values[y,x],
+                         horizontalalignment='center',
+                         verticalalignment='center')
     plt.colorbar(heatmap)
-    ax.set_xticks(np.arange(data.shape[0])+0.5,minor=False)
-    ax.set_yticks(np.arange(data.shape[1])+0.5,minor=False)
-    ax.set_xticklabels(row_labels,minor=False)
-    ax.set_yticklabels(column_labels,minor=False)
-    
-    plt.suptitle('Sharpe Ratio HeatMap', fontsize=18)
-    plt.xlabel('Z-score Exit Threshold',fontsize=14)
-    plt.ylabel('Z-score Entry Threshold',fontsize=14)
-    plt.show()
+    ax.set_xticks(np.arange(data.shape[1])+0.5,minor=False)
+    ax.set_yticks(np.arange(data.shape[0])+0.5,minor=False)
+    ax.set_xticklabels(data.columns,minor=False)
+    ax.set_yticklabels(data.index,minor=False)
 
-    
+    plt.suptitle(title, fontsize=18)
+    plt.xlabel(data.columns.name,fontsize=14)
+    plt.ylabel(data.index.name,fontsize=14)
+    return fig
 
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Sharpe ratio heatmap of a parameter sweep")
+    parser.add_argument('csv',nargs='?',default='opt.csv',help="written by ParameterSweep.to_csv")
+    parser.add_argument('--x',default=None,help="parameter on the horizontal axis")
+    parser.add_argument('--y',default=None,help="parameter on the vertical axis")
+    args=parser.parse_args()
+    results=pd.read_csv(args.csv)
+    # 有更多参数时取其他参数中最好的夏普比率
+    data=create_data_matrix(results,'sharpe',args.x,args.y,aggfunc='max')
+    print(data)
+    plot_heatmap(data,'Sharpe Ratio HeatMap','%.2f',plt.cm.Blues)
+    plt.show()
@@ -6,18 +6,51 @@ try:
 except ImportError:
     import queue
 
+import numpy as np
 import pandas as pd
 from abc import abstractmethod
-from performance import create_sharpe_ratio, create_drawdowns
+from performance import OnlineMetrics, create_drawdowns, summary_stats
+
+
+class SymbolVector(object):
+    """
+    按代码读写一个NumPy向量的字典式视图，current_positions[symbol]的用法与
+    原来的字典相同，而整个向量可以直接参与向量化的计算
+    """
+    __slots__ = ('values', '_pos')
+
+    def __init__(self, values, symbol_pos):
+        self.values = values
+        self._pos = symbol_pos
+
+    def __getitem__(self, symbol):
+        return self.values[self._pos[symbol]]
+
+    def __setitem__(self, symbol, value):
+        self.values[self._pos[symbol]] = value
+
+    def __iter__(self):
+        return iter(self._pos)
+
+    def __len__(self):
+        return len(self._pos)
+
+    def keys(self):
+        return self._pos.keys()
+
+    def items(self):
+        return [(s, self.values[j]) for s, j in self._pos.items()]
 
 
 class Portfolio(object):
     """
     Portfolio类处理所有的持仓和市场价值，针对在每个时间点上的数据的情况
-    postion DataFrame存放一个用时间做索引的持仓数量
-    holdings DataFrame存放特定时间索引对应的每个代码的现金和总的市场持仓价值，
-    以及资产组合总量的百分比变化。
+    持仓和市值保存在预先分配的(时间, 代码)矩阵中，现金、佣金和总资产各是一个向量，
+    每条数据只需要一次向量乘法就可以完成按市值计价。
+    最后由create_equity_curve_dateframe转换为以时间为索引的DataFrame。
     """
+    # 持仓数量的类型，默认是整数股；需要小数持仓时子类可以改为np.float64
+    position_dtype = np.int64
 
     def __init__(self, bars, events, start_date, initial_capital=100000):
         self.bars = bars
@@ -29,32 +62,56 @@ class Portfolio(object):
         self.start_date = start_date
         self.initial_capital = initial_capital
 
-        self.all_positions = self.__construct_all_positions()
-
-        self.current_positions = dict((k, v) for k, v in \
-                                      [(s, 0) for s in self.symbol_list])
-
-        self.all_holdings = self.__construct_all_holdings()
+        symbol_pos = dict((s, j) for j, s in enumerate(self.symbol_list))
+        self.current_positions = SymbolVector(
+            np.zeros(len(self.symbol_list), dtype=self.position_dtype), symbol_pos
+        )
         self.current_holdings = self.__construct_current_holdings()
+        self.traded_value = 0.0
+        # 逐条更新的业绩统计，回测进行中随时可以读取
+        self.metrics = OnlineMetrics(initial_capital)
 
+        self.__construct_ledger(self.__initial_capacity())
 
-    def __construct_all_positions(self):
+    def __initial_capacity(self):
         """
-        使用start_date来确定时间索引开始的日期来构造所有的持仓列表
+        根据数据的条数预先分配账本的行数（加上start_date的一行），
+        不知道数据条数时从一个默认值开始按需扩大
         """
-        d = dict((k, v) for k, v in [(s, 0.0) for s in self.symbol_list])
-        d['datetime'] = self.start_date
-        return [d]
+        bar_store = getattr(self.bars, 'bar_store', None)
+        if bar_store is not None:
+            return len(bar_store) + 1
+        return 1024
 
-    def __construct_all_holdings(self):
+    def __construct_ledger(self, capacity):
         """
-        这个函数构造一个字典，保存所有的代码的资产组合的startdate的价值
+        预先分配账本，第0行是start_date时的初始状态
         """
-        d = dict((k, v) for k, v in [(s, 0.0) for s in self.symbol_list])
-        d['cash'] = self.initial_capital
-        d['commission'] = 0.0
-        d['total'] = self.initial_capital
-        return [d]
+        n = len(self.symbol_list)
+        self.ledger_datetimes = np.empty(capacity, dtype='datetime64[ns]')
+        self.ledger_positions = np.zeros((capacity, n), dtype=self.position_dtype)
+        self.ledger_holdings = np.zeros((capacity, n))
+        self.ledger_cash = np.zeros(capacity)
+        self.ledger_commission = np.zeros(capacity)
+        self.ledger_total = np.zeros(capacity)
+        self.ledger_traded = np.zeros(capacity)
+
+        self.ledger_datetimes[0] = np.datetime64(self.start_date, 'ns')
+        self.ledger_cash[0] = self.initial_capital
+        self.ledger_total[0] = self.initial_capital
+        self.ledger_rows = 1
+
+    def __grow_ledger(self):
+        """
+        账本写满时容量加倍，均摊代价是常数
+        """
+        rows = self.ledger_rows
+        for name in ('ledger_datetimes', 'ledger_positions', 'ledger_holdings',
+                     'ledger_cash', 'ledger_commission', 'ledger_total', 'ledger_traded'):
+            old = getattr(self, name)
+            new = np.zeros((2 * len(old),) + old.shape[1:], dtype=old.dtype)
+            new[:rows] = old[:rows]
+            setattr(self, name, new)
 
     def __construct_current_holdings(self):
         """
@@ -70,28 +127,25 @@ class Portfolio(object):
         """
         在持仓矩阵当中根据当前市场数据来增加一条新纪录，它反映了这个阶段所有持仓的市场价值
         """
-        self.latest_datetime = self.bars.get_latest_bar_datetime(
-            self.symbol_list[0]
-        )
-        dp = dict((k, v) for k, v in [(s, 0) for s in self.symbol_list])
-        dp['datetime'] = self.latest_datetime
-        for s in self.symbol_list:
-            dp[s] = self.current_positions[s]
-
-        self.all_positions.append(dp)
-
-        dh = dict((k, v) for k, v in [(s, 0) for s in self.symbol_list])
-        dh['datetime'] = self.latest_datetime
-        dh['cash'] = self.current_holdings['cash']
-        dh['commission'] = self.current_holdings['commission']
-        dh['total'] = self.current_holdings['cash']
-
-        for s in self.symbol_list:
-            market_value = self.current_positions[s] * \
-                           self.bars.get_latest_bar_value(s, "adj_close")
-            dh[s] = market_value
-            dh['total'] += market_value
-        self.all_holdings.append(dh)
+        self.latest_datetime = self.bars.get_latest_datetime()
+        if self.ledger_rows == len(self.ledger_total):
+            self.__grow_ledger()
+        t = self.ledger_rows
+        self.ledger_rows += 1
+
+        positions = self.current_positions.values
+        prices = self.bars.get_history("adj_close", N=1)[-1]
+        market_value = self.ledger_holdings[t]
+        np.multiply(positions, prices, out=market_value, where=positions != 0)
+
+        self.ledger_datetimes[t] = np.datetime64(self.latest_datetime, 'ns')
+        self.ledger_positions[t] = positions
+        self.ledger_cash[t] = self.current_holdings['cash']
+        self.ledger_commission[t] = self.current_holdings['commission']
+        self.ledger_total[t] = self.current_holdings['cash'] + market_value.sum()
+        self.ledger_traded[t] = self.traded_value
+        self.traded_value = 0.0
+        self.metrics.update(self.ledger_total[t])
 
     def update_positions_from_fill(self, fill_event):
         """
@@ -114,13 +168,16 @@ class Portfolio(object):
         if fill.buy_or_sell == 'SELL':
             fill_dir = -1
 
-        fill_cost = self.bars.get_latest_bar_value(
-            fill.symbol, "adj_close"
-        )
+        fill_cost = fill.fill_cost
+        if fill_cost is None:
+            fill_cost = self.bars.get_latest_bar_value(
+                fill.symbol, "adj_close"
+            )
         cost = fill_dir * fill_cost * fill.quantity;
         self.current_holdings[fill.symbol] += cost
         self.current_holdings['commission'] += fill.commission
         self.current_holdings['cash'] -= (cost + fill.commission)
+        self.traded_value += abs(cost)
         # self.current_holdings['total']=self.current_holdings['total'] - fill.commission
         a = 1
 
@@ -136,6 +193,16 @@ class Portfolio(object):
     def generate_naive_order(self, signal):
         raise NotImplementedError("Should implement generate_naive_order()")
 
+    def vectorized_positions(self, state):
+        """
+        可选的向量化接口：由策略的目标状态（见Strategy.vectorized_signals）一次性
+        给出每个时刻每个代码成交之后的持仓，返回(时间, 代码)的数组。
+        结果应当与逐个信号调用generate_naive_order时的持仓一致，所以只适用于
+        下单数量不依赖于现金的规则，由vectorized.VectorizedBacktest使用；
+        没有实现时VectorizedBacktest逐个信号调用generate_naive_order。
+        """
+        raise NotImplementedError("Should implement vectorized_positions()")
+
     # def generate_naive_order(self,signal):
     #     """
     #     简单的生成一个订单对象，固定的数量，利用信号对象，没有风险管理
@@ -171,29 +238,39 @@ class Portfolio(object):
 
     def create_equity_curve_dateframe(self):
         """
-        基于all_holdings创建一个pandas的DataFrame。
+        基于账本创建一个pandas的DataFrame。
         """
-        curve = pd.DataFrame(self.all_holdings)
-        curve.set_index('datetime', inplace=True)
+        rows = self.ledger_rows
+        curve = pd.DataFrame(self.ledger_holdings[:rows], columns=self.symbol_list,
+                             index=pd.DatetimeIndex(self.ledger_datetimes[:rows], name='datetime'))
+        curve['cash'] = self.ledger_cash[:rows]
+        curve['commission'] = self.ledger_commission[:rows]
+        curve['total'] = self.ledger_total[:rows]
         curve['returns'] = curve['total'].pct_change()
         curve['equity_curve'] = (1.0 + curve['returns']).cumprod()
         self.equity_curve = curve
 
-    def output_summary_stats(self):
+    def summary_stats(self):
         """
-        Equity_summary
+        以数值的形式返回业绩统计，供参数优化等批量处理使用
         """
-        total_return = self.equity_curve['equity_curve'][-1]
-        returns = self.equity_curve['returns']
-        pnl = self.equity_curve['equity_curve']
-
-        sharpe_ratio = create_sharpe_ratio(returns)
-        drawdown, max_dd, dd_duration = create_drawdowns(pnl)
+        rows = self.ledger_rows
+        stats = summary_stats(self.ledger_total[:rows], traded=self.ledger_traded[:rows])
+        drawdown, max_dd, dd_duration = create_drawdowns(self.equity_curve['equity_curve'])
         self.equity_curve['drawdown'] = drawdown
-
-        stats = [("Total Return", "%0.2f%%" % ((total_return - 1.0) * 100.0)),
-                 ("Sharpe Ratio", "%0.2f" % sharpe_ratio),
-                 ("Max Drawdown", "%0.2f%%" % (max_dd * 100)),
-                 ("Drawdown Duration", "%d" % dd_duration)]
-        self.equity_curve.to_csv('equity.csv')
         return stats
+
+    def output_summary_stats(self):
+        """
+        Equity_summary
+        """
+        stats = self.summary_stats()
+        return [("Total Return", "%0.2f%%" % (stats['total_return'] * 100.0)),
+                ("Sharpe Ratio", "%0.2f" % stats['sharpe']),
+                ("Max Drawdown", "%0.2f%%" % (stats['max_drawdown'] * 100)),
+                ("Drawdown Duration", "%d" % stats['drawdown_duration']),
+                ("Max Drawdown Pct", "%0.2f%%" % (stats['max_drawdown_pct'] * 100)),
+                ("Sortino Ratio", "%0.2f" % stats['sortino']),
+                ("Calmar Ratio", "%0.2f" % stats['calmar']),
+                ("Hit Rate", "%0.2f%%" % (stats['hit_rate'] * 100)),
+                ("Turnover", "%0.2f" % stats['turnover'])]
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# profiling.py
+
+from __future__ import print_function
+
+from array import array
+import json
+import time
+
+import numpy as np
+
+
+def handler_name(handler):
+    """
+    处理函数在报告中的名字：绑定方法为"类名.方法名"，其他为__qualname__
+    """
+    owner = getattr(handler, '__self__', None)
+    if owner is not None:
+        return '%s.%s' % (type(owner).__name__, handler.__name__)
+    return getattr(handler, '__qualname__', repr(handler))
+
+
+class HandlerProfiler(object):
+    """
+    记录回测中每个处理函数的调用次数和每次调用的耗时，以及每类事件的数量和
+    分发耗时。每次调用的耗时保存在array('d')中，报告时再计算分位数。
+    只有Backtest(profile=True)时才会创建，没有开启时回测的主循环中没有任何计时。
+    """
+    percentiles = (50, 90, 99)
+
+    def __init__(self):
+        self.samples = {}
+        self.event_counts = {}
+        self.event_times = {}
+        self.bars = 0
+        self.started = None
+        self.elapsed = 0.0
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.elapsed += time.perf_counter() - self.started
+        self.started = None
+
+    def record(self, name, seconds):
+        """
+        记录一次调用的耗时
+        """
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = array('d')
+        samples.append(seconds)
+
+    def record_event(self, name, seconds):
+        """
+        记录一个事件从取出到所有处理函数返回的耗时
+        """
+        self.event_counts[name] = self.event_counts.get(name, 0) + 1
+        self.event_times[name] = self.event_times.get(name, 0.0) + seconds
+
+    def _stats(self, samples):
+        values = np.frombuffer(samples, dtype=np.float64)
+        stats = {
+            'calls': len(values),
+            'total': float(values.sum()),
+            'mean': float(values.mean()),
+            'max': float(values.max()),
+        }
+        for q, v in zip(self.percentiles, np.percentile(values, self.percentiles)):
+            stats['p%d' % q] = float(v)
+        return stats
+
+    def report(self):
+        """
+        以字典的形式返回统计结果，耗时的单位是秒
+        """
+        elapsed = self.elapsed
+        events = sum(self.event_counts.values())
+        return {
+            'elapsed': elapsed,
+            'bars': self.bars,
+            'events': events,
+            'events_per_second': events / elapsed if elapsed > 0 else None,
+            'bars_per_second': self.bars / elapsed if elapsed > 0 else None,
+            'handlers': dict((name, self._stats(s)) for name, s in self.samples.items() if len(s)),
+            'event_types': dict(
+                (name, {'count': n, 'total': self.event_times[name]})
+                for name, n in self.event_counts.items()
+            ),
+        }
+
+    def to_json(self, path):
+        """
+        把统计结果写入JSON文件
+        """
+        with open(path, 'w') as fp:
+            json.dump(self.report(), fp, indent=1, sort_keys=True)
+
+    def print_report(self):
+        """
+        按累计耗时从高到低输出各个处理函数的统计
+        """
+        report = self.report()
+        print("Elapsed %.3fs, %s bars, %s events (%.0f events/s)" % (
+            report['elapsed'], report['bars'], report['events'],
+            report['events_per_second'] or 0.0))
+        handlers = sorted(report['handlers'].items(), key=lambda x: -x[1]['total'])
+        for name, s in handlers:
+            print("%-45s calls=%-8d total=%.4fs mean=%.1fus p99=%.1fus" % (
+                name, s['calls'], s['total'], s['mean'] * 1e6, s['p99'] * 1e6))
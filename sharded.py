@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+# sharded.py
+
+from __future__ import print_function
+
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os, os.path
+
+import numpy as np
+import pandas as pd
+
+from backtest import Backtest
+from bar_cache import ensure_cache
+from bar_store import BarStore
+from data import HistoricCSVDataHandler, SparseCSVDataHandler
+from performance import summary_stats
+
+
+def split_symbols(symbol_list, n_shards):
+    """
+    把代码列表按顺序分成n_shards份，每份的代码数最多相差1
+    """
+    n_shards = max(1, min(n_shards, len(symbol_list)))
+    bounds = np.linspace(0, len(symbol_list), n_shards + 1).round().astype(int)
+    return [list(symbol_list[bounds[k]:bounds[k + 1]]) for k in range(n_shards)]
+
+
+def _run_shard(task):
+    """
+    在工作进程中对一份代码执行一次完整的回测，返回这一份的账本和成交记录
+    """
+    config, symbols, initial_capital = task
+    data_handler_params = config['data_handler_params']
+    # 全部代码的数据在共享内存或者内存映射的缓存中，这一份只取自己的列（视图）
+    store = _open_bar_source(config.get('bar_source'))
+    if store is not None:
+        data_handler_params = dict(data_handler_params, bar_store=store.select(symbols))
+    backtest = Backtest(
+        config['csv_dir'], symbols, initial_capital, 0.0, config['start_date'],
+        config['data_handler_cls'], config['execution_handler_cls'],
+        config['portfolio_cls'], config['strategy_cls'],
+        strategy_params=config['strategy_params'],
+        data_handler_params=data_handler_params, verbose=False,
+        execution_handler_params=config['execution_handler_params']
+    )
+    backtest._run_backtest()
+    portfolio = backtest.portfolio
+    rows = portfolio.ledger_rows
+    return {
+        'symbols': symbols,
+        'datetimes': portfolio.ledger_datetimes[:rows].copy(),
+        'holdings': portfolio.ledger_holdings[:rows].copy(),
+        'positions': portfolio.ledger_positions[:rows].copy(),
+        'cash': portfolio.ledger_cash[:rows].copy(),
+        'commission': portfolio.ledger_commission[:rows].copy(),
+        'total': portfolio.ledger_total[:rows].copy(),
+        'traded': portfolio.ledger_traded[:rows].copy(),
+        'trades': backtest.execution_handler.blotter.to_frame(),
+        'signals': backtest.signals,
+        'orders': backtest.orders,
+        'fills': backtest.fills,
+    }
+
+
+def _align(shard, index):
+    """
+    把一份的账本对齐到合并后的时间索引上（不含第0行）：每个时刻取这一份在这个
+    时刻或者之前的最后一行，这一份在这个时刻没有数据时，持仓和现金都没有变化。
+    账本的第k行是第k条数据之后的状态，所以已经发布的数据条数就是对应的行号，
+    还没有数据时对应第0行的初始状态。
+    """
+    return np.searchsorted(shard['datetimes'][1:], index, side='right')
+
+
+def _open_bar_source(source):
+    """
+    在工作进程中打开主进程准备好的全部代码的数据：('cache', 路径)以内存映射的
+    方式读取二进制缓存，('shared', handle)挂载共享内存，都不复制数据；
+    ('store', BarStore)是在主进程中执行时直接传入的数据
+    """
+    if source is None:
+        return None
+    kind, value = source
+    if kind == 'store':
+        return value
+    if kind == 'cache':
+        return BarStore.load(value)
+    return BarStore.attach_shared_memory(value)
+
+
+def _read_calendar(csv_dir, symbol):
+    """
+    只读取一个代码的CSV文件的第一列（时间）
+    """
+    frame = pd.read_csv(os.path.join(csv_dir, '%s.csv' % symbol), header=0, usecols=[0],
+                        index_col=0, parse_dates=True)
+    return frame.index.values.astype('datetime64[ns]')
+
+
+class ShardedBacktest(object):
+    """
+    按代码分片的多进程回测，用于代码之间没有相互作用的策略（例如对每个代码单独
+    运行的MovingAverageCrossStrategy）。
+    symbol_list被分成n_shards份，每份在一个工作进程中独立地执行完整的事件循环，
+    初始资金按代码数分配给各份。结束后把各份的持仓市值、现金和成交记录合并为
+    一条资产曲线和一张成交记录表。
+    每份的资金是独立的，所以当组合的下单规则依赖于整个组合的现金时，结果与
+    不分片的回测不同。
+    各个代码的交易日不同时，每一份自己的时间索引只是全部时间的一部分，向前填充
+    得到的数据条与不分片时不同。所以使用HistoricCSVDataHandler（及其子类）时，
+    全部代码对齐到所有时间的并集上，工作进程只取自己的列：data_handler_params中
+    指定了cache_dir时，主进程准备好二进制缓存，工作进程以内存映射的方式读取；
+    否则主进程读取一次CSV文件并放入共享内存，工作进程只读地挂载，都不需要复制
+    和传递数据。大的股票池建议使用cache_dir，之后的运行不再需要解析CSV文件。
+    SparseCSVDataHandler只发布有数据的代码，不受影响；其他的数据处理对象
+    （例如StreamingCSVDataHandler）在各份的时间索引不同时，启动工作进程之前就
+    抛出ValueError。
+    """
+
+    def __init__(
+            self, csv_dir, symbol_list, initial_capital, start_date,
+            data_handler_cls, execution_handler_cls, portfolio_cls, strategy_cls,
+            strategy_params=None, data_handler_params=None,
+            processes=None, n_shards=None, execution_handler_params=None
+    ):
+        self.config = {
+            'csv_dir': csv_dir,
+            'start_date': start_date,
+            'data_handler_cls': data_handler_cls,
+            'execution_handler_cls': execution_handler_cls,
+            'portfolio_cls': portfolio_cls,
+            'strategy_cls': strategy_cls,
+            'strategy_params': strategy_params or {},
+            'data_handler_params': data_handler_params or {},
+            'execution_handler_params': execution_handler_params or {},
+        }
+        self.symbol_list = list(symbol_list)
+        self.initial_capital = initial_capital
+        self.processes = processes
+        self.shards = split_symbols(self.symbol_list, n_shards or processes or os.cpu_count() or 1)
+        self.equity_curve = None
+        self.trades = None
+        self.signals = 0
+        self.orders = 0
+        self.fills = 0
+
+    def run(self):
+        """
+        执行所有分片的回测并合并结果，返回合并后的资产曲线
+        """
+        config = dict(self.config)
+        data_handler_cls = config['data_handler_cls']
+        shm = None
+        serial = self.processes == 1 or len(self.shards) == 1
+        if issubclass(data_handler_cls, HistoricCSVDataHandler):
+            config['bar_source'], shm = self._prepare_bar_source(serial)
+            # 数据通过bar_source传递，不再随每个任务pickle
+            config['data_handler_params'] = dict(
+                (k, v) for k, v in config['data_handler_params'].items() if k != 'bar_store')
+        elif not issubclass(data_handler_cls, SparseCSVDataHandler):
+            self._check_calendars()
+        tasks = [(config, symbols,
+                  self.initial_capital * len(symbols) / float(len(self.symbol_list)))
+                 for symbols in self.shards]
+        try:
+            if serial:
+                results = [_run_shard(task) for task in tasks]
+            else:
+                with ProcessPoolExecutor(max_workers=self.processes) as pool:
+                    results = list(pool.map(_run_shard, tasks))
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self._merge(results)
+        return self.equity_curve
+
+    def _prepare_bar_source(self, serial=False):
+        """
+        在主进程中准备全部代码的数据，返回(bar_source, shm)。
+        指定了cache_dir时保证缓存有效，工作进程直接读取缓存；否则（或者缓存
+        没能写入时）把数据放入共享内存，shm由run在结束后释放。
+        serial为True时所有分片都在主进程中执行，直接使用读取的数据
+        """
+        params = self.config['data_handler_params']
+        csv_dir = self.config['csv_dir']
+        store = params.get('bar_store')
+        if store is None and params.get('cache_dir') is not None:
+            path = ensure_cache(csv_dir, self.symbol_list, params['cache_dir'],
+                                params.get('csv_format'))
+            if path is not None:
+                return ('cache', path), None
+        if store is None:
+            store = BarStore.from_csv(csv_dir, self.symbol_list, params.get('csv_format'))
+        if serial:
+            return ('store', store), None
+        handle, shm = store.to_shared_memory()
+        return ('shared', handle), shm
+
+    def _check_calendars(self):
+        """
+        逐条对齐所有代码的数据处理对象（例如StreamingCSVDataHandler）在每一份中
+        只对齐这一份的代码，各份的时间索引不同时结果与不分片时不同，抛出ValueError
+        """
+        calendars = [np.unique(np.concatenate([_read_calendar(self.config['csv_dir'], s)
+                                               for s in symbols]))
+                     for symbols in self.shards]
+        union = np.unique(np.concatenate(calendars))
+        for symbols, calendar in zip(self.shards, calendars):
+            if not np.array_equal(calendar, union):
+                raise ValueError(
+                    "Shard %s has its own calendar (%s of %s bars); "
+                    "use HistoricCSVDataHandler or SparseCSVDataHandler"
+                    % (symbols, len(calendar), len(union)))
+
+    def _merge(self, results):
+        """
+        合并各份的账本：在所有分片时间的并集上向前对齐，各份的现金、佣金和总资产
+        相加，持仓市值按原来的代码顺序排列。第0行是start_date时的初始状态
+        """
+        bars = np.unique(np.concatenate([r['datetimes'][1:] for r in results]))
+        index = np.concatenate((results[0]['datetimes'][:1], bars))
+        n = len(index)
+        holdings = np.zeros((n, len(self.symbol_list)))
+        symbol_pos = dict((s, j) for j, s in enumerate(self.symbol_list))
+        cash = np.zeros(n)
+        commission = np.zeros(n)
+        total = np.zeros(n)
+        traded = np.zeros(n)
+        for r in results:
+            rows = np.concatenate(([0], _align(r, bars)))
+            cols = [symbol_pos[s] for s in r['symbols']]
+            holdings[:, cols] = r['holdings'][rows]
+            cash += r['cash'][rows]
+            commission += r['commission'][rows]
+            total += r['total'][rows]
+            # 成交金额只记在这一份真正有账本记录的时刻
+            traded[np.searchsorted(bars, r['datetimes'][1:]) + 1] += r['traded'][1:]
+
+        curve = pd.DataFrame(holdings, columns=self.symbol_list,
+                             index=pd.DatetimeIndex(index, name='datetime'))
+        curve['cash'] = cash
+        curve['commission'] = commission
+        curve['total'] = total
+        curve['returns'] = curve['total'].pct_change()
+        curve['equity_curve'] = (1.0 + curve['returns']).cumprod()
+        self.equity_curve = curve
+        self.traded = traded
+
+        trades = pd.concat([r['trades'] for r in results], ignore_index=True)
+        order = np.argsort(trades['date_time'].values, kind='stable')
+        self.trades = trades.iloc[order].reset_index(drop=True)
+        self.signals = sum(r['signals'] for r in results)
+        self.orders = sum(r['orders'] for r in results)
+        self.fills = sum(r['fills'] for r in results)
+
+    def summary_stats(self):
+        """
+        合并后的资产曲线的业绩统计
+        """
+        return summary_stats(self.equity_curve['total'].values, traded=self.traded)
+
+    def write_results(self, output_dir='.'):
+        """
+        与Backtest.write_results相同，写入equity.csv、stats.json和Execution_summary.csv
+        """
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        stats = dict((k, float(v)) for k, v in self.summary_stats().items())
+        stats['signals'] = self.signals
+        stats['orders'] = self.orders
+        stats['fills'] = self.fills
+        self.equity_curve.to_csv(os.path.join(output_dir, 'equity.csv'))
+        self.trades.to_csv(os.path.join(output_dir, 'Execution_summary.csv'))
+        with open(os.path.join(output_dir, 'stats.json'), 'w') as fp:
+            json.dump(stats, fp, indent=1)
+        return stats
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+# sweep.py
+
+from __future__ import print_function
+
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from backtest import Backtest
+from bar_cache import load_bar_store
+from bar_store import BarStore
+from event import MarketEvent
+from performance import summary_stats
+
+# 每个工作进程中保存的回测配置和数据，由_init_worker设置一次
+_worker = {}
+
+
+def expand_param_grid(param_grid):
+    """
+    把参数网格展开为参数字典的列表。
+    param_grid可以是{参数名: 取值列表}的字典（取所有组合），也可以是参数字典的列表。
+    """
+    if isinstance(param_grid, dict):
+        keys = sorted(param_grid)
+        return [dict(zip(keys, values))
+                for values in itertools.product(*[param_grid[k] for k in keys])]
+    return list(param_grid)
+
+
+def _load_bar_store(config):
+    """
+    读取行情数据，指定了cache_dir时使用二进制缓存
+    """
+    if config.get('cache_dir') is not None:
+        return load_bar_store(config['csv_dir'], config['symbol_list'], config['cache_dir'],
+                              config.get('csv_format'))
+    return BarStore.from_csv(config['csv_dir'], config['symbol_list'], config.get('csv_format'))
+
+
+def _init_worker(config):
+    """
+    工作进程的初始化：保存配置并且只加载一次行情数据，
+    之后这个进程中的所有回测共享同一个BarStore。
+    如果主进程已经把数据放入共享内存，则只读地挂载它，不再读取CSV文件。
+    """
+    _worker.clear()
+    _worker.update(config)
+    if config.get('shared_store') is not None:
+        _worker['bar_store'] = BarStore.attach_shared_memory(config['shared_store'])
+    else:
+        _worker['bar_store'] = _load_bar_store(config)
+
+
+def _stop_on_drawdown(backtest, threshold):
+    """
+    注册一个MarketEvent的处理函数，组合的回撤比例超过threshold时停止回测
+    """
+    metrics = backtest.portfolio.metrics
+    data_handler = backtest.data_handler
+
+    def check(event):
+        if metrics.drawdown_pct > threshold:
+            data_handler.continue_backtest = False
+
+    backtest.subscribe(MarketEvent, check)
+
+
+def _run_one(params):
+    """
+    在工作进程中用一组策略参数执行一次回测，返回参数、事件计数以及
+    资产总值和成交金额曲线；业绩统计由主进程对所有曲线一次性计算。
+    回测因为回撤超过max_drawdown而提前停止时不返回曲线，结果中直接使用
+    组合在停止时的逐条统计。
+    """
+    backtest = Backtest(
+        _worker['csv_dir'], _worker['symbol_list'], _worker['initial_capital'],
+        0.0, _worker['start_date'], _worker['data_handler_cls'],
+        _worker['execution_handler_cls'], _worker['portfolio_cls'],
+        _worker['strategy_cls'], strategy_params=params,
+        data_handler_params={'bar_store': _worker['bar_store']}, verbose=False,
+        execution_handler_params=_worker['execution_handler_params']
+    )
+    threshold = _worker.get('max_drawdown')
+    if threshold is not None:
+        _stop_on_drawdown(backtest, threshold)
+    backtest._run_backtest()
+    portfolio = backtest.portfolio
+    rows = portfolio.ledger_rows
+    result = dict(params)
+    result['signals'] = backtest.signals
+    result['orders'] = backtest.orders
+    result['fills'] = backtest.fills
+    result['aborted'] = threshold is not None and portfolio.metrics.drawdown_pct > threshold
+    if result['aborted']:
+        result.update(portfolio.metrics.stats())
+        return result, None, None
+    return result, portfolio.ledger_total[:rows].copy(), portfolio.ledger_traded[:rows].copy()
+
+
+def score_curves(rows, totals, traded):
+    """
+    把所有回测的资产总值曲线排成(时间, 回测数)的矩阵，一次计算全部的业绩统计，
+    合并到每组参数的结果中。提前停止的回测（曲线为None）保留它们自己的统计
+    """
+    results = pd.DataFrame(list(rows))
+    done = [k for k, total in enumerate(totals) if total is not None]
+    if not done:
+        return results
+    stats = summary_stats(np.column_stack([totals[k] for k in done]),
+                          traded=np.column_stack([traded[k] for k in done]))
+    for key, values in stats.items():
+        if key not in results:
+            results[key] = np.nan
+        results.loc[done, key] = values
+    return results
+
+
+class ParameterSweep(object):
+    """
+    参数优化：对参数网格中的每一组策略参数执行一次回测。回测被分配到一个进程池中
+    并行执行，每个工作进程只加载一次行情数据，所有的业绩统计汇总到一个DataFrame中。
+    shared_memory为True时，行情数据只在主进程中加载一次并放入共享内存，所有工作
+    进程只读地挂载同一份数据，内存占用不再随进程数增长。
+    指定cache_dir时，数据从二进制缓存中以内存映射的方式读取（见bar_cache），
+    缓存在启动进程池之前由主进程准备好。csv_format是CSV文件的格式（见ingest.CSV_FORMATS），
+    None表示yahoo格式。
+    工作进程只返回资产总值曲线，所有曲线在主进程中作为一个矩阵一次性计算业绩统计。
+    指定max_drawdown（回撤比例，例如0.3）时，回撤超过这个值的回测会被提前停止，
+    结果中的aborted列为True。
+    execution_handler_params传给执行处理对象，例如{'cost_model': costs.CostModel(...)}。
+    传入的各个类需要能够被pickle（即定义在可以导入的模块中）。
+    """
+
+    def __init__(
+            self, csv_dir, symbol_list, initial_capital, start_date,
+            data_handler_cls, execution_handler_cls, portfolio_cls, strategy_cls,
+            param_grid, processes=None, chunksize=1, shared_memory=False,
+            cache_dir=None, max_drawdown=None, execution_handler_params=None,
+            csv_format=None
+    ):
+        self.config = {
+            'csv_dir': csv_dir,
+            'symbol_list': symbol_list,
+            'initial_capital': initial_capital,
+            'start_date': start_date,
+            'data_handler_cls': data_handler_cls,
+            'execution_handler_cls': execution_handler_cls,
+            'portfolio_cls': portfolio_cls,
+            'strategy_cls': strategy_cls,
+            'cache_dir': cache_dir,
+            'csv_format': csv_format,
+            'max_drawdown': max_drawdown,
+            'execution_handler_params': execution_handler_params or {},
+        }
+        self.params_list = expand_param_grid(param_grid)
+        self.processes = processes
+        self.chunksize = chunksize
+        self.shared_memory = shared_memory
+        self.results = None
+
+    def run(self):
+        """
+        执行所有的回测，返回每组参数一行的结果表
+        """
+        print("Running %s parameter sets..." % len(self.params_list))
+        config = dict(self.config)
+        shm = None
+        if self.shared_memory and self.processes != 1:
+            store = _load_bar_store(config)
+            config['shared_store'], shm = store.to_shared_memory()
+            del store
+        elif config['cache_dir'] is not None and self.processes != 1:
+            _load_bar_store(config)
+        try:
+            if self.processes == 1:
+                _init_worker(config)
+                outputs = [_run_one(p) for p in self.params_list]
+            else:
+                with ProcessPoolExecutor(max_workers=self.processes,
+                                         initializer=_init_worker,
+                                         initargs=(config,)) as pool:
+                    outputs = list(pool.map(_run_one, self.params_list,
+                                            chunksize=self.chunksize))
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        rows, totals, traded = zip(*outputs)
+        self.results = score_curves(rows, totals, traded)
+        return self.results
+
+    def to_csv(self, path='opt.csv'):
+        """
+        把结果表写入CSV文件
+        """
+        self.results.to_csv(path, index=False)
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+# conftest.py
+
+import os
+import sys
+
+# 仓库中的模块都在顶层，测试时把仓库目录加入导入路径
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+CSV_DIR = os.path.join(ROOT, 'data_csv')
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+# test_bar_store.py
+
+import numpy as np
+import pytest
+
+from bar_store import RingBuffer
+
+
+@pytest.mark.parametrize('capacity', [1, 2, 5])
+def test_ring_buffer_windows_are_latest_rows(capacity):
+    buffer = RingBuffer(capacity, (3,))
+    rows = np.arange(60, dtype=np.float64).reshape(20, 3)
+    assert buffer.last is None
+    assert len(buffer.window(4)) == 0
+    for k, row in enumerate(rows):
+        buffer.append(row)
+        assert len(buffer) == min(k + 1, capacity)
+        np.testing.assert_array_equal(buffer.last, row)
+        for N in range(1, capacity + 3):
+            window = buffer.window(N)
+            np.testing.assert_array_equal(window, rows[max(k + 1 - min(N, capacity), 0):k + 1])
+            # 窗口是数据数组的视图，不是副本
+            assert window.base is buffer.data or window.size == 0
+    assert buffer.data.shape == (2 * capacity, 3)
+
+
+@pytest.mark.parametrize('old, new', [(3, 6), (6, 3), (4, 1)])
+def test_ring_buffer_resize_keeps_latest_rows(old, new):
+    buffer = RingBuffer(old, (), 'datetime64[ns]', np.datetime64('NaT'))
+    times = np.arange('2020-01-01', '2020-01-11', dtype='datetime64[D]').astype('datetime64[ns]')
+    for t in times:
+        buffer.append(t)
+    buffer.resize(new)
+    np.testing.assert_array_equal(buffer.window(new), times[-min(old, new):])
+    buffer.append(np.datetime64('2020-02-01', 'ns'))
+    assert len(buffer) == min(min(old, new) + 1, new)
+    assert buffer.last == np.datetime64('2020-02-01', 'ns')
+    np.testing.assert_array_equal(buffer.window(2)[:-1], times[-1:] if new > 1 else [])
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+# test_costs.py
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import CSV_DIR
+from benchmark import BenchmarkPortfolio
+from costs import (CostModel, ExchangeFees, IB_COMMISSION, SpreadSlippage,
+                   SquareRootImpact, TieredCommission)
+from event import FillEvent, ib_commission
+from execution import SimulatedExecutionHandler
+from vectorized import VectorizedBacktest
+from Strategies.MovingAverageCrossStrategy import MovingAverageCrossStrategy
+
+COMPONENTS = [
+    IB_COMMISSION,
+    TieredCommission([(100, 0.002), (1000, 0.001), (np.inf, 0.0005)],
+                     minimum=1.0, maximum=0.01, per_share=False),
+    ExchangeFees({'NYSE': (0.003, 0.0), 'SSE': (0.0, 0.00002)}, {'A': 'NYSE', 'B': 'SSE'}),
+    SpreadSlippage(10, {'B': 25}),
+    SquareRootImpact(0.5),
+]
+
+
+@pytest.fixture(scope='module')
+def trades():
+    rng = np.random.default_rng(0)
+    n = 1000
+    quantity = rng.integers(-50, 3000, n).astype(float)
+    price = rng.uniform(5, 500, n)
+    symbols = np.array(['A', 'B', 'C'])[rng.integers(0, 3, n)]
+    market = {'volume': rng.uniform(0, 1e6, n), 'volatility': rng.uniform(0, 0.05, n)}
+    # 包括没有波动率和成交量为0的数据
+    market['volatility'][::7] = np.nan
+    market['volume'][::5] = 0
+    return symbols, quantity, price, market
+
+
+@pytest.mark.parametrize('component', COMPONENTS, ids=lambda c: type(c).__name__)
+def test_component_batch_matches_cost(trades, component):
+    symbols, quantity, price, market = trades
+    batch = component.batch(symbols, quantity, price, market)
+    scalar = [component.cost(symbols[k], quantity[k], price[k],
+                             {'volume': market['volume'][k],
+                              'volatility': market['volatility'][k]})
+              for k in range(len(quantity))]
+    np.testing.assert_allclose(batch, scalar, rtol=1e-12, atol=0)
+
+
+def test_ib_commission_matches_fill_event(trades):
+    quantity = trades[1]
+    expected = [FillEvent(None, 'A', q, 'BUY', None).commission for q in quantity]
+    np.testing.assert_array_equal(ib_commission(quantity), expected)
+
+
+def test_cost_model_batch_matches_fill(trades, monkeypatch):
+    symbols, quantity, price, market = trades
+    quantity = np.abs(quantity) + 1
+    model = CostModel(fees=COMPONENTS[2:3], slippage=COMPONENTS[3:])
+    direction = np.where(np.arange(len(quantity)) % 2, 1, -1)
+    batch_price, batch_commission = model.batch(symbols, quantity, price, direction, market)
+    for k in range(len(quantity)):
+        market_k = {'volume': market['volume'][k], 'volatility': market['volatility'][k]}
+        # fill从数据处理对象中取市场数据，这里直接给出第k笔成交的数据
+        monkeypatch.setattr(model, 'market', lambda bars, symbol: market_k)
+        fill_price, commission = model.fill(symbols[k], quantity[k], price[k],
+                                            'BUY' if direction[k] > 0 else 'SELL', bars=True)
+        assert batch_price[k] == pytest.approx(fill_price, rel=1e-12)
+        assert batch_commission[k] == pytest.approx(commission, rel=1e-12)
+
+
+def test_vectorized_validate_with_cost_model():
+    model = CostModel(fees=[ExchangeFees({'NASDAQ': (0.0, 0.0000221)}, {}, default='NASDAQ')],
+                      slippage=[SpreadSlippage(5), SquareRootImpact(0.3, window=20)])
+    params = {'short_window': 20, 'long_window': 60}
+    vectorized = VectorizedBacktest(CSV_DIR, ['AAPL'], 100000.0, pd.Timestamp('2015-05-01'),
+                                    BenchmarkPortfolio, MovingAverageCrossStrategy, params,
+                                    cost_model=model)
+    vectorized.run()
+    vectorized.validate(SimulatedExecutionHandler)
+    free = VectorizedBacktest(CSV_DIR, ['AAPL'], 100000.0, pd.Timestamp('2015-05-01'),
+                              BenchmarkPortfolio, MovingAverageCrossStrategy, params)
+    free.run()
+    rows = free.portfolio.ledger_rows
+    assert vectorized.fills == free.fills > 0
+    assert vectorized.portfolio.ledger_commission[rows - 1] > free.portfolio.ledger_commission[rows - 1]
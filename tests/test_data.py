@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+# test_data.py
+
+import pytest
+
+from conftest import CSV_DIR
+from data import HistoricCSVDataHandler
+from event import EventQueue
+
+
+def test_dense_getters_raise_before_first_bar():
+    bars = HistoricCSVDataHandler(EventQueue(), CSV_DIR, ['AAPL'])
+    with pytest.raises(IndexError):
+        bars.get_latest_bar('AAPL')
+    with pytest.raises(IndexError):
+        bars.get_latest_bar_value('AAPL', 'adj_close')
+    with pytest.raises(IndexError):
+        bars.get_latest_bar_datetime('AAPL')
+    with pytest.raises(IndexError):
+        bars.get_latest_datetime()
+    assert len(bars.get_history('adj_close', 5)) == 0
+
+    bars.update_bars()
+    first = bars.bar_store.index[0]
+    assert bars.get_latest_datetime() == first
+    assert bars.get_latest_bar_datetime('AAPL') == first
+    assert bars.get_latest_bar_value('AAPL', 'adj_close') == \
+        bars.bar_store.columns['adj_close'][0, 0]
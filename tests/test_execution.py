@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+# test_execution.py
+
+import numpy as np
+import pytest
+
+from backtest import Backtest
+from benchmark import BenchmarkPortfolio, STAGES, _stage_times, write_universe
+from data import HistoricCSVDataHandler, SparseCSVDataHandler
+from event import EventQueue, OrderEvent
+from execution import MatchingExecutionHandler
+from Strategies.MovingAverageCrossStrategy import MovingAverageCrossStrategy
+
+SIGNS = {'BL': -1.0, 'SL': 1.0, 'BS': 1.0, 'SS': -1.0}
+
+
+@pytest.fixture(scope='module')
+def universe(tmp_path_factory):
+    csv_dir = str(tmp_path_factory.mktemp('universe'))
+    return csv_dir, write_universe(csv_dir, 2, 400, gap=0.1, seed=3)
+
+
+def _naive(bars, orders_at, participation):
+    """
+    逐条数据扫描全部挂单的参考实现，规则与MatchingExecutionHandler相同
+    """
+    book, triggered, fills, seq = [], {}, [], 0
+    for t, (symbols, open_, high, low, volume, updated) in enumerate(bars):
+        converted = []
+        for j, s in enumerate(symbols):
+            if updated is not None and s not in updated:
+                continue
+            cap = np.inf if participation is None else participation * volume[j]
+
+            def fill(r, price, cap):
+                q = r['rem'] if cap == np.inf else min(r['rem'], int(cap))
+                r['rem'] -= q
+                if r['rem'] <= 0:
+                    r['active'] = False
+                fills.append((t, s, q, r['ev'].buy_or_sell, round(price, 8)))
+                return cap - q
+
+            queue = triggered.get(j, [])
+            while queue and cap >= 1 and open_[j] == open_[j]:
+                if queue[0]['active']:
+                    cap = fill(queue[0], open_[j], cap)
+                if not queue[0]['active']:
+                    queue.pop(0)
+            for side in ('BS', 'SS', 'BL', 'SL'):
+                sign = SIGNS[side]
+                bound = high[j] if sign > 0 else -low[j]
+                cands = sorted([r for r in book if r['sym'] == s and r['side'] == side
+                                and r['active']], key=lambda r: (r['key'], r['seq']))
+                for k, r in enumerate(cands):
+                    if not r['key'] <= bound or not cap >= 1:
+                        break
+                    ev = r['ev']
+                    price = sign * r['key']
+                    if open_[j] == open_[j]:
+                        price = min(price, open_[j]) if sign < 0 else max(price, open_[j])
+                    if side in ('BS', 'SS') and ev.order_type == 'STP LMT' and \
+                            ((price > ev.order_price) if side == 'BS' else (price < ev.order_price)):
+                        r['active'] = False
+                        converted.append(r)
+                        continue
+                    cap = fill(r, price, cap)
+                if side in ('BS', 'SS'):
+                    for r in cands:
+                        if r['active'] and r['key'] <= bound:
+                            r['active'] = False
+                            if r['ev'].order_type == 'STP LMT':
+                                converted.append(r)
+                            else:
+                                triggered.setdefault(j, []).append(dict(r, active=True))
+        for r in converted:
+            ev = r['ev']
+            side = 'BL' if ev.buy_or_sell == 'BUY' else 'SL'
+            book.append(dict(r, side=side, key=SIGNS[side] * ev.order_price, seq=seq, active=True))
+            seq += 1
+        for ev in orders_at.get(t, []):
+            buy = ev.buy_or_sell == 'BUY'
+            if ev.order_type == 'LMT':
+                side, price = ('BL' if buy else 'SL'), ev.order_price
+            else:
+                side = 'BS' if buy else 'SS'
+                price = ev.stop_price if ev.stop_price is not None else ev.order_price
+            book.append(dict(ev=ev, sym=ev.symbol, side=side, key=SIGNS[side] * price,
+                             seq=seq, rem=ev.quantity, active=True))
+            seq += 1
+    return fills
+
+
+@pytest.mark.parametrize('handler_cls', [HistoricCSVDataHandler, SparseCSVDataHandler])
+@pytest.mark.parametrize('participation', [None, 2e-4])
+def test_matching_agrees_with_naive_scan(universe, handler_cls, participation):
+    csv_dir, symbols = universe
+    rng = np.random.default_rng(11)
+    market = EventQueue()
+    bars = handler_cls(market, csv_dir, symbols)
+    events = EventQueue()
+    handler = MatchingExecutionHandler(events, participation=participation)
+    orders_at, seen, fills, t = {}, [], [], 0
+    while True:
+        bars.update_bars()
+        if not bars.continue_backtest:
+            break
+        event = market.popleft()
+        handler.on_market(event, bars)
+        while events:
+            f = events.popleft()
+            fills.append((t, f.symbol, f.quantity, f.buy_or_sell, round(f.fill_cost, 8)))
+        seen.append((bars.symbol_list,) +
+                    tuple(bars.get_history(x, 1)[-1].copy() for x in ('open', 'high', 'low', 'volume')) +
+                    (event.symbols,))
+        for k in range(rng.integers(0, 4)):
+            s = symbols[rng.integers(len(symbols))]
+            px = bars.get_history('close', 1)[-1][symbols.index(s)]
+            if px != px:
+                continue
+            order_type = ('LMT', 'STP', 'STP LMT')[rng.integers(3)]
+            side = ('BUY', 'SELL')[rng.integers(2)]
+            stop = px + abs(px * rng.normal(0, 0.03)) * (1 if side == 'BUY' else -1)
+            limit = px * (1 + rng.normal(0, 0.03))
+            order = OrderEvent(None, s, order_type, int(rng.integers(1, 5000)), side,
+                               stop if order_type == 'STP' else limit, 'LONG',
+                               stop if order_type == 'STP LMT' else None)
+            handler.execute_order(order)
+            orders_at.setdefault(t, []).append(order)
+        t += 1
+    assert fills == _naive(seen, orders_at, participation)
+    assert len(fills) > 100
+
+
+class _Bars(object):
+    """
+    只有一个代码、逐条给出数据的最小数据处理对象
+    """
+    symbol_list = ['X']
+
+    def __init__(self):
+        self.row = None
+
+    def get_history(self, field, N=1):
+        return np.array([[self.row[field]]])
+
+    def get_latest_datetime(self):
+        return self.row['t']
+
+
+class _Market(object):
+    type = 'MARKET'
+    symbols = None
+
+
+def _bar(t, open_, high, low, volume=1000.0):
+    return {'t': t, 'open': open_, 'high': high, 'low': low, 'volume': volume, 'close': open_}
+
+
+@pytest.mark.parametrize('order_type', ['STP', 'STP LMT'])
+def test_capped_stop_drains_without_new_trigger(order_type):
+    events = EventQueue()
+    handler = MatchingExecutionHandler(events, participation=0.01)
+    bars = _Bars()
+    bars.row = _bar(0, 100.0, 101.0, 99.0)
+    handler.on_market(_Market(), bars)
+    # 卖出止损，触发价95，止损限价单的限价为90
+    handler.execute_order(OrderEvent(None, 'X', order_type, 35, 'SELL',
+                                     90.0 if order_type == 'STP LMT' else 95.0, 'SHORT',
+                                     95.0 if order_type == 'STP LMT' else None))
+    # 第1条数据触发止损，成交量的限制是每条10股；之后价格回到触发价之上
+    rows = [_bar(1, 96.0, 96.0, 94.0), _bar(2, 97.0, 98.0, 96.5),
+            _bar(3, 98.0, 99.0, 97.0), _bar(4, 99.0, 99.5, 98.0)]
+    fills = []
+    for row in rows:
+        bars.row = row
+        handler.on_market(_Market(), bars)
+        while events:
+            f = events.popleft()
+            fills.append((row['t'], f.quantity, f.fill_cost))
+    assert [q for t, q, p in fills] == [10, 10, 10, 5]
+    assert [t for t, q, p in fills] == [1, 2, 3, 4]
+    assert fills[0][2] == 95.0
+    # 之后的成交：止损单按开盘价，止损限价单按限价单规则（开盘价高于限价时按开盘价）
+    assert [p for t, q, p in fills[1:]] == [97.0, 98.0, 99.0]
+    assert not handler.open_orders
+
+
+def test_profile_separates_matching_from_update_timeindex(universe):
+    csv_dir, symbols = universe
+    backtest = Backtest(csv_dir, symbols, 100000.0, 0.0, np.datetime64('2010-01-01'),
+                        HistoricCSVDataHandler, MatchingExecutionHandler, BenchmarkPortfolio,
+                        MovingAverageCrossStrategy,
+                        strategy_params={'short_window': 10, 'long_window': 30},
+                        verbose=False, profile=True)
+    backtest._run_backtest()
+    handlers = backtest.profiler.report()['handlers']
+    assert handlers['MatchingExecutionHandler.on_market']['calls'] == \
+        handlers['BenchmarkPortfolio.update_timeindex']['calls'] == \
+        len(backtest.data_handler.bar_store)
+    # 撮合计入execution阶段，每个处理函数只属于一个阶段
+    for name in handlers:
+        assert sum(name.endswith(suffixes) for stage, suffixes in STAGES) == 1, name
+    report = {'handlers': {'MatchingExecutionHandler.on_market': {'total': 1.0},
+                           'BenchmarkPortfolio.update_timeindex': {'total': 2.0}}}
+    times = _stage_times(report)
+    assert times['execution'] == 1.0
+    assert times['portfolio'] == 2.0
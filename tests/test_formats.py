@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+# test_formats.py
+
+import pandas as pd
+import pytest
+
+from conftest import CSV_DIR
+from backtest import Backtest
+from benchmark import BenchmarkPortfolio
+from data import HistoricCSVDataHandler
+from execution import SimulatedExecutionHandler
+from sharded import ShardedBacktest
+from sweep import ParameterSweep
+from vectorized import VectorizedBacktest
+from Strategies.MovingAverageCrossStrategy import MovingAverageCrossStrategy
+
+# data_csv/hs300.csv是ingest.CSV_FORMATS中'hs300'格式的沪深300指数
+SYMBOLS = ['hs300']
+START = pd.Timestamp('2005-01-01')
+GRID = {'short_window': [5, 10], 'long_window': [30]}
+
+
+def _backtest(params):
+    backtest = Backtest(CSV_DIR, SYMBOLS, 100000.0, 0.0, START, HistoricCSVDataHandler,
+                        SimulatedExecutionHandler, BenchmarkPortfolio,
+                        MovingAverageCrossStrategy, strategy_params=params,
+                        data_handler_params={'csv_format': 'hs300'}, verbose=False)
+    backtest._run_backtest()
+    return backtest
+
+
+def test_vectorized_reads_csv_format():
+    vectorized = VectorizedBacktest(CSV_DIR, SYMBOLS, 100000.0, START, BenchmarkPortfolio,
+                                    MovingAverageCrossStrategy,
+                                    strategy_params={'short_window': 5, 'long_window': 30},
+                                    csv_format='hs300')
+    vectorized.run()
+    assert len(vectorized.data_handler.bar_store) == 3691
+    assert vectorized.fills > 0
+    vectorized.validate(SimulatedExecutionHandler)
+
+
+@pytest.mark.parametrize('processes, shared_memory', [(1, False), (2, False), (2, True)])
+def test_sweep_reads_csv_format(processes, shared_memory):
+    sweep = ParameterSweep(CSV_DIR, SYMBOLS, 100000.0, START, HistoricCSVDataHandler,
+                           SimulatedExecutionHandler, BenchmarkPortfolio,
+                           MovingAverageCrossStrategy, GRID, processes=processes,
+                           shared_memory=shared_memory, csv_format='hs300')
+    results = sweep.run()
+    for k, row in results.iterrows():
+        params = {'short_window': row['short_window'], 'long_window': row['long_window']}
+        assert row['fills'] == _backtest(params).fills > 0
+
+
+def test_sharded_reads_csv_format():
+    sharded = ShardedBacktest(CSV_DIR, SYMBOLS, 100000.0, START, HistoricCSVDataHandler,
+                              SimulatedExecutionHandler, BenchmarkPortfolio,
+                              MovingAverageCrossStrategy,
+                              strategy_params={'short_window': 5, 'long_window': 30},
+                              data_handler_params={'csv_format': 'hs300'}, processes=1)
+    sharded.run()
+    assert sharded.fills == _backtest({'short_window': 5, 'long_window': 30}).fills
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+# test_indicators.py
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Strategies.indicators import (ATR, EMA, RSI, RollingMax, RollingMin, RollingStd, SMA,
+                                   ZScore, rolling_mean)
+
+Row = namedtuple('Row', ('high', 'low', 'close'))
+WINDOW = 5
+
+
+@pytest.fixture(scope='module')
+def prices():
+    """
+    (时间, 代码)的行情：第1个代码从第20条数据才开始（预热期），第2个代码随机缺失
+    30%的数据，第3个代码中间有一段价格不变
+    """
+    rng = np.random.default_rng(4)
+    T, S = 120, 4
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0, 0.02, (T, S)), axis=0))
+    close[40:60, 3] = close[40, 3]
+    high = close * (1 + np.abs(rng.normal(0, 0.01, (T, S))))
+    low = close * (1 - np.abs(rng.normal(0, 0.01, (T, S))))
+    high[40:60, 3] = low[40:60, 3] = close[40, 3]
+    missing = np.zeros((T, S), dtype=bool)
+    missing[:20, 1] = True
+    missing[:, 2] = rng.random(T) < 0.3
+    for a in (close, high, low):
+        a[missing] = np.nan
+    return high, low, close
+
+
+def _run(indicator, prices, attr='value'):
+    high, low, close = prices
+    values = []
+    for t in range(len(close)):
+        indicator.update(Row(high[t], low[t], close[t]))
+        values.append(np.array(getattr(indicator, attr), dtype=np.float64))
+    return np.array(values)
+
+
+def _reference(values, func):
+    """
+    对每个代码的有效数据分别计算func，没有数据的时刻沿用上一个值
+    """
+    out = np.full(values.shape, np.nan)
+    for j in range(values.shape[1]):
+        series = pd.Series(values[:, j]).dropna()
+        if len(series):
+            out[:, j] = func(series).reindex(range(len(values))).ffill().values
+    return out
+
+
+def _window_std(ddof):
+    """
+    直接对每个窗口求标准差（pandas的rolling std用滑动和计算，价格不变时有舍入误差）
+    """
+    def func(s):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return s.rolling(WINDOW, min_periods=1).apply(
+                lambda w: np.std(w, ddof=ddof) if len(w) > ddof else np.nan, raw=True)
+    return func
+
+
+def _wilder(values, window):
+    """
+    前window个数据取简单平均，之后按Wilder的方法递推
+    """
+    out = np.empty(len(values))
+    for k, v in enumerate(values):
+        n = min(k + 1, window)
+        out[k] = v if k == 0 else out[k - 1] + (v - out[k - 1]) / n
+    return out
+
+
+def test_sma_matches_rolling_mean_exactly(prices):
+    close = prices[2]
+    actual = _run(SMA('close', WINDOW), prices)
+    np.testing.assert_array_equal(actual, rolling_mean(close, WINDOW))
+    expected = _reference(close, lambda s: s.rolling(WINDOW, min_periods=1).mean())
+    np.testing.assert_allclose(actual, expected, rtol=1e-12)
+
+
+def test_short_and_long_sma_are_equal_before_the_long_window_fills():
+    # 第short_window条数据上两条均线都是同样几个数据的平均值，必须严格相等
+    rng = np.random.default_rng(0)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0, 0.02, (30, 200)), axis=0))
+    short, long_ = SMA('close', 10), SMA('close', 50)
+    for t in range(len(close)):
+        row = Row(close[t], close[t], close[t])
+        short.update(row)
+        long_.update(row)
+        if t < 10:
+            np.testing.assert_array_equal(short.value, long_.value)
+
+
+@pytest.mark.parametrize('ddof', [0, 1])
+def test_rolling_std_matches_pandas(prices, ddof):
+    close = prices[2]
+    expected = _reference(close, _window_std(ddof))
+    np.testing.assert_allclose(_run(RollingStd('close', WINDOW, ddof), prices), expected,
+                               rtol=1e-9, atol=1e-9)
+
+
+def test_zscore_matches_pandas(prices):
+    close = prices[2]
+    mean = _reference(close, lambda s: s.rolling(WINDOW, min_periods=1).mean())
+    std = _reference(close, _window_std(0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = (close - mean) / std
+    actual = _run(ZScore('close', WINDOW), prices)
+    # 窗口内只有一个数据或者价格不变时标准差为0（由舍入误差决定是0还是很小的数），跳过
+    check = std > 1e-6
+    np.testing.assert_allclose(actual[check], expected[check], rtol=1e-7)
+    assert np.isnan(actual[np.isnan(close)]).all()
+
+
+def test_ema_matches_pandas(prices):
+    close = prices[2]
+    expected = _reference(close, lambda s: s.ewm(span=WINDOW, adjust=False).mean())
+    np.testing.assert_allclose(_run(EMA('close', WINDOW), prices), expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize('cls, method', [(RollingMax, 'max'), (RollingMin, 'min')])
+def test_rolling_extremes_match_pandas(prices, cls, method):
+    close = prices[2]
+    expected = _reference(close, lambda s: getattr(s.rolling(WINDOW, min_periods=1), method)())
+    np.testing.assert_array_equal(_run(cls('close', WINDOW), prices), expected)
+
+
+def test_atr_matches_reference(prices):
+    high, low, close = prices
+
+    def atr(j):
+        def func(s):
+            rows = s.index
+            h = pd.Series(high[rows, j], index=rows)
+            l = pd.Series(low[rows, j], index=rows)
+            prev = s.shift(1)
+            tr = pd.concat([h - l, (h - prev).abs(), (l - prev).abs()], axis=1).max(axis=1)
+            return pd.Series(_wilder(tr.values, WINDOW), index=rows)
+        return func
+
+    expected = np.column_stack([_reference(close[:, [j]], atr(j))[:, 0]
+                                for j in range(close.shape[1])])
+    np.testing.assert_allclose(_run(ATR(WINDOW), prices), expected, rtol=1e-12)
+
+
+def test_rsi_matches_reference(prices):
+    close = prices[2]
+
+    def rsi(s):
+        change = s.diff().iloc[1:]
+        gain = _wilder(np.maximum(change.values, 0.0), WINDOW)
+        loss = _wilder(np.maximum(-change.values, 0.0), WINDOW)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            value = np.where(loss == 0.0, 100.0, 100.0 - 100.0 / (1.0 + gain / loss))
+        value = np.where((gain == 0.0) & (loss == 0.0), 50.0, value)
+        return pd.Series(value, index=change.index)
+
+    expected = _reference(close, rsi)
+    actual = _run(RSI('close', WINDOW), prices)
+    np.testing.assert_allclose(actual, expected, rtol=1e-12)
+    # 第一条数据之前和只有一条数据时还没有价格变化
+    assert np.isnan(actual[0]).all()
+    assert np.isnan(actual[:20, 1]).all()
+
+
+def test_rsi_on_flat_prices_is_50():
+    indicator = RSI('close', WINDOW)
+    flat = np.array([10.0, 10.0])
+    for t in range(10):
+        indicator.update(Row(flat, flat, flat))
+    np.testing.assert_array_equal(indicator.value, [50.0, 50.0])
+    indicator.update(Row(flat, flat, np.array([11.0, 9.0])))
+    np.testing.assert_array_equal(indicator.value, [100.0, 0.0])
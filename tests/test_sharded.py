@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+# test_sharded.py
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest import Backtest
+from benchmark import BenchmarkPortfolio, write_universe
+from data import HistoricCSVDataHandler, StreamingCSVDataHandler, SparseCSVDataHandler
+from execution import SimulatedExecutionHandler
+import sharded
+from sharded import ShardedBacktest
+from Strategies.MovingAverageCrossStrategy import MovingAverageCrossStrategy
+
+START = pd.Timestamp('2009-12-01')
+PARAMS = {'short_window': 10, 'long_window': 30}
+
+
+@pytest.fixture(scope='module')
+def universe(tmp_path_factory):
+    # 各个代码随机缺失10%的数据，交易日各不相同
+    csv_dir = str(tmp_path_factory.mktemp('universe'))
+    return csv_dir, write_universe(csv_dir, 6, 400, gap=0.1, seed=5)
+
+
+def _sharded(csv_dir, symbols, handler_cls, processes=1, data_handler_params=None):
+    return ShardedBacktest(csv_dir, symbols, 100000.0, START, handler_cls,
+                           SimulatedExecutionHandler, BenchmarkPortfolio,
+                           MovingAverageCrossStrategy, strategy_params=PARAMS,
+                           data_handler_params=data_handler_params,
+                           processes=processes, n_shards=3)
+
+
+@pytest.mark.parametrize('handler_cls', [HistoricCSVDataHandler, SparseCSVDataHandler])
+def test_sharded_matches_unsharded_on_gapped_data(universe, handler_cls):
+    csv_dir, symbols = universe
+    backtest = Backtest(csv_dir, symbols, 100000.0, 0.0, START, handler_cls,
+                        SimulatedExecutionHandler, BenchmarkPortfolio,
+                        MovingAverageCrossStrategy, strategy_params=PARAMS, verbose=False)
+    backtest._run_backtest()
+    backtest.portfolio.create_equity_curve_dateframe()
+    expected = backtest.portfolio.equity_curve
+
+    sharded = _sharded(csv_dir, symbols, handler_cls)
+    curve = sharded.run()
+    assert sharded.fills == backtest.fills
+    assert sharded.signals == backtest.signals
+    np.testing.assert_allclose(curve['total'].values, expected['total'].values)
+    np.testing.assert_allclose(curve[symbols].values, expected[symbols].values)
+
+
+@pytest.mark.parametrize('handler_cls, cache', [
+    (HistoricCSVDataHandler, False),
+    (HistoricCSVDataHandler, True),
+    (SparseCSVDataHandler, False),
+])
+def test_process_pool_matches_single_process(universe, tmp_path, handler_cls, cache):
+    csv_dir, symbols = universe
+    params = {'cache_dir': str(tmp_path / 'cache')} if cache else None
+    serial = _sharded(csv_dir, symbols, handler_cls)
+    serial.run()
+    pooled = _sharded(csv_dir, symbols, handler_cls, processes=2, data_handler_params=params)
+    pooled.run()
+    assert pooled.fills == serial.fills
+    pd.testing.assert_frame_equal(pooled.equity_curve, serial.equity_curve)
+    pd.testing.assert_frame_equal(pooled.trades, serial.trades)
+
+
+def test_sharded_rejects_streaming_with_different_calendars(universe, monkeypatch):
+    csv_dir, symbols = universe
+
+    def fail(task):
+        raise AssertionError("shards should not run")
+
+    # 在启动任何一份回测之前就检查时间索引
+    monkeypatch.setattr(sharded, '_run_shard', fail)
+    with pytest.raises(ValueError, match='calendar'):
+        _sharded(csv_dir, symbols, StreamingCSVDataHandler).run()
+
+
+def test_sharded_runs_streaming_with_a_common_calendar(tmp_path):
+    csv_dir = str(tmp_path)
+    symbols = write_universe(csv_dir, 4, 200, seed=8)
+    backtest = Backtest(csv_dir, symbols, 100000.0, 0.0, START, StreamingCSVDataHandler,
+                        SimulatedExecutionHandler, BenchmarkPortfolio,
+                        MovingAverageCrossStrategy, strategy_params=PARAMS, verbose=False)
+    backtest._run_backtest()
+    sharded_run = _sharded(csv_dir, symbols, StreamingCSVDataHandler, processes=2)
+    sharded_run.run()
+    assert sharded_run.fills == backtest.fills > 0
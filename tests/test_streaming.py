@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+# test_streaming.py
+
+import numpy as np
+import pytest
+
+from benchmark import write_universe
+from data import HistoricCSVDataHandler, SparseCSVDataHandler, StreamingCSVDataHandler
+from event import EventQueue
+
+
+@pytest.fixture(scope='module')
+def universe(tmp_path_factory):
+    # 有缺失数据的三个代码，各自的时间索引不同
+    csv_dir = str(tmp_path_factory.mktemp('universe'))
+    return csv_dir, write_universe(csv_dir, 3, 300, gap=0.1, seed=7)
+
+
+@pytest.mark.parametrize('handler_cls', [StreamingCSVDataHandler, SparseCSVDataHandler])
+def test_getters_raise_before_first_bar(universe, handler_cls):
+    csv_dir, symbols = universe
+    bars = handler_cls(EventQueue(), csv_dir, symbols)
+    for getter, args in ((bars.get_latest_bar, (symbols[0],)),
+                         (bars.get_latest_bar_value, (symbols[0], 'adj_close')),
+                         (bars.get_latest_bar_datetime, (symbols[0],)),
+                         (bars.get_latest_datetime, ())):
+        with pytest.raises(IndexError):
+            getter(*args)
+    bars.update_bars()
+    bars.get_latest_datetime()
+
+
+@pytest.mark.parametrize('lookback', [1, 3, 50])
+def test_streaming_windows_match_dense(universe, lookback):
+    csv_dir, symbols = universe
+    dense = HistoricCSVDataHandler(EventQueue(), csv_dir, symbols)
+    stream = StreamingCSVDataHandler(EventQueue(), csv_dir, symbols, chunksize=37,
+                                     max_lookback=lookback)
+    for t in range(len(dense.bar_store)):
+        dense.update_bars()
+        stream.update_bars()
+        kept = min(t + 1, lookback)
+        for N in (1, lookback, lookback + 5):
+            for field in ('adj_close', 'pct_change', 'volume'):
+                expected = dense.get_history(field, min(N, kept))
+                actual = stream.get_history(field, N)
+                assert actual.shape == expected.shape
+                np.testing.assert_array_equal(actual, expected)
+            np.testing.assert_array_equal(stream.get_latest_bars(symbols[1], N).datetime,
+                                          dense.get_latest_bars(symbols[1], min(N, kept)).datetime)
+        assert stream.get_latest_datetime() == dense.get_latest_datetime()
+    stream.update_bars()
+    assert not stream.continue_backtest
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# test_sweep.py
+
+import pandas as pd
+import pytest
+
+from benchmark import BenchmarkPortfolio, write_universe
+from data import HistoricCSVDataHandler
+from execution import SimulatedExecutionHandler
+from sweep import ParameterSweep, expand_param_grid
+from Strategies.MovingAverageCrossStrategy import MovingAverageCrossStrategy
+
+GRID = {'short_window': [5, 10], 'long_window': [20, 40]}
+
+
+@pytest.fixture(scope='module')
+def universe(tmp_path_factory):
+    csv_dir = str(tmp_path_factory.mktemp('universe'))
+    return csv_dir, write_universe(csv_dir, 3, 300, gap=0.05, seed=2)
+
+
+def _sweep(universe, **kwargs):
+    csv_dir, symbols = universe
+    sweep = ParameterSweep(csv_dir, symbols, 100000.0, pd.Timestamp('2009-12-01'),
+                           HistoricCSVDataHandler, SimulatedExecutionHandler,
+                           BenchmarkPortfolio, MovingAverageCrossStrategy, GRID, **kwargs)
+    return sweep.run()
+
+
+@pytest.fixture(scope='module')
+def serial(universe):
+    return _sweep(universe, processes=1)
+
+
+def test_expand_param_grid():
+    assert expand_param_grid(GRID) == [
+        {'long_window': 20, 'short_window': 5}, {'long_window': 20, 'short_window': 10},
+        {'long_window': 40, 'short_window': 5}, {'long_window': 40, 'short_window': 10},
+    ]
+    assert expand_param_grid([{'a': 1}]) == [{'a': 1}]
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'processes': 2},
+    {'processes': 2, 'chunksize': 2},
+    {'processes': 2, 'shared_memory': True},
+], ids=['pool', 'chunked', 'shared_memory'])
+def test_pool_matches_serial(universe, serial, kwargs):
+    assert (serial['fills'] > 0).all()
+    pd.testing.assert_frame_equal(_sweep(universe, **kwargs), serial)
+
+
+def test_cache_dir_matches_serial(universe, serial, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    pd.testing.assert_frame_equal(_sweep(universe, processes=2, cache_dir=cache_dir), serial)
+    pd.testing.assert_frame_equal(_sweep(universe, processes=1, cache_dir=cache_dir), serial)
+
+
+def test_plot_reads_sweep_columns_by_name(universe, serial, tmp_path):
+    pytest.importorskip('matplotlib')
+    from plot_sharpe import create_data_matrix, param_columns
+
+    path = str(tmp_path / 'opt.csv')
+    serial.to_csv(path, index=False)
+    results = pd.read_csv(path)
+    assert param_columns(results) == ['long_window', 'short_window']
+    data = create_data_matrix(results, 'sharpe')
+    assert list(data.index) == GRID['long_window']
+    assert list(data.columns) == GRID['short_window']
+    for _, row in serial.iterrows():
+        assert data.loc[row['long_window'], row['short_window']] == pytest.approx(row['sharpe'])
+    # 多于两个参数时，其他参数的取值用aggfunc合并
+    results['extra'] = 0
+    results = pd.concat([results, results.assign(extra=1, sharpe=results['sharpe'] + 1.0)])
+    results = results[param_columns(serial) + ['extra'] + list(serial.columns[2:])]
+    with pytest.raises(ValueError):
+        create_data_matrix(results, 'sharpe')
+    best = create_data_matrix(results, 'sharpe', x='short_window', y='long_window')
+    pd.testing.assert_frame_equal(best, data + 1.0)
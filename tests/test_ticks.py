@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# test_ticks.py
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data import TickBarDataHandler
+from event import EventQueue
+from ticks import BAR_COLUMNS, aggregate_ticks, make_aggregator
+
+SPECS = ['1min', 'tick:50', 'volume:2000']
+N_TICKS = 3000
+
+
+def _ticks(seed):
+    """
+    模拟的逐笔成交：间隔是0到3秒的整数，所以经常有多笔成交的时间相同
+    """
+    rng = np.random.RandomState(seed)
+    start = pd.Timestamp('2020-01-02 09:30:00').value
+    times = start + np.cumsum(rng.randint(0, 4, N_TICKS)) * 10 ** 9
+    prices = 100.0 + np.cumsum(rng.normal(0.0, 0.05, N_TICKS))
+    volumes = rng.randint(1, 100, N_TICKS).astype(np.float64)
+    return pd.DataFrame({'datetime': pd.DatetimeIndex(times.view('datetime64[ns]')),
+                         'price': prices, 'volume': volumes})
+
+
+@pytest.fixture(scope='module')
+def tick_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp('ticks')
+    frames = {}
+    for seed, symbol in enumerate(['AAA', 'BBB']):
+        frames[symbol] = _ticks(seed)
+        frames[symbol].to_csv(str(path / ('%s.csv' % symbol)), index=False)
+    return str(path), frames
+
+
+def _reference(ticks, spec):
+    """
+    一次性聚合全部成交的参考实现
+    """
+    kind, _, size = spec.partition(':')
+    if kind == 'tick':
+        keys = np.arange(len(ticks)) // int(size)
+    elif kind == 'volume':
+        keys = ((ticks['volume'].cumsum() - ticks['volume']) // float(size)).values
+    else:
+        resampled = ticks.set_index('datetime').resample(spec, closed='left', label='right')
+        frame = resampled['price'].ohlc()
+        frame['volume'] = resampled['volume'].sum()
+        frame = frame[resampled['price'].count() > 0]
+        frame['adj_close'] = frame['close']
+        return frame
+    groups = ticks.groupby(keys)
+    frame = groups['price'].ohlc()
+    frame['volume'] = groups['volume'].sum()
+    frame['adj_close'] = frame['close']
+    frame.index = pd.DatetimeIndex(groups['datetime'].last().values)
+    return frame
+
+
+@pytest.mark.parametrize('spec', SPECS)
+def test_aggregation_matches_reference(tick_dir, spec):
+    csv_dir, frames = tick_dir
+    bars = aggregate_ticks(csv_dir + '/AAA.csv', [spec], chunksize=N_TICKS)[spec]
+    expected = _reference(frames['AAA'], spec)
+    assert len(bars) == len(expected)
+    np.testing.assert_allclose(bars[list(BAR_COLUMNS)].values,
+                               expected[list(BAR_COLUMNS)].values)
+    np.testing.assert_array_equal(bars.index.values, expected.index.values)
+
+
+@pytest.mark.parametrize('chunksize', [1, 7, 49, 50, 333])
+def test_chunked_matches_unchunked(tick_dir, chunksize):
+    csv_dir, frames = tick_dir
+    whole = aggregate_ticks(csv_dir + '/AAA.csv', SPECS, chunksize=N_TICKS)
+    chunked = aggregate_ticks(csv_dir + '/AAA.csv', SPECS, chunksize=chunksize)
+    for spec in SPECS:
+        pd.testing.assert_frame_equal(chunked[spec], whole[spec])
+
+
+def test_push_carries_partial_bar_across_chunks(tick_dir):
+    csv_dir, frames = tick_dir
+    ticks = frames['AAA']
+    times = ticks['datetime'].values.astype('datetime64[ns]').view(np.int64)
+    prices = ticks['price'].values
+    volumes = ticks['volume'].values
+    for spec in SPECS:
+        whole = make_aggregator(spec)
+        expected = [whole.push(times, prices, volumes), whole.flush()]
+        # 按不等长的块推入，块的边界落在K线的中间
+        split = make_aggregator(spec)
+        cuts = [0, 13, 14, 500, 1234, N_TICKS]
+        actual = [split.push(times[a:b], prices[a:b], volumes[a:b])
+                  for a, b in zip(cuts[:-1], cuts[1:])] + [split.flush()]
+        for k in ('datetime',) + BAR_COLUMNS:
+            np.testing.assert_array_equal(np.concatenate([p[k] for p in actual]),
+                                          np.concatenate([p[k] for p in expected]))
+
+
+@pytest.mark.parametrize('bar', SPECS)
+def test_handler_publishes_aggregated_bars(tick_dir, bar):
+    csv_dir, frames = tick_dir
+    symbols = ['AAA', 'BBB']
+    expected = dict((s, aggregate_ticks('%s/%s.csv' % (csv_dir, s), [bar])[bar])
+                    for s in symbols)
+    union = expected['AAA'].index.union(expected['BBB'].index)
+    aligned = dict((s, expected[s].reindex(union, method='pad')) for s in symbols)
+    bars = TickBarDataHandler(EventQueue(), csv_dir, symbols, bar=bar, chunksize=37,
+                              resolutions=[r for r in SPECS if r != bar])
+    published = []
+    while True:
+        bars.update_bars()
+        if not bars.continue_backtest:
+            break
+        now = bars.get_latest_datetime()
+        published.append(now)
+        for s in symbols:
+            np.testing.assert_array_equal(
+                [bars.get_latest_bar_value(s, f) for f in BAR_COLUMNS],
+                aligned[s].loc[now, list(BAR_COLUMNS)].values)
+    assert pd.DatetimeIndex(published).equals(union)
+    # 其他周期的K线在时间到达之后才发布
+    for r in bars.resolutions:
+        index = aggregate_ticks(csv_dir + '/AAA.csv', [r])[r].index
+        released = index[index <= published[-1]]
+        history = bars.get_resolution_bars(r, 'AAA', N=5)
+        assert [b.datetime for b in history] == list(released[-5:])
+
+
+@pytest.mark.parametrize('bar', ['tick:2', 'volume:150'])
+def test_bars_sharing_the_last_tick_time_get_unique_labels(tmp_path, bar):
+    # 每个时间有5笔成交，一根K线的最后一笔成交经常与前一根的时间相同
+    ticks = _ticks(3)
+    ticks['datetime'] = ticks['datetime'].values[::5].repeat(5)[:N_TICKS]
+    ticks.to_csv(str(tmp_path / 'AAA.csv'), index=False)
+    bars = aggregate_ticks(str(tmp_path / 'AAA.csv'), [bar], chunksize=7)[bar]
+    expected = _reference(ticks, bar)
+    np.testing.assert_allclose(bars[list(BAR_COLUMNS)].values,
+                               expected[list(BAR_COLUMNS)].values)
+    labels = bars.index.values.view(np.int64)
+    last = expected.index.values.astype('datetime64[ns]').view(np.int64)
+    # 标签是最后一笔成交的时间，与前一根相同时推后1纳秒
+    assert (labels != last).any()
+    assert (labels >= last).all() and (labels - last < 5).all()
+    assert (np.diff(labels) > 0).all()
+
+    handler = TickBarDataHandler(EventQueue(), str(tmp_path), ['AAA'], bar=bar, chunksize=7)
+    published = []
+    while True:
+        handler.update_bars()
+        if not handler.continue_backtest:
+            break
+        published.append(handler.get_latest_datetime())
+    assert pd.DatetimeIndex(published).equals(bars.index)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# test_vectorized.py
+
+import pandas as pd
+import pytest
+
+from conftest import CSV_DIR
+from AAPL import My_portfolio
+from benchmark import BenchmarkPortfolio, write_universe
+from execution import SimulatedExecutionHandler
+from vectorized import VectorizedBacktest
+from Strategies.MovingAverageCrossStrategy import MovingAverageCrossStrategy
+
+PARAMS = {'short_window': 10, 'long_window': 50}
+START = pd.Timestamp('2009-12-01')
+
+
+class SignalPortfolio(BenchmarkPortfolio):
+    """
+    与BenchmarkPortfolio相同，但是没有vectorized_positions，向量化回测逐个信号下单
+    """
+
+    def vectorized_positions(self, state):
+        raise NotImplementedError("Should implement vectorized_positions()")
+
+
+@pytest.fixture(scope='module', params=[(1, 0.0), (2, 0.0), (3, 0.05), (4, 0.2)],
+                ids=lambda p: 'seed%s-gap%s' % p)
+def universe(request, tmp_path_factory):
+    seed, gap = request.param
+    csv_dir = str(tmp_path_factory.mktemp('universe'))
+    return csv_dir, write_universe(csv_dir, 20, 600, gap=gap, seed=seed)
+
+
+def _vectorized(csv_dir, symbols, portfolio_cls, start=START, params=PARAMS):
+    vectorized = VectorizedBacktest(csv_dir, symbols, 100000.0, start, portfolio_cls,
+                                    MovingAverageCrossStrategy, params)
+    vectorized.run()
+    return vectorized
+
+
+@pytest.mark.parametrize('portfolio_cls', [BenchmarkPortfolio, SignalPortfolio])
+def test_validate_on_synthetic_universe(universe, portfolio_cls):
+    csv_dir, symbols = universe
+    vectorized = _vectorized(csv_dir, symbols, portfolio_cls)
+    errors = vectorized.validate(SimulatedExecutionHandler)
+    assert errors['fills'] == 0
+    assert vectorized.fills > 10 * len(symbols)
+
+
+def test_vectorized_positions_match_signal_path(universe):
+    csv_dir, symbols = universe
+    fast = _vectorized(csv_dir, symbols, BenchmarkPortfolio)
+    slow = _vectorized(csv_dir, symbols, SignalPortfolio)
+    assert (fast.signals, fast.orders, fast.fills) == (slow.signals, slow.orders, slow.fills)
+    rows = fast.portfolio.ledger_rows
+    assert (fast.portfolio.ledger_positions[:rows] == slow.portfolio.ledger_positions[:rows]).all()
+    assert (fast.portfolio.ledger_total[:rows] == slow.portfolio.ledger_total[:rows]).all()
+
+
+def test_validate_with_cash_dependent_orders():
+    # My_portfolio按当前现金决定下单数量，只能逐个信号下单
+    vectorized = _vectorized(CSV_DIR, ['AAPL'], My_portfolio, pd.Timestamp('2015-05-01'),
+                             {'short_window': 20, 'long_window': 60})
+    errors = vectorized.validate(SimulatedExecutionHandler)
+    assert errors['fills'] == 0
+    assert vectorized.fills > 0
+
+
+def test_validate_detects_mismatch(universe):
+    csv_dir, symbols = universe
+    vectorized = _vectorized(csv_dir, symbols, BenchmarkPortfolio)
+    vectorized.portfolio.ledger_cash[-1] += 1.0
+    with pytest.raises(ValueError, match='ledger_cash'):
+        vectorized.validate(SimulatedExecutionHandler)
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+# ticks.py
+
+from __future__ import print_function
+
+from abc import ABCMeta, abstractmethod
+import argparse
+from collections import deque
+import os, os.path
+
+import numpy as np
+import pandas as pd
+
+# 逐笔成交文件的列，第一列为时间，文件需要按时间升序排列
+TICK_COLUMNS = ['datetime', 'price', 'volume']
+# 聚合得到的K线的字段，与CSV文件中除时间以外的字段相同（adj_close等于close）
+BAR_COLUMNS = ('open', 'high', 'low', 'close', 'volume', 'adj_close')
+# 没有更多K线时head的值，与data._ChunkedCSVReader相同
+_EXHAUSTED = np.iinfo(np.int64).max
+
+
+class BarAggregator(object, metaclass=ABCMeta):
+    """
+    把逐笔成交增量地聚合为K线的抽象基类。每次push一块成交数据，先用向量化的方式
+    算出每笔成交所属的K线编号，再用reduceat一次性得到这一块中每根K线的OHLCV。
+    最后一根K线可能还没有结束，作为未完成的K线保留到下一块，所以只需要保存一根
+    K线的状态，不保存成交的历史。
+    K线的时间标签严格递增，分块与否不影响聚合的结果。
+    """
+
+    def __init__(self):
+        self._partial = None
+        self._last_label = np.iinfo(np.int64).min
+
+    @abstractmethod
+    def _keys(self, times, volumes):
+        """
+        返回每笔成交所属K线的编号（单调不减）
+        """
+        raise NotImplementedError("Should implement _keys()")
+
+    def _label(self, keys, last_times):
+        """
+        K线的时间标签，默认为K线中最后一笔成交的时间。同一时间有多笔成交时，
+        相邻两根K线的最后一笔成交可能时间相同，这时后一根的标签取前一根的标签
+        加1纳秒，这样DataHandler的时间索引中不会出现重复的时间
+        """
+        # L[i] = max(t[i], L[i-1] + 1)，令u[i] = L[i] - i，则u是t[i] - i的累计最大值
+        steps = np.arange(len(last_times), dtype=np.int64)
+        labels = np.maximum.accumulate(
+            np.r_[self._last_label + 1, last_times - steps])[1:] + steps
+        if len(labels):
+            self._last_label = labels[-1]
+        return labels
+
+    def push(self, times, prices, volumes):
+        """
+        加入一块按时间排列的成交（时间为int64的纳秒数），返回已经完成的K线，
+        格式为{'datetime': int64纳秒, 'open': ..., ...}的数组字典
+        """
+        if not len(times):
+            return _empty_bars()
+        keys = self._keys(times, volumes)
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        ends = np.r_[starts[1:], len(keys)] - 1
+        groups = {
+            'key': keys[starts],
+            'open': prices[starts],
+            'high': np.maximum.reduceat(prices, starts),
+            'low': np.minimum.reduceat(prices, starts),
+            'close': prices[ends],
+            'volume': np.add.reduceat(volumes, starts),
+            'last': times[ends],
+        }
+        partial = self._partial
+        if partial is not None:
+            if partial['key'] == groups['key'][0]:
+                groups['open'][0] = partial['open']
+                groups['high'][0] = max(groups['high'][0], partial['high'])
+                groups['low'][0] = min(groups['low'][0], partial['low'])
+                groups['volume'][0] += partial['volume']
+            else:
+                for k in groups:
+                    groups[k] = np.r_[partial[k], groups[k]]
+        self._partial = dict((k, v[-1]) for k, v in groups.items())
+        return self._bars(dict((k, v[:-1]) for k, v in groups.items()))
+
+    def flush(self):
+        """
+        数据结束时返回最后一根未完成的K线
+        """
+        partial, self._partial = self._partial, None
+        if partial is None:
+            return _empty_bars()
+        return self._bars(dict((k, np.array([v])) for k, v in partial.items()))
+
+    def _bars(self, groups):
+        bars = dict((k, groups[k]) for k in ('open', 'high', 'low', 'close', 'volume'))
+        bars['adj_close'] = groups['close']
+        bars['datetime'] = self._label(groups['key'], groups['last']).astype(np.int64)
+        return bars
+
+
+class TimeBars(BarAggregator):
+    """
+    按固定时间间隔（例如1s、1min、5min）聚合，标签为K线的结束时间，
+    这样在这个时间点上这根K线的数据都已经发生了（区间左闭右开，与
+    resample(period, closed='left', label='right')相同）。没有成交的时间段不产生K线。
+    """
+
+    def __init__(self, period):
+        super(TimeBars, self).__init__()
+        self.period = pd.Timedelta(period).value
+
+    def _keys(self, times, volumes):
+        return times // self.period
+
+    def _label(self, keys, last_times):
+        return (keys + 1) * self.period
+
+
+class TickBars(BarAggregator):
+    """
+    每size笔成交聚合为一根K线，标签为最后一笔成交的时间（见BarAggregator._label）
+    """
+
+    def __init__(self, size):
+        super(TickBars, self).__init__()
+        self.size = int(size)
+        self._count = 0
+
+    def _keys(self, times, volumes):
+        keys = (self._count + np.arange(len(times), dtype=np.int64)) // self.size
+        self._count += len(times)
+        return keys
+
+
+class VolumeBars(BarAggregator):
+    """
+    每成交size的量聚合为一根K线。一笔成交不会被拆开，成交之前的累计成交量
+    落在[k*size, (k+1)*size)内的成交属于第k根K线。标签为最后一笔成交的时间
+    （见BarAggregator._label）。
+    """
+
+    def __init__(self, size):
+        super(VolumeBars, self).__init__()
+        self.size = float(size)
+        self._cum = 0.0
+
+    def _keys(self, times, volumes):
+        before = self._cum + np.cumsum(volumes) - volumes
+        self._cum += volumes.sum()
+        return np.floor(before / self.size).astype(np.int64)
+
+
+def make_aggregator(spec):
+    """
+    根据字符串创建聚合对象：'1s'、'1min'、'5min'等为时间K线，
+    'tick:500'为每500笔成交的K线，'volume:10000'为每10000成交量的K线
+    """
+    kind, _, size = spec.partition(':')
+    if kind == 'tick':
+        return TickBars(size)
+    if kind == 'volume':
+        return VolumeBars(size)
+    return TimeBars(spec)
+
+
+def _empty_bars():
+    bars = dict((k, np.zeros(0)) for k in BAR_COLUMNS)
+    bars['datetime'] = np.zeros(0, dtype=np.int64)
+    return bars
+
+
+def read_ticks(path, chunksize=100000):
+    """
+    按块读取逐笔成交文件，每次返回(时间的int64纳秒数, 价格, 成交量)
+    """
+    for chunk in pd.read_csv(path, header=0, names=TICK_COLUMNS, chunksize=chunksize):
+        if not len(chunk):
+            continue
+        times = pd.to_datetime(chunk['datetime']).values.astype('datetime64[ns]').view(np.int64)
+        yield (times, chunk['price'].to_numpy(dtype=np.float64),
+               chunk['volume'].to_numpy(dtype=np.float64))
+
+
+def aggregate_ticks(path, specs, chunksize=100000):
+    """
+    读一遍逐笔成交文件，同时生成多种周期的K线，返回{spec: DataFrame}。
+    内存中只保留一块成交数据和已经生成的K线。
+    """
+    aggregators = [(spec, make_aggregator(spec)) for spec in specs]
+    parts = dict((spec, []) for spec in specs)
+    for times, prices, volumes in read_ticks(path, chunksize):
+        for spec, aggregator in aggregators:
+            parts[spec].append(aggregator.push(times, prices, volumes))
+    for spec, aggregator in aggregators:
+        parts[spec].append(aggregator.flush())
+    return dict((spec, _to_frame(parts[spec])) for spec in specs)
+
+
+def _to_frame(parts):
+    columns = dict((k, np.concatenate([p[k] for p in parts])) for k in BAR_COLUMNS)
+    index = pd.DatetimeIndex(np.concatenate([p['datetime'] for p in parts]).view('datetime64[ns]'),
+                             name='datetime')
+    return pd.DataFrame(columns, index=index, columns=list(BAR_COLUMNS))
+
+
+class TickBarReader(object):
+    """
+    按块读取一个代码的逐笔成交并聚合为K线，接口与data._ChunkedCSVReader相同
+    （head是下一根K线的时间，pop返回它的各字段并前进），供TickBarDataHandler使用。
+    extra中的其他周期用同一遍成交数据聚合，完成的K线放入pending，
+    由数据处理对象在K线的时间到达之后再发布。
+    """
+
+    def __init__(self, path, spec, chunksize=100000, extra=()):
+        self._ticks = read_ticks(path, chunksize)
+        self._aggregator = make_aggregator(spec)
+        self._extra = [(s, make_aggregator(s)) for s in extra]
+        self.pending = dict((s, deque()) for s in extra)
+        self._bars = None
+        self._pos = 0
+        self.head = _EXHAUSTED
+        self._fill()
+
+    def _fill(self):
+        """
+        读入成交数据直到至少有一根完成的K线，或者文件结束
+        """
+        while True:
+            chunk = next(self._ticks, None)
+            if chunk is None:
+                bars = self._aggregator.flush()
+                for s, aggregator in self._extra:
+                    self._queue(s, aggregator.flush())
+            else:
+                bars = self._aggregator.push(*chunk)
+                for s, aggregator in self._extra:
+                    self._queue(s, aggregator.push(*chunk))
+            if len(bars['datetime']) or chunk is None:
+                break
+        self._bars = bars
+        self._values = np.column_stack([bars[k] for k in BAR_COLUMNS]) \
+            if len(bars['datetime']) else None
+        self._pos = 0
+        self.head = bars['datetime'][0] if len(bars['datetime']) else _EXHAUSTED
+
+    def _queue(self, spec, bars):
+        pending = self.pending[spec]
+        for i in range(len(bars['datetime'])):
+            pending.append((bars['datetime'][i], tuple(bars[k][i] for k in BAR_COLUMNS)))
+
+    def pop(self):
+        values = self._values[self._pos]
+        self._pos += 1
+        if self._pos < len(self._values):
+            self.head = self._bars['datetime'][self._pos]
+        else:
+            self._fill()
+        return values
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Aggregate a tick file into bar CSV files (one pass, several resolutions)"
+    )
+    parser.add_argument('tick_file')
+    parser.add_argument('--bars', nargs='+', default=['1min'],
+                        help="e.g. 1s 1min 5min tick:500 volume:10000")
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--chunksize', type=int, default=100000)
+    args = parser.parse_args()
+    symbol = os.path.splitext(os.path.basename(args.tick_file))[0]
+    for spec, frame in aggregate_ticks(args.tick_file, args.bars, args.chunksize).items():
+        out_dir = os.path.join(args.out_dir, spec.replace(':', '_'))
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        # 写成yahoo格式（列的顺序与data.CSV_COLUMNS相同），可以直接用HistoricCSVDataHandler读取
+        frame[['high', 'low', 'open', 'close', 'volume', 'adj_close']].to_csv(
+            os.path.join(out_dir, '%s.csv' % symbol))
+        print("%s: %s bars" % (spec, len(frame)))
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+# vectorized.py
+
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+
+from backtest import Backtest
+from data import HistoricCSVDataHandler
+from event import EventQueue, SignalEvent, ib_commission
+
+
+class VectorizedBacktest(object):
+    """
+    向量化的快速回测，用于大量参数的初步筛选。
+    策略通过vectorized_signals一次性给出整个历史的目标状态，持仓、成交、佣金
+    （与FillEvent.calculate_ib_commission的规则相同）、现金和总资产都用NumPy
+    的数组运算得到。portfolio_cls实现了vectorized_positions时（下单数量不依赖于
+    现金，例如固定数量），持仓也由它一次性给出；否则只在出现信号的时刻调用一次
+    generate_naive_order来决定下单数量，所以下单规则只能依赖于信号、当前的
+    现金和持仓。订单不经过ExecutionHandler，所有订单都按信号时刻的价格全部成交。
+    结果写入Portfolio的账本，时间的对应关系与事件驱动的Backtest相同：
+    第t条数据上的成交在第t+1行才反映出来。validate可以用事件驱动的回测检查结果。
+    逐条更新的portfolio.metrics不会被更新，业绩统计使用Portfolio.summary_stats。
+    cost_model（见costs.CostModel）不为None时，每个时刻的所有成交用它的batch方法
+    一次性计算成交价格和佣金，结果与把同一个成本模型传给执行处理对象的
+    事件驱动回测相同。
+    bar_store、cache_dir和csv_format的含义与HistoricCSVDataHandler相同。
+    """
+
+    def __init__(
+            self, csv_dir, symbol_list, initial_capital, start_date,
+            portfolio_cls, strategy_cls, strategy_params=None,
+            bar_store=None, cache_dir=None, cost_model=None, csv_format=None
+    ):
+        self.csv_dir = csv_dir
+        self.symbol_list = symbol_list
+        self.initial_capital = initial_capital
+        self.start_date = start_date
+        self.portfolio_cls = portfolio_cls
+        self.strategy_cls = strategy_cls
+        self.strategy_params = strategy_params or {}
+        self.cost_model = cost_model
+
+        self.events = EventQueue()
+        self.data_handler = HistoricCSVDataHandler(self.events, csv_dir, symbol_list,
+                                                   bar_store=bar_store, cache_dir=cache_dir,
+                                                   csv_format=csv_format)
+        self.strategy = strategy_cls(self.data_handler, self.events, **self.strategy_params)
+        self.portfolio = portfolio_cls(self.data_handler, self.events, start_date,
+                                       initial_capital)
+        self.signals = 0
+        self.orders = 0
+        self.fills = 0
+
+    def _price_fills(self, rows, cols, quantity, direction, prices, columns):
+        """
+        对一组成交计算成交价格和佣金，rows和cols是成交的时刻和代码下标
+        """
+        if self.cost_model is None:
+            return prices[rows, cols], ib_commission(quantity)
+        market = self.cost_model.market_batch(columns, rows, cols)
+        return self.cost_model.batch([self.symbol_list[j] for j in cols], quantity,
+                                     prices[rows, cols], direction, market)
+
+    def _generate_fills(self, state, prices, datetimes, columns):
+        """
+        在目标状态发生变化的时刻生成订单，返回成交的
+        (时刻, 代码下标, 带方向的数量, 成交价格, 佣金)。
+        组合实现了vectorized_positions时，所有成交由持仓的差一次性得到；
+        否则逐个信号调用generate_naive_order（见_generate_fills_by_signal）。
+        """
+        prev = np.vstack((np.zeros((1, state.shape[1]), dtype=state.dtype), state[:-1]))
+        changed = state != prev
+        portfolio = self.portfolio
+        try:
+            target = portfolio.vectorized_positions(state)
+        except NotImplementedError:
+            return self._generate_fills_by_signal(state, changed, prices, datetimes, columns)
+
+        self.signals = int(changed.sum())
+        target = np.asarray(target, dtype=portfolio.position_dtype)
+        delta = np.diff(target, axis=0, prepend=np.zeros((1, target.shape[1]), target.dtype))
+        fill_t, fill_j = np.nonzero(delta)
+        signed = delta[fill_t, fill_j].astype(np.float64)
+        direction = np.sign(signed).astype(np.int64)
+        price, commission = self._price_fills(fill_t, fill_j, np.abs(signed), direction,
+                                              prices, columns)
+        if len(target):
+            portfolio.current_positions.values[:] = target[-1]
+        portfolio.current_holdings['cash'] -= (signed * price).sum() + commission.sum()
+        portfolio.current_holdings['commission'] += commission.sum()
+        self.orders = self.fills = len(fill_t)
+        return (fill_t.astype(np.intp), fill_j.astype(np.intp), signed,
+                np.asarray(price, dtype=np.float64), np.asarray(commission, dtype=np.float64))
+
+    def _generate_fills_by_signal(self, state, changed, prices, datetimes, columns):
+        """
+        逐个信号调用generate_naive_order生成订单。同一时刻的所有订单都基于这一时刻
+        成交之前的现金和持仓，这与事件队列中先处理完所有信号再处理成交的顺序一致
+        """
+        portfolio = self.portfolio
+        positions = portfolio.current_positions
+        holdings = portfolio.current_holdings
+
+        fill_t, fill_j, fill_q, fill_p, fill_c = [], [], [], [], []
+        for t in np.flatnonzero(changed.any(axis=1)):
+            bar_date = datetimes[t]
+            quantities = []
+            for j in np.flatnonzero(changed[t]):
+                target = state[t, j]
+                direction = 'EXIT' if target == 0 else ('LONG' if target > 0 else 'SHORT')
+                signal = SignalEvent(1, bar_date, self.symbol_list[j], bar_date,
+                                     direction, prices[t, j], 1.0)
+                self.signals += 1
+                order = portfolio.generate_naive_order(signal)
+                if order is None:
+                    continue
+                self.orders += 1
+                quantities.append((j, order.quantity, 1 if order.buy_or_sell == 'BUY' else -1))
+            if not quantities:
+                continue
+            idx = np.array([j for j, q, d in quantities], dtype=np.intp)
+            quantity = np.array([q for j, q, d in quantities], dtype=np.float64)
+            direction = np.array([d for j, q, d in quantities])
+            signed = quantity * direction
+            price, commission = self._price_fills(np.full(len(idx), t), idx, quantity,
+                                                  direction, prices, columns)
+            cost = signed * price
+            positions.values[idx] += signed.astype(positions.values.dtype)
+            holdings['cash'] -= cost.sum() + commission.sum()
+            holdings['commission'] += commission.sum()
+            fill_t.extend([t] * len(idx))
+            fill_j.extend(idx)
+            fill_q.extend(signed)
+            fill_p.extend(price)
+            fill_c.extend(commission)
+        self.fills = len(fill_t)
+        return (np.array(fill_t, dtype=np.intp), np.array(fill_j, dtype=np.intp),
+                np.array(fill_q, dtype=np.float64), np.array(fill_p, dtype=np.float64),
+                np.array(fill_c, dtype=np.float64))
+
+    def run(self):
+        """
+        执行向量化回测，结果写入self.portfolio的账本，返回Portfolio对象
+        """
+        store = self.data_handler.bar_store
+        prices = store.columns['adj_close']
+        T, S = prices.shape
+        state = np.asarray(self.strategy.vectorized_signals(store))
+        fill_t, fill_j, fill_q, fill_p, commission = self._generate_fills(
+            state, prices, store.index, store.columns)
+
+        # 账本的第0行是初始状态，第t+1行对应第t条数据，第t条数据上的成交
+        # 从第t+2行开始生效（超出账本的部分丢弃）
+        portfolio = self.portfolio
+        rows = T + 1
+        delta_pos = np.zeros((rows + 1, S))
+        delta_cash = np.zeros(rows + 1)
+        delta_comm = np.zeros(rows + 1)
+        traded = np.zeros(rows + 1)
+        cost = fill_q * fill_p
+        np.add.at(delta_pos, (fill_t + 2, fill_j), fill_q)
+        np.add.at(delta_cash, fill_t + 2, -(cost + commission))
+        np.add.at(delta_comm, fill_t + 2, commission)
+        np.add.at(traded, fill_t + 2, np.abs(cost))
+
+        positions = np.cumsum(delta_pos[:rows], axis=0).astype(portfolio.position_dtype)
+        market_value = np.zeros((rows, S))
+        np.multiply(positions[1:], prices, out=market_value[1:], where=positions[1:] != 0)
+        cash = self.initial_capital + np.cumsum(delta_cash[:rows])
+
+        portfolio.ledger_datetimes = np.empty(rows, dtype='datetime64[ns]')
+        portfolio.ledger_datetimes[0] = np.datetime64(self.start_date, 'ns')
+        portfolio.ledger_datetimes[1:] = store.index.values
+        portfolio.ledger_positions = positions
+        portfolio.ledger_holdings = market_value
+        portfolio.ledger_cash = cash
+        portfolio.ledger_commission = np.cumsum(delta_comm[:rows])
+        portfolio.ledger_total = cash + market_value.sum(axis=1)
+        portfolio.ledger_traded = traded[:rows]
+        portfolio.ledger_rows = rows
+        portfolio.latest_datetime = pd.Timestamp(store.index[-1]) if T else None
+        return portfolio
+
+    def validate(self, execution_handler_cls, atol=1e-6):
+        """
+        用相同的数据、策略和组合执行一次事件驱动的回测，比较两者的账本，
+        返回各项的最大误差；超过atol时抛出ValueError，异常信息中列出超过的各项。
+        策略的vectorized_signals需要与calculate_signals逐位一致（例如用
+        indicators.rolling_mean对应SMA），否则理论上相等的指标可能因为舍入误差
+        产生不同的信号。
+        """
+        if self.portfolio.ledger_rows == 1:
+            self.run()
+        backtest = Backtest(
+            self.csv_dir, self.symbol_list, self.initial_capital, 0.0, self.start_date,
+            HistoricCSVDataHandler, execution_handler_cls, self.portfolio_cls,
+            self.strategy_cls, strategy_params=self.strategy_params,
+            data_handler_params={'bar_store': self.data_handler.bar_store}, verbose=False,
+            execution_handler_params={'cost_model': self.cost_model} if self.cost_model else None
+        )
+        backtest._run_backtest()
+        expected, actual = backtest.portfolio, self.portfolio
+        if expected.ledger_rows != actual.ledger_rows:
+            raise ValueError("Ledger length mismatch: %s != %s" %
+                             (actual.ledger_rows, expected.ledger_rows))
+        rows = actual.ledger_rows
+        errors = {}
+        for name in ('ledger_positions', 'ledger_cash', 'ledger_commission', 'ledger_total'):
+            diff = np.abs(getattr(actual, name)[:rows] - getattr(expected, name)[:rows])
+            errors[name] = float(np.nanmax(diff)) if diff.size else 0.0
+        errors['fills'] = self.fills - backtest.fills
+        bad = dict((k, v) for k, v in errors.items() if abs(v) > atol)
+        if bad:
+            raise ValueError("Vectorized backtest does not match the event-driven "
+                             "backtest: %s" % bad)
+        return errors